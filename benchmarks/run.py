@@ -0,0 +1,285 @@
+#! /usr/bin/env python
+
+"""Times the buildings hot paths on synthetic inputs and records the results as JSON.
+
+  Typical usage example (from the repository root):
+
+  python -m benchmarks.run --output bench_main.json
+  python -m benchmarks.run --output bench_branch.json --compare bench_main.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_metadata, make_strains, make_titer_sheet
+from buildings.cli import COMMANDS
+from buildings.lookup import CacheReader
+from buildings.strains import StrainIndex
+from buildings.titer_block import analyze_sheet, find_titer_block, find_titer_blocks
+from buildings.uniq_merge import merge_two, write_excel
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Time the buildings hot paths on synthetic inputs and record the results as JSON."
+    )
+    parser.add_argument("--output", help="Path of the JSON results.", required=False)
+    parser.add_argument(
+        "--compare", help="Path of earlier JSON results to compare against.", required=False
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Flag benchmarks whose median time grew by more than this ratio [default: 1.25].",
+        required=False,
+    )
+    parser.add_argument(
+        "--filter", help="Only run benchmarks whose name contains this string.", required=False
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Only run the smallest case of each benchmark.", required=False
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of timed runs per case [default: 5].", required=False
+    )
+    return parser.parse_args()
+
+
+# ===== Benchmarks
+# Each benchmark maps a parameter grid to a setup function, which builds the
+# inputs for one combination of parameters and returns the function to time.
+def setup_merge_two(n_rows, n_cols, conflict_rate, sentinel_density, conflict_resolution):
+    cache_df, new_df = make_metadata(
+        n_rows=n_rows, n_cols=n_cols, conflict_rate=conflict_rate, sentinel_density=sentinel_density
+    )
+    return lambda: merge_two(cache_df, new_df, conflict_resolution=conflict_resolution)
+
+
+def setup_write_excel(n_rows, n_cols):
+    tmpdir = tempfile.TemporaryDirectory()
+    merged = merge_two(*make_metadata(n_rows=n_rows, n_cols=n_cols))
+
+    def run():
+        return write_excel(merged, f"{tmpdir.name}/merged.xlsx")
+
+    return run
+
+
+def setup_find_titer_block(n_viruses, n_sera, extra_rows):
+    worksheet = make_titer_sheet(n_viruses=n_viruses, n_sera=n_sera, extra_rows=extra_rows)
+    return lambda: find_titer_block(worksheet)
+
+
+def setup_find_titer_blocks(n_viruses, n_sera, extra_rows):
+    worksheet = make_titer_sheet(n_viruses=n_viruses, n_sera=n_sera, extra_rows=extra_rows)
+    return lambda: find_titer_blocks(worksheet)
+
+
+def setup_analyze_sheet(n_viruses, n_sera, layouts):
+    # The cells are classified in every run, with layouts the sheet matches the template of a sheet seen before
+    worksheet = make_titer_sheet(n_viruses=n_viruses, n_sera=n_sera)
+    templates = {} if layouts else None
+    if layouts:
+        analyze_sheet(make_titer_sheet(n_viruses=n_viruses, n_sera=n_sera, seed=1), layouts=templates)
+    return lambda: analyze_sheet(worksheet, layouts=templates)
+
+
+def setup_strain_index(n_strains, n_lookups):
+    # Abbreviations of catalogue strains, e.g. "A/Hong Kong/123/2019" -> "Hon/123/19"
+    names = make_strains(n_strains=n_strains)
+    index = StrainIndex(names)
+    abbrevs = [f"{x.split('/')[1][:3]}/{x.split('/')[2]}/{x.split('/')[3][2:]}" for x in names[:n_lookups]]
+    return lambda: [index.match(x) for x in abbrevs]
+
+
+def setup_cache_lookup(n_rows, n_lookups):
+    # Point lookups in a merged file through its key index, the index is built once in setup
+    tmpdir = tempfile.TemporaryDirectory()
+    path = f"{tmpdir.name}/merged.tsv"
+    names = sorted(set(make_strains(n_strains=n_rows)))
+    with open(path, "w") as fh:
+        fh.write("strain\tclade\tdate\n")
+        fh.writelines(f"{x}\tclade{i % 7}\t20{x[-2:]}-01-01\n" for i, x in enumerate(names))
+    reader = CacheReader(path)
+    keys = names[:: max(1, len(names) // n_lookups)][:n_lookups]
+
+    def run():
+        tmpdir  # Keep the files until the benchmark is done
+        return [reader.get(x) for x in keys]
+
+    return run
+
+
+def setup_cli_startup(command):
+    # A fresh interpreter per run, as workflow engines call the command line
+    argv = [sys.executable, "-m", "buildings"] + ([command] if command else []) + ["--help"]
+    return lambda: subprocess.run(argv, stdout=subprocess.DEVNULL, check=True)
+
+
+BENCHMARKS = {
+    "merge_two": (
+        setup_merge_two,
+        {
+            "n_rows": [10000, 100000],
+            "n_cols": [20],
+            "conflict_rate": [0.05, 0.3],
+            "sentinel_density": [0.05],
+            "conflict_resolution": ["left", "join"],
+        },
+    ),
+    "write_excel": (
+        setup_write_excel,
+        {
+            "n_rows": [1000, 10000],
+            "n_cols": [20],
+        },
+    ),
+    "find_titer_block": (
+        setup_find_titer_block,
+        {
+            "n_viruses": [40, 400],
+            "n_sera": [12, 48],
+            "extra_rows": [10],
+        },
+    ),
+    "find_titer_blocks": (
+        setup_find_titer_blocks,
+        {
+            "n_viruses": [40, 400, 4000],
+            "n_sera": [12, 48],
+            "extra_rows": [10],
+        },
+    ),
+    "analyze_sheet": (
+        setup_analyze_sheet,
+        {
+            "n_viruses": [40, 400],
+            "n_sera": [12, 48],
+            "layouts": [False, True],
+        },
+    ),
+    "strain_index": (
+        setup_strain_index,
+        {
+            "n_strains": [10000, 500000],
+            "n_lookups": [1000],
+        },
+    ),
+    "cache_lookup": (
+        setup_cache_lookup,
+        {
+            "n_rows": [10000, 1000000],
+            "n_lookups": [1000],
+        },
+    ),
+    "cli_startup": (
+        setup_cli_startup,
+        {
+            "command": [None] + list(COMMANDS),
+        },
+    ),
+}
+
+
+def _cases(grid: dict, quick: bool):
+    """Yields each combination of parameters of a grid, only the first one if quick."""
+    for values in product(*grid.values()):
+        yield dict(zip(grid.keys(), values))
+        if quick:
+            return
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(name_filter: str = None, quick: bool = False, repeat: int = 5) -> dict:
+    """Runs the benchmarks, returning their timings with a description of the environment."""
+    results = []
+    for name, (setup, grid) in BENCHMARKS.items():
+        if name_filter and name_filter not in name:
+            continue
+        for params in _cases(grid, quick):
+            func = setup(**params)
+            func()  # warm up
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+            result = {
+                "name": name,
+                "params": params,
+                "min": min(times),
+                "median": float(np.median(times)),
+                "mean": float(np.mean(times)),
+                "repeat": repeat,
+            }
+            print(f"{name} {params}: median {result['median']:.4f}s", file=sys.stderr)
+            results.append(result)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns (name, params, ratio) for every case whose median time grew by more than threshold."""
+    key = lambda x: (x["name"], json.dumps(x["params"], sort_keys=True))
+    baseline = {key(x): x for x in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"]
+        print(f"{result['name']} {result['params']}: {ratio:.2f}x", file=sys.stderr)
+        if ratio > threshold:
+            regressions.append((result["name"], result["params"], ratio))
+    return regressions
+
+
+def main():
+    args = parse_args()
+
+    results = run_benchmarks(name_filter=args.filter, quick=args.quick, repeat=args.repeat)
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            regressions = compare(results, json.load(fh), args.threshold)
+        for name, params, ratio in regressions:
+            print(f"Regression: {name} {params} is {ratio:.2f}x slower", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Synthetic inputs for the benchmarks (and tests) of the buildings hot paths.
+
+  Typical usage example:
+
+  cache_df, new_df = make_metadata(n_rows=100000, conflict_rate=0.1)
+  merged_df = merge_two(cache_df, new_df)
+
+  worksheet = make_titer_sheet(n_viruses=40, n_sera=12)
+  titer_block = find_titer_block(worksheet)
+
+  index = StrainIndex(make_strains(n_strains=100000))
+"""
+import numpy as np
+import pandas as pd
+
+SENTINELS = [np.nan, "-N/A-", "?"]
+TITERS = ["< 10", 10.0, 20.0, 40.0, 80.0, 160.0, 320.0, 640.0, 1280.0, 2560.0]
+LOCATIONS = ["Victoria", "Sydney", "Darwin", "Perth", "Brisbane", "Singapore", "Auckland", "Fiji"]
+PASSAGES = ["MDCK1", "MDCK2", "SIAT1", "SIAT3", "E3", "E5"]
+
+
+def _vocab(rng: np.random.Generator, col: int, n_rows: int) -> np.ndarray:
+    """Values of a metadata column, from a date-like column to low cardinality clade or geo-like columns."""
+    if col % 4 == 0:
+        days = rng.integers(0, 3 * 365, n_rows)
+        return (np.datetime64("2022-01-01") + days).astype(str).astype(object)
+    cardinality = [5, 50, 500][col % 3]
+    return np.array([f"c{col}_v{i}" for i in range(cardinality)], dtype=object)[
+        rng.integers(0, cardinality, n_rows)
+    ]
+
+
+def make_metadata(
+    n_rows: int = 10000,
+    n_cols: int = 20,
+    overlap: float = 0.3,
+    conflict_rate: float = 0.05,
+    sentinel_density: float = 0.05,
+    seed: int = 0,
+) -> tuple:
+    """Generates a (cache, new) pair of metadata DataFrames of strings, as read by uniq_merge.main.
+
+    Args:
+      n_rows:
+        Number of rows in each DataFrame
+      n_cols:
+        Number of value columns in each DataFrame. The new DataFrame shares three quarters of them and adds its own.
+      overlap:
+        Fraction of the new strains that are already in the cache
+      conflict_rate:
+        Fraction of the shared (strain, column) cells where the new value differs from the cached one
+      sentinel_density:
+        Fraction of cells holding NaN, "-N/A-" or "?"
+      seed:
+        Seed of the random generator
+
+    Returns:
+      A (cache_df, new_df) tuple of DataFrames with a 'strain' column.
+    """
+    rng = np.random.default_rng(seed)
+    cols = [f"col{i}" for i in range(n_cols + n_cols // 4)]
+    cache_cols, new_cols = cols[:n_cols], cols[n_cols // 4:]
+
+    cache_strains = np.array([f"A/{LOCATIONS[i % len(LOCATIONS)]}/{i}/2022" for i in range(n_rows)], dtype=object)
+    n_shared = int(overlap * n_rows)
+    shared = rng.choice(n_rows, n_shared, replace=False)
+    new_strains = np.concatenate(
+        [
+            cache_strains[shared],
+            np.array([f"A/{LOCATIONS[i % len(LOCATIONS)]}/{i}/2023" for i in range(n_rows - n_shared)], dtype=object),
+        ]
+    )
+
+    cache_df = pd.DataFrame({"strain": cache_strains})
+    new_df = pd.DataFrame({"strain": new_strains})
+    for i, col in enumerate(cols):
+        if col in cache_cols:
+            cache_df[col] = _vocab(rng, i, n_rows)
+        if col in new_cols:
+            values = _vocab(rng, i, n_rows)
+            if col in cache_cols:
+                # Shared strains agree with the cache unless they conflict
+                agree = rng.random(n_shared) >= conflict_rate
+                values[:n_shared][agree] = cache_df[col].to_numpy()[shared][agree]
+            new_df[col] = values
+
+    for df in (cache_df, new_df):
+        for col in df.columns[1:]:
+            is_sentinel = rng.random(len(df)) < sentinel_density
+            df.loc[is_sentinel, col] = rng.choice(np.array(SENTINELS, dtype=object), is_sentinel.sum())
+    return cache_df, new_df
+
+
+class Sheet:
+    """Minimal in-memory stand-in for an xlrd worksheet, with the name, nrows, ncols, cell_value and row_values used by titer_block."""
+
+    def __init__(self, rows: list, name: str = "Sheet1"):
+        self.name = name
+        self.rows = rows
+        self.nrows = len(rows)
+        self.ncols = max((len(x) for x in rows), default=0)
+        for row in rows:
+            row.extend([""] * (self.ncols - len(row)))
+
+    def cell_value(self, rowx: int, colx: int):
+        return self.rows[rowx][colx]
+
+    def row_values(self, rowx: int) -> list:
+        return self.rows[rowx]
+
+
+def make_titer_sheet(
+    n_viruses: int = 20,
+    n_sera: int = 10,
+    row_offset: int = 6,
+    col_offset: int = 3,
+    extra_rows: int = 5,
+    extra_cols: int = 3,
+    seed: int = 0,
+    name: str = "Sheet1",
+) -> Sheet:
+    """Generates a VIDRL-like HI titer worksheet.
+
+    The titer block is n_viruses rows by n_sera columns. Above it are the
+    abbreviated serum names, serum passages and serum IDs, to its left the full
+    virus names and to its right the virus passages. The first n_sera viruses
+    are the reference antigens of the sera, in order.
+
+    Args:
+      n_viruses:
+        Number of antigen rows in the titer block
+      n_sera:
+        Number of antisera columns in the titer block
+      row_offset:
+        Index of the first row of the titer block, at least 3
+      col_offset:
+        Index of the first column of the titer block, at least 2
+      extra_rows:
+        Number of footnote rows below the block
+      extra_cols:
+        Number of annotation columns right of the block, the first holds the virus passages
+      seed:
+        Seed of the random generator
+      name:
+        Name of the worksheet
+
+    Returns:
+      A Sheet.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = row_offset + n_viruses + extra_rows
+    n_cols = col_offset + n_sera + max(1, extra_cols)
+    rows = [[""] * n_cols for _ in range(n_rows)]
+    rows[0][0] = "HAEMAGGLUTINATION INHIBITION REPORT"
+
+    for i in range(n_viruses):
+        row = rows[row_offset + i]
+        location = LOCATIONS[i % len(LOCATIONS)]
+        row[col_offset - 2] = float(i + 1)
+        row[col_offset - 1] = f"A/{location}/{100 + i}/2022"
+        for j in range(n_sera):
+            row[col_offset + j] = TITERS[rng.integers(len(TITERS))]
+        row[col_offset + n_sera] = PASSAGES[rng.integers(len(PASSAGES))]
+
+    for j in range(n_sera):
+        location = LOCATIONS[j % len(LOCATIONS)]
+        rows[row_offset - 3][col_offset + j] = f"{location[:3]}/{100 + j}/22"
+        rows[row_offset - 2][col_offset + j] = PASSAGES[rng.integers(len(PASSAGES))]
+        rows[row_offset - 1][col_offset + j] = f"F{rng.integers(1000, 99999):05d}"
+
+    for i in range(extra_rows):
+        rows[row_offset + n_viruses + i][0] = f"Footnote {i + 1}"
+    return Sheet(rows, name=name)
+
+
+def make_strains(n_strains: int = 100000, seed: int = 0) -> list:
+    """Generates full strain names, e.g. "A/Sydney/1234/2019", spread over the LOCATIONS and ten years."""
+    rng = np.random.default_rng(seed)
+    locations = np.array(LOCATIONS + ["Hong Kong", "New Caledonia", "South Australia"], dtype=object)
+    return [
+        f"{kind}/{location}/{isolate}/{year}"
+        for kind, location, isolate, year in zip(
+            rng.choice(["A", "B"], n_strains),
+            rng.choice(locations, n_strains),
+            rng.integers(1, 5000, n_strains),
+            rng.integers(2015, 2025, n_strains),
+        )
+    ]
@@ -0,0 +1,6 @@
+"""Run the buildings command line as `python -m buildings <command> [options]`."""
+import sys
+
+from buildings.cli import main
+
+sys.exit(main())
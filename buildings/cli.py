@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+
+"""Single entry point of the buildings tools, run as `buildings <command> [options]`.
+
+Each command is a module of the package whose main() parses the options
+following the command. A module is only imported when its command runs, so
+`buildings --help` and the small commands do not pay for pandas, numpy or
+Pillow. The options of the commands importing pandas or numpy are parsed
+before the import (see buildings.options), so their --help is as fast.
+
+  Typical usage example:
+
+  buildings merge --cache cache.tsv --new new.tsv --outfile merged.tsv
+  buildings lookup --cache merged.tsv --strains A/Sydney/101/2022
+  buildings titer-block --files 'HI/*.xlsx' --output results.tsv
+  buildings resize --imgs 'imgs/*.jpg' --widths 400 800
+  buildings merge --help
+"""
+import argparse
+import importlib
+import sys
+
+# Command: (module running it, description)
+COMMANDS = {
+    "merge": ("buildings.uniq_merge", "Harmonize and merge data tables such that conflicting data is not lost."),
+    "lookup": ("buildings.lookup", "Fetch the rows of some strains from a merged file through its key index."),
+    "titer-block": ("buildings.titer_block", "Find the blocks of titers in Excel worksheets."),
+    "resize": ("buildings.resize", "Resize images, optionally to several widths and formats."),
+    "mk-wdl": ("buildings.mk_wdl_task", "Take a script, return a WDL task."),
+    "mk-nf": ("buildings.mk_nf_process", "Take a script, return a Nextflow process."),
+    "mk-buildyaml": ("buildings.mk_buildyaml", "Take a sequence and metadata file pair, return a basic build.yaml."),
+}
+
+# Parsers (in buildings.options) of the commands whose module imports pandas or numpy, run before importing it
+PARSERS = {
+    "merge": "merge_parser",
+    "titer-block": "titer_block_parser",
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="buildings",
+        description="Data wrangling tools. Run 'buildings <command> --help' for the options of a command.",
+        epilog="commands:\n" + "\n".join(f"  {name:<14}{description}" for name, (_, description) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command", help="One of the commands below.")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Options of the command.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # The command parses sys.argv itself, named after the command in its usage and errors
+    saved_argv = sys.argv
+    sys.argv = [f"buildings {args.command}"] + args.args
+    try:
+        if args.command in PARSERS:
+            from buildings import options
+
+            getattr(options, PARSERS[args.command])().parse_args()
+        module = importlib.import_module(COMMANDS[args.command][0])
+        return module.main()
+    finally:
+        sys.argv = saved_argv
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Per-stage timings, peak memory, counts and profiles for the buildings command line tools.
+
+Every CLI adds the options with add_arguments and wraps its work in run, which
+reports the stages when --timings or --timings_json is given and profiles the
+whole run when --profile is given. Stages are no-ops when the options are off.
+
+  Typical usage example:
+
+  parser = argparse.ArgumentParser()
+  add_arguments(parser)
+  args = parser.parse_args()
+
+  with run(args) as timings:
+      with timings.stage("read") as counts:
+          df = pd.read_csv(path)
+          counts["rows"] = len(df)
+"""
+import contextlib
+import cProfile
+import json
+import pstats
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def add_arguments(parser):
+    """Adds the --timings, --timings_json and --profile options to an argparse parser."""
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print the wall time, peak memory and counts of each stage to stderr",
+    )
+    group.add_argument(
+        "--timings_json",
+        required=False,
+        help="Write the wall time, peak memory and counts of each stage to this JSON file",
+    )
+    group.add_argument(
+        "--profile",
+        required=False,
+        help="Profile the run with cProfile, write the stats to this file and print the top functions to stderr",
+    )
+    return parser
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident memory of the process so far, in MB (None where unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+class Timings:
+    """Collects the wall time, peak memory and counts of the stages of a run.
+
+    Stages are recorded in order. A stage entered several times (e.g. once per
+    file) accumulates its time, calls and counts.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def _stage(self, name: str):
+        counts = {}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "peak_rss_mb": None, "counts": {}})
+            stage["seconds"] += seconds
+            stage["calls"] += 1
+            stage["peak_rss_mb"] = peak_rss_mb()
+            for key, value in counts.items():
+                stage["counts"][key] = stage["counts"].get(key, 0) + value
+
+    def stage(self, name: str):
+        """Returns a context manager timing a stage, which yields a dict of counts to fill (e.g. rows, cells, images)."""
+        if not self.enabled:
+            return contextlib.nullcontext({})
+        return self._stage(name)
+
+    def to_dict(self) -> dict:
+        """Returns the stages and the peak memory of the run, JSON serializable."""
+        return {"stages": self.stages, "peak_rss_mb": peak_rss_mb()}
+
+    def report(self, file=None):
+        """Prints one line per stage, to stderr by default."""
+        file = file or sys.stderr
+        for name, stage in self.stages.items():
+            counts = " ".join(f"{key}={value}" for key, value in stage["counts"].items())
+            calls = f" x{stage['calls']}" if stage["calls"] > 1 else ""
+            peak = "" if stage["peak_rss_mb"] is None else f"  peak {stage['peak_rss_mb']:.0f} MB"
+            print(f"{name:<20} {stage['seconds']:9.3f}s{calls}{peak}  {counts}".rstrip(), file=file)
+
+
+@contextlib.contextmanager
+def run(args):
+    """Instruments a run of a CLI from its parsed --timings, --timings_json and --profile options.
+
+    Args:
+      args:
+        argparse namespace, missing options count as off
+
+    Yields:
+      The Timings of the run, disabled unless --timings or --timings_json is given.
+    """
+    timings = Timings(enabled=bool(getattr(args, "timings", False) or getattr(args, "timings_json", None)))
+    profile = getattr(args, "profile", None)
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        yield timings
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(20)
+        if getattr(args, "timings", False):
+            timings.report()
+        if getattr(args, "timings_json", None):
+            with open(args.timings_json, "w") as fh:
+                json.dump(timings.to_dict(), fh, indent=2)
@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+
+"""Fetch the rows of a few strains from a merged file without reading the rest of it.
+
+A merged file written by uniq_merge (one row per key, in sorted order) can keep
+a key index next to it (<file>.idx, see uniq_merge.write_cache_index), which
+lists the byte offset and length of each row in key order. Both files are
+memory mapped and the index is binary searched, so a lookup touches a few
+pages of each whatever their size, and neither is parsed as a whole.
+
+  Typical usage example:
+
+  with CacheReader("merged_cache_new.tsv") as reader:
+      row = reader.get("A/Sydney/101/2022")  # raw bytes of the row, or None
+      df = reader.lookup(["A/Sydney/101/2022", "A/Perth/3/2022"])
+
+  python buildings/lookup.py --cache merged_cache_new.tsv --strains A/Sydney/101/2022 A/Perth/3/2022
+"""
+import argparse
+import io
+import mmap
+import os
+import sys
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fetch the rows of some strains from a merged file through its key index."
+    )
+    parser.add_argument(
+        "--cache",
+        help="Merged file written by uniq_merge, its key index (<cache>.idx) is built if missing or stale.",
+        required=True,
+    )
+    parser.add_argument(
+        "--strains",
+        nargs="+",
+        help="Strains to fetch.",
+        required=False,
+    )
+    parser.add_argument(
+        "--strain_file",
+        help="File listing the strains to fetch, one per line.",
+        required=False,
+    )
+    parser.add_argument(
+        "--groupby_col",
+        default="strain",
+        help="Group by column name of the merged file [default 'strain'].",
+        required=False,
+    )
+    parser.add_argument(
+        "--delim",
+        default="\t",
+        help="Delimiter of the merged file.",
+        required=False,
+    )
+    parser.add_argument(
+        "--outfile",
+        help="Write the header and the rows found to this file [default: stdout].",
+        required=False,
+    )
+    return parser.parse_args()
+
+
+def index_path(path: str) -> str:
+    """Path of the key index kept next to a merged file."""
+    return path + ".idx"
+
+
+def index_stamp(path: str) -> str:
+    """Size and modification time of a merged file, written first in its key index to detect a stale index."""
+    st = os.stat(path)
+    return f"#{st.st_size}\t{st.st_mtime_ns}\n"
+
+
+class CacheReader:
+    """Random access to the rows of a merged file by key, through its memory mapped key index.
+
+    The index is built (see uniq_merge.write_cache_index) if it is missing or
+    older than the file.
+    """
+
+    def __init__(self, path: str, groupby_col: str = "strain", delim: str = "\t"):
+        self.path = path
+        self.delim = delim
+        idx_path = index_path(path)
+        fresh = False
+        if os.path.exists(idx_path):
+            with open(idx_path) as fh:
+                fresh = fh.readline() == index_stamp(path)
+        if not fresh:
+            # pandas is only needed to (re)build the index
+            try:
+                from buildings.uniq_merge import write_cache_index
+            except ImportError:  # Run as a script, python buildings/lookup.py
+                from uniq_merge import write_cache_index
+            write_cache_index(path, groupby_col=groupby_col, delim=delim)
+
+        with open(path, "rb") as fh:
+            self._data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(idx_path, "rb") as fh:
+            self._index = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = self._data[: self._data.find(b"\n") + 1]
+        # Skip the stamp and the header of the index
+        self._start = self._index.find(b"\n", self._index.find(b"\n") + 1) + 1
+
+    def _find(self, key: bytes) -> tuple:
+        """Binary searches the lines of the index for key, returning the (offset, length) of its row or None."""
+        index = self._index
+        lo, hi = self._start, len(index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = max(lo, index.rfind(b"\n", lo, mid) + 1)
+            line_end = index.find(b"\n", line_start)
+            if line_end < 0:
+                line_end = len(index)
+            fields = index[line_start:line_end].rstrip(b"\r").split(b"\t")
+            if fields[0] == key:
+                return int(fields[1]), int(fields[2])
+            if fields[0] < key:
+                lo = line_end + 1
+            else:
+                hi = line_start
+        return None
+
+    def get(self, key: str) -> bytes:
+        """Returns the row of key as raw bytes, line ending included, or None if the file has no such key."""
+        found = self._find(key.encode())
+        if found is None:
+            return None
+        offset, length = found
+        return self._data[offset: offset + length]
+
+    def lookup(self, keys: list):
+        """Reads the rows of keys as a DataFrame of strings (like read_table), in key order, skipping missing keys."""
+        import pandas as pd
+
+        rows = [self.get(key) for key in sorted(set(keys))]
+        data = self.header + b"".join(x for x in rows if x is not None)
+        return pd.read_csv(io.BytesIO(data), sep=self.delim, header=0, dtype=str)
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    args = parse_args()
+    keys = list(args.strains or [])
+    if args.strain_file:
+        with open(args.strain_file) as fh:
+            keys += [line.strip() for line in fh if line.strip()]
+    if not keys:
+        raise ValueError("Give the strains to fetch with --strains or --strain_file")
+
+    missing = []
+    with CacheReader(args.cache, groupby_col=args.groupby_col, delim=args.delim) as reader:
+        out = open(args.outfile, "wb") if args.outfile else sys.stdout.buffer
+        try:
+            out.write(reader.header)
+            for key in keys:
+                row = reader.get(key)
+                if row is None:
+                    missing.append(key)
+                else:
+                    out.write(row)
+        finally:
+            if args.outfile:
+                out.close()
+            else:
+                out.flush()
+    if missing:
+        print(f"Not found: {', '.join(missing)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,11 @@ import argparse
 
 def parse_args():
     parser = argparse.ArgumentParser(
-        description = "Take a script, return a wdl task"
+        description = "Take a script, return a Nextflow process"
     )
     parser.add_argument(
         "--script",
-        help = "The sequence fasta file.",
+        help = "The script run by the process.",
         required = True
     )
     parser.add_argument(
@@ -20,14 +20,14 @@ def parse_args():
     return parser.parse_args()
 
 nf_text = """
-process {name} {
+process {name} {{
   input: 
   output: 
   scripts:
   \"\"\"
   {script}
   \"\"\"
-}
+}}
 """
 
 def mk_nf_task(script, name="example"):
@@ -35,7 +35,7 @@ def mk_nf_task(script, name="example"):
 
 def main():
     args = parse_args()
-    mk_nf_process(args.script, args.docker)
+    mk_nf_task(args.script)
 
 if __name__ == "__main__":
     main()
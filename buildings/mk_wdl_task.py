@@ -9,7 +9,7 @@ def parse_args():
     )
     parser.add_argument(
         "--script",
-        help = "The sequence fasta file.",
+        help = "The script run by the task.",
         required = True
     )
     parser.add_argument(
@@ -20,18 +20,18 @@ def parse_args():
     return parser.parse_args()
 
 wdl_text = """
-task {name} {
-  input {
-  }
-  ouptut {
-  }
-  command {
+task {name} {{
+  input {{
+  }}
+  output {{
+  }}
+  command {{
     {script}
-  }
-  runtime {
+  }}
+  runtime {{
     docker: {docker}
-  }
-}
+  }}
+}}
 """
 
 def mk_wdl_task(script, docker, name="example"):
@@ -0,0 +1,200 @@
+"""Command line options of the commands whose modules import pandas or numpy.
+
+The parsers live apart from the modules running the commands, so that the
+buildings command line parses the options first: --help and bad options
+return without importing the heavy dependencies. Each module parses its own
+options through the same parser.
+
+  Typical usage example:
+
+  args = merge_parser().parse_args()
+"""
+import argparse
+
+try:
+    from buildings import instrument
+except ImportError:  # Run as a script, python buildings/uniq_merge.py
+    import instrument
+
+# Values standing for missing data besides NA, masked before resolving conflicts, see uniq_merge
+SENTINELS = ("", "-N/A-", "?")
+
+
+def merge_parser():
+    """Options of uniq_merge, run as buildings merge."""
+    parser = argparse.ArgumentParser(
+        description="Harmonize and merge pandas DataTables such that conflicting data is not lost."
+    )
+    parser.add_argument(
+        "--cache",
+        help="Path to cache of cleaned data, read as Parquet or Feather for .parquet/.pq or .feather/.arrow extensions.",
+        required=True,
+    )
+    parser.add_argument(
+        "--new",
+        action="append",
+        help="Path to new data, repeat to merge several files in order of precedence.",
+        required=True,
+    )
+    parser.add_argument(
+        "--cache_delim",
+        default="\t",
+        help="delimiter for cache of cleaned data.",
+        required=False,
+    )
+    parser.add_argument(
+        "--new_delim", default="\t", help="delimiter for new data.", required=False
+    )
+    parser.add_argument(
+        "--outfile",
+        default="merged_cache_new.tsv",
+        help="Merged file, written as Parquet or Feather for .parquet/.pq or .feather/.arrow extensions [default: merged_cache_new.tsv].",
+        required=False,
+    )
+    parser.add_argument(
+        "--outfile_excel",
+        help="Merged Excel file, only written if given. Rows past the Excel row limit continue on new sheets.",
+        required=False,
+    )
+    parser.add_argument(
+        "--outfile_delim",
+        default="\t",
+        help="delimiter for outfile data.",
+        required=False,
+    )
+    parser.add_argument(
+        "--groupby_col",
+        default="strain",
+        help="Group by column name [default 'strain'].",
+        required=False,
+    )
+    parser.add_argument(
+        "--conflict_resolution",
+        choices=["left", "right", "join"],
+        default="join",
+        help="Specify how to handle conflicting values [default: 'join'].",
+        required=False,
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Also write the key index of --outfile (<outfile>.idx), to fetch strains from it with buildings lookup. "
+        "Always written with --incremental.",
+        required=False,
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-resolve strains found in --new and splice them into --cache, which must be a previous --outfile. "
+        "Keeps a key index next to the cache (<cache>.idx) and skips the Excel output.",
+        required=False,
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes resolving conflicts in the in-memory merge [default: 1].",
+        required=False,
+    )
+    parser.add_argument(
+        "--max_memory",
+        type=float,
+        help="Stream the merge through spill files, keeping memory use to roughly this many MB. Skips the Excel output.",
+        required=False,
+    )
+    parser.add_argument(
+        "--tmpdir",
+        help="Directory for the spill files of --max_memory [default: system temp dir].",
+        required=False,
+    )
+    parser.add_argument(
+        "--conflicts",
+        help="Write the conflicting values, with the file each came from, to this file "
+        "(one row per strain, column and distinct value, same formats as --outfile).",
+        required=False,
+    )
+    parser.add_argument(
+        "--sentinels",
+        nargs="*",
+        default=list(SENTINELS),
+        help="Values standing for missing data, besides empty cells. Columns holding nothing else are dropped "
+        "and these values never conflict [default: '' '-N/A-' '?'].",
+        required=False,
+    )
+
+    instrument.add_arguments(parser)
+    return parser
+
+
+def titer_block_parser():
+    """
+    Options of titer_block, run as buildings titer-block. titer_block.parse_args checks --source against its PATTERNS.
+    """
+    parser = argparse.ArgumentParser(
+        description="Find the block of titers in an Excel worksheet.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--file",
+        default="~/nextstrain/fludata/VIDRL-Melbourne-WHO-CC/raw-data/A/H1N1pdm/HI/2024/20240528H1N1.xlsx",
+        required=False,
+        help="Path to the Excel file",
+    )
+    parser.add_argument(
+        "--source",
+        default="vidrl",
+        help="Data source, selects the patterns used to find the virus and serum annotations (see titer_block.PATTERNS)",
+    )
+    parser.add_argument(
+        "--files",
+        nargs="+",
+        required=False,
+        help="Batch mode: paths or glob patterns of Excel files, processed instead of --file",
+    )
+    parser.add_argument(
+        "--file_list",
+        required=False,
+        help="Batch mode: file listing one Excel file per line, processed instead of --file",
+    )
+    parser.add_argument(
+        "--output",
+        required=False,
+        help="Batch mode: results file, TSV (one row per sheet) for a .tsv extension and JSON otherwise. Defaults to JSON on stdout",
+    )
+    parser.add_argument(
+        "--cache",
+        required=False,
+        help="Batch mode: JSON file of results by file content hash, files that did not change are not parsed again",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Batch mode: number of processes parsing workbooks",
+    )
+    parser.add_argument(
+        "--strains",
+        required=False,
+        help="Reference strain catalogue (TSV with a strain column, or one name per line), resolves the abbreviated "
+        "serum names without a virus row in the sheet",
+    )
+    parser.add_argument(
+        "--subtype",
+        required=False,
+        help="Only map sera to --strains strains of this subtype, e.g. H3N2 (catalogue subtype column, strains of "
+        "unknown subtype are kept). Sera are always mapped to strains of the type of the sheet's viruses",
+    )
+    parser.add_argument(
+        "--layouts",
+        required=False,
+        help="Batch mode: JSON file of sheet layouts, sheets laid out like sheets seen before skip the full titer block "
+        "detection. Updated with the layouts of the parsed sheets",
+    )
+    parser.add_argument(
+        "--titers",
+        required=False,
+        help="Extract every titer of --file or the batch files to this file, one record per (virus, serum, titer), "
+        "as Parquet for a .parquet extension and TSV otherwise. Does not take --jobs or --cache",
+    )
+    instrument.add_arguments(parser)
+    return parser
@@ -4,8 +4,16 @@
 import sys
 import argparse
 import os
+import concurrent.futures
+import hashlib
+import json
+from collections import Counter
 from glob import glob
-from PIL import Image
+
+try:
+  from buildings import instrument
+except ImportError: # Run as a script, python buildings/resize.py
+  import instrument
 
 # (2) Define command line arguments
 def parse_args():
@@ -19,38 +27,257 @@ def parse_args():
         help = "Path to image or images.",
         required = True
     )
+    parser.add_argument(
+        "--new_width",
+        help = "Width of the resized images, in pixels [default: 800].",
+        type = int,
+        default = 800
+    )
+    parser.add_argument(
+        "--outdir",
+        help = "Folder of the resized images [default: resized].",
+        default = "resized"
+    )
+    parser.add_argument(
+        "--widths",
+        help = "Resize each image to all these widths from a single decode, into one folder of --outdir per width, instead of --new_width.",
+        nargs = "+",
+        type = int,
+        default = None
+    )
+    parser.add_argument(
+        "--format",
+        help = "Format of the resized images, e.g. jpeg, png or webp, or one format per --widths [default: same as the source].",
+        nargs = "+",
+        default = None
+    )
+    parser.add_argument(
+        "--quality",
+        help = "Quality of the resized JPEG or WebP images, 1-100, or one quality per --widths [default: Pillow's].",
+        nargs = "+",
+        type = int,
+        default = None
+    )
+    parser.add_argument(
+        "--incremental",
+        help = "Only resize images that changed since the last run, as recorded in the manifest of --outdir, and remove the outputs of deleted images.",
+        action = "store_true"
+    )
+    parser.add_argument(
+        "--jobs",
+        help = "Number of processes resizing images [default: 1].",
+        type = int,
+        default = 1
+    )
+    instrument.add_arguments(parser)
 
     return parser.parse_args()
 
 # (3) Reusable functions
-def resize_800width(imgfile:str, outdir:str = 'resized', new_width:int = 800):
+def output_path(imgfile:str, outdir:str = 'resized', format:str = None) -> str:
+  # Same file name in outdir, with the extension of format if given
+  name = os.path.basename(imgfile)
+  if format:
+    name = os.path.splitext(name)[0] + {'jpeg': '.jpg'}.get(format.lower(), '.' + format.lower())
+  return os.path.join(outdir, name)
+
+def pillow_format(format:str) -> str:
+  # Pillow's name of an output format given by name or extension, e.g. 'jpg' -> 'JPEG', 'tif' -> 'TIFF'
+  from PIL import Image
+  name = Image.registered_extensions().get('.' + format.lower(), format.upper())
+  if name not in Image.SAVE:
+    raise ValueError(f"Unknown image format '{format}', expected one of: {', '.join(sorted(Image.SAVE)).lower()}")
+  return name
+
+def resize_pyramid(imgfile:str, outdirs:list, widths:list, formats:list, qualities:list) -> list:
+  # Resize one image to several widths from a single decode, the i-th size into outdirs[i], which must exist
+  # Sizes are made from the largest down, each resampled from the previous one. Returns the outputs, in the order of widths
+  from PIL import Image # Imported on first use, keeps the startup of the command line fast
   img = Image.open(imgfile)
+  width, height = img.size
+  ratio = height / width
+  portrait = width <= height # Ignore landscaped items
+
+  # JPEGs are decoded at the smallest scale (1/2, 1/4, 1/8) still larger than the largest output
+  # unless an output keeps the full size (smaller image than its width)
+  if portrait and width >= max(widths):
+    img.draft('RGB', (max(widths), int(ratio * max(widths))))
   if img.mode != 'RGB':
     img = img.convert('RGB')
-  width, height = img.size
-  
-  if width > height: # Ignore landscaped items
-    new_img = img
-  elif width < 800:  # Ignore smaller images
-    new_img = img
-  else:              # Resize image
-    ratio = height / width
-    new_height = int(ratio * new_width)
-    new_img = img.resize((new_width, new_height))
 
+  outputs = [None] * len(widths)
+  new_img = img
+  for i in sorted(range(len(widths)), key = lambda i: -widths[i]):
+    if portrait and width >= widths[i]: # Ignore smaller images
+      new_img = new_img.resize((widths[i], int(ratio * widths[i])))
+    outputs[i] = output_path(imgfile, outdirs[i], formats[i])
+    options = {} if qualities[i] is None else {'quality': qualities[i]}
+    new_img.save(outputs[i], format = pillow_format(formats[i]) if formats[i] else None, **options)
+  return outputs
+
+def resize_image(imgfile:str, outdir:str = 'resized', new_width:int = 800, format:str = None, quality:int = None) -> str:
+  # Resize one image into outdir, which must exist, and return the path of the output
+  return resize_pyramid(imgfile, [outdir], [new_width], [format], [quality])[0]
+
+def pyramid_sizes(outdir:str, widths:list, format = None, quality = None) -> tuple:
+  # Output folders, formats and qualities of each width: one folder of outdir per width
+  # format and quality are either one value for all widths, or one value per width
+  per_width = lambda x: list(x) if isinstance(x, (list, tuple)) else [x] * len(widths)
+  formats, qualities = per_width(format), per_width(quality)
+  if len(formats) != len(widths) or len(qualities) != len(widths):
+    raise ValueError(f"Expected one format and quality, or one per width ({len(widths)})")
+  return [os.path.join(outdir, str(x)) for x in widths], formats, qualities
+
+def resize_800width(imgfile:str, outdir:str = 'resized', new_width:int = 800):
   # Save image to new folder
   if not os.path.exists(outdir):
     os.makedirs(outdir)
-  new_img.save(outdir + '/' + os.path.basename(imgfile))
+  resize_image(imgfile, outdir, new_width)
+
+def resize_all(file_list:list, outdir:str = 'resized', new_width:int = 800, format = None, quality = None, jobs:int = 1, max_in_flight:int = None, widths:list = None):
+  # Resize images across jobs processes, yielding (input, output) pairs as they complete
+  # With widths, each image is resized to every width (see resize_pyramid and pyramid_sizes) and the output is the list of files
+  # At most max_in_flight images [default: 2 per job] are queued or being resized at any time, bounding memory
+  if widths is None:
+    os.makedirs(outdir, exist_ok = True)
+    func, sizes = resize_image, (outdir, new_width, format, quality)
+  else:
+    outdirs, formats, qualities = pyramid_sizes(outdir, widths, format, quality)
+    for folder in outdirs:
+      os.makedirs(folder, exist_ok = True)
+    func, sizes = resize_pyramid, (outdirs, widths, formats, qualities)
+
+  if jobs <= 1:
+    for imgfile in file_list:
+      yield imgfile, func(imgfile, *sizes)
+    return
+
+  max_in_flight = max_in_flight or 2 * jobs
+  with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as pool:
+    in_flight = {}
+    for imgfile in file_list:
+      if len(in_flight) >= max_in_flight:
+        done, _ = concurrent.futures.wait(in_flight, return_when = concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          yield in_flight.pop(future), future.result()
+      in_flight[pool.submit(func, imgfile, *sizes)] = imgfile
+    for future in concurrent.futures.as_completed(in_flight):
+      yield in_flight[future], future.result()
+
+# Manifest of the images resized into an output folder, by absolute source path
+MANIFEST = 'manifest.json'
+
+def file_sha256(path:str) -> str:
+  sha256 = hashlib.sha256()
+  with open(path, 'rb') as fh:
+    for chunk in iter(lambda: fh.read(1 << 20), b''):
+      sha256.update(chunk)
+  return sha256.hexdigest()
+
+def read_manifest(outdir:str) -> dict:
+  path = os.path.join(outdir, MANIFEST)
+  if not os.path.exists(path):
+    return {}
+  with open(path) as fh:
+    return json.load(fh)
+
+def write_manifest(outdir:str, manifest:dict):
+  # Write then rename, an interrupted run leaves the previous manifest
+  path = os.path.join(outdir, MANIFEST)
+  with open(path + '.tmp', 'w') as fh:
+    json.dump(manifest, fh, indent = 1, sort_keys = True)
+  os.replace(path + '.tmp', path)
+
+def remove_outputs(outdir:str, outputs:list, referenced:Counter):
+  # Remove outputs that are no longer tracked, unless referenced (the outputs of the manifest, counted once per run) still holds them:
+  # another image of the manifest has been resized to the same output since
+  for output in outputs:
+    outfile = os.path.join(outdir, output)
+    if not referenced[output] and os.path.exists(outfile):
+      os.remove(outfile)
+
+def resize_incremental(file_list:list, outdir:str = 'resized', new_width:int = 800, format = None, quality = None, jobs:int = 1, widths:list = None):
+  # Resize only the images whose content or resize parameters changed since the last run, yielding (input, output) pairs as resize_all
+  # An image is unchanged if its size and mtime match the manifest, or its size and sha256 if only the mtime changed (e.g. copied again)
+  # Outputs of images deleted since the last run are removed, as are the previous outputs of images resized to other files
+  os.makedirs(outdir, exist_ok = True)
+  manifest = read_manifest(outdir)
+  params = {'new_width': new_width, 'format': format, 'quality': quality, 'widths': widths}
+
+  todo, stats = [], {}
+  for imgfile in file_list:
+    source = os.path.abspath(imgfile)
+    stat = os.stat(imgfile)
+    entry = manifest.get(source)
+    if entry and entry['params'] == params and all(os.path.exists(os.path.join(outdir, x)) for x in entry['outputs']):
+      if (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+        continue
+      if entry['size'] == stat.st_size and entry['sha256'] == file_sha256(imgfile):
+        entry['mtime_ns'] = stat.st_mtime_ns
+        continue
+    todo.append(imgfile)
+    stats[imgfile] = stat
+
+  referenced = Counter(output for entry in manifest.values() for output in entry['outputs'])
+  for source in [x for x in manifest if not os.path.exists(x)]:
+    outputs = manifest.pop(source)['outputs']
+    referenced.subtract(outputs)
+    remove_outputs(outdir, outputs, referenced)
+
+  try:
+    for imgfile, outfile in resize_all(todo, outdir, new_width, format, quality, jobs, widths = widths):
+      source = os.path.abspath(imgfile)
+      previous = manifest.get(source)
+      outputs = [os.path.relpath(x, outdir) for x in ([outfile] if widths is None else outfile)]
+      manifest[source] = {
+        'outputs': outputs,
+        'size': stats[imgfile].st_size,
+        'mtime_ns': stats[imgfile].st_mtime_ns,
+        'sha256': file_sha256(imgfile),
+        'params': params,
+      }
+      referenced.update(outputs)
+      # e.g. a png left behind by a new --format
+      if previous:
+        referenced.subtract(previous['outputs'])
+        remove_outputs(outdir, [x for x in previous['outputs'] if x not in outputs], referenced)
+      yield imgfile, outfile
+  finally:
+    write_manifest(outdir, manifest)
+
+def resize_images(args, file_list:list):
+  # Resize the images with the options of the command line, yielding (input, output) pairs
+  # One format and quality for all sizes, or one per width
+  format, quality = args.format, args.quality
+  for name in format or []: # Unknown formats fail here rather than in every worker
+    if name:
+      pillow_format(name)
+  if args.widths is None or (format and len(format) == 1):
+    format = format[0] if format else None
+  if args.widths is None or (quality and len(quality) == 1):
+    quality = quality[0] if quality else None
+  return (resize_incremental if args.incremental else resize_all)(
+    file_list,
+    outdir = args.outdir,
+    new_width = args.new_width,
+    format = format,
+    quality = quality,
+    jobs = args.jobs,
+    widths = args.widths,
+  )
 
 # (4) Main call, connecting arguments to reusable functions (workflow)
 def main():
     args = parse_args()
 
-    file_list = glob(args.imgs)
-    for filename in file_list:
-      print(filename)
-      resize_800width(filename)
+    with instrument.run(args) as timings:
+      with timings.stage('glob') as counts:
+        file_list = glob(args.imgs)
+        counts['images'] = len(file_list)
+      with timings.stage('resize') as counts:
+        for filename, _ in resize_images(args, file_list):
+          print(filename)
+          counts['images'] = counts.get('images', 0) + 1
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,181 @@
+"""Index of full strain names, to resolve abbreviated strain names such as "Vic/123/22".
+
+Names are indexed by isolate number and year, so an abbreviation is resolved by
+looking up the few names sharing them and scoring how well their location
+matches the abbreviated one, whatever the number of names indexed.
+
+  Typical usage example:
+
+  index = StrainIndex(["A/Victoria/123/2022", "A/Sydney/5/2021"])
+  index.match("Vic/123/22")  # ("A/Victoria/123/2022", 0.9)
+
+  catalogue = StrainIndex.from_file("references_metadata.tsv")
+  name, score = catalogue.match("HK/45/19", flu_type="A", subtype="H3N2")
+"""
+import csv
+import re
+
+# Match scores of an abbreviated location, see location_score
+EXACT, PREFIX, INITIALS, SUBSEQUENCE = 1.0, 0.9, 0.85, 0.7
+
+
+def _compact(text: str) -> str:
+    return re.sub(r"[^0-9a-z]", "", text.lower())
+
+
+def _year(token: str) -> str:
+    """Two digit year of a year token, e.g. "2022" or "22e" -> "22", None if it does not start with a year."""
+    token = token.strip()
+    if not token.isdigit():
+        digits = re.match(r"\d+", token)
+        token = digits.group() if digits else ""
+    return token[-2:] if len(token) in (2, 4) else None
+
+
+def _isolate(token: str) -> str:
+    """Isolate number of a strain name, without leading zeros, e.g. "0123" -> "123"."""
+    token = token.strip().lower()
+    if not token.isalnum():
+        token = _compact(token)
+    return token.lstrip("0") or token
+
+
+def parse_strain(name: str) -> tuple:
+    """Splits a strain name, full or abbreviated, into its (location, isolate, two digit year).
+
+    The last three fields separated by "/" are read, so a type, subtype or host
+    before them is ignored: "A/Sydney/101/2022", "A/swine/Iowa/1/2020" and
+    "Syd/101/22" all parse. Returns None for names without these three fields.
+    """
+    parts = str(name).split("/")
+    if len(parts) < 3:
+        return None
+    location, isolate, year = parts[-3:]
+    year, isolate = _year(year), _isolate(isolate)
+    if year is None or not isolate or not location.strip():
+        return None
+    return location.strip(), isolate, year
+
+
+def location_score(abbrev: str, location: str) -> float:
+    """Scores how well an abbreviated location matches a location, from 0 (no match) to 1 (same location).
+
+    "Sydney" matches itself, then its prefixes ("Syd"), the initials of its
+    words ("HK" for "Hong Kong") and the letters it spells in order starting
+    with its first letter ("Bsb" for "Brisbane").
+    """
+    a, loc = _compact(abbrev), _compact(location)
+    if not a or not loc:
+        return 0.0
+    if a == loc:
+        return EXACT
+    if loc.startswith(a):
+        return PREFIX
+    if a == "".join(word[0] for word in re.findall(r"[0-9a-z]+", location.lower())):
+        return INITIALS
+    if a[0] == loc[0]:
+        letters = iter(loc)
+        if all(letter in letters for letter in a):
+            return SUBSEQUENCE
+    return 0.0
+
+
+def flu_type(name: str) -> str:
+    """Type of a full strain name, its first field if a single letter, e.g. "A/Sydney/101/2022" -> "A", else None."""
+    parts = str(name).split("/")
+    if len(parts) < 4 or len(parts[0].strip()) != 1 or not parts[0].strip().isalpha():
+        return None
+    return parts[0].strip().upper()
+
+
+def _differs(wanted: str, value: str) -> bool:
+    """Whether a strain's type or subtype rules it out, unknown values never do."""
+    return bool(wanted) and bool(value) and _compact(wanted) != _compact(value)
+
+
+class StrainIndex:
+    """Full strain names indexed by (isolate, two digit year), see parse_strain.
+
+    Names that do not parse are ignored. Matching an abbreviation only scores the
+    names sharing its isolate and year, so lookups stay fast with hundreds of
+    thousands of names. Each name keeps its type (see flu_type) and subtype, if
+    known, so that matches can be restricted to them.
+    """
+
+    def __init__(self, names=(), subtype: str = None):
+        self._names = {}
+        self.add(names, subtype=subtype)
+
+    def add(self, names, subtype: str = None):
+        """Indexes more names, all of the given subtype if known."""
+        for name in names:
+            self._add(name, subtype)
+        return self
+
+    def _add(self, name, subtype=None):
+        parsed = parse_strain(name)
+        if parsed is None:
+            return
+        location, isolate, year = parsed
+        self._names.setdefault((isolate, year), []).append((location, name, flu_type(name), subtype or None))
+
+    def __len__(self):
+        return sum(len(x) for x in self._names.values())
+
+    def match(self, abbrev: str, min_score: float = SUBSEQUENCE, flu_type: str = None, subtype: str = None) -> tuple:
+        """Finds the full name of an abbreviated strain name.
+
+        Args:
+          abbrev:
+            An abbreviated or full strain name, e.g. "Vic/123/22"
+          min_score:
+            Lowest location_score accepted
+          flu_type, subtype:
+            Only consider the names of this type (e.g. "A") and subtype (e.g. "H1N1"), names whose type or subtype
+            is unknown are kept
+
+        Returns:
+          The (name, score) of the best matching name sharing the isolate and year of abbrev,
+          or (None, 0.0) if none scores at least min_score or several distinct names score best
+          (e.g. "S/101/22" for both "A/Sydney/101/2022" and "A/Singapore/101/2022").
+        """
+        parsed = parse_strain(abbrev)
+        if parsed is None:
+            return None, 0.0
+        location, isolate, year = parsed
+        best, best_score, ambiguous = None, 0.0, False
+        for candidate_location, name, name_type, name_subtype in self._names.get((isolate, year), []):
+            if _differs(flu_type, name_type) or _differs(subtype, name_subtype):
+                continue
+            score = location_score(location, candidate_location)
+            if score > best_score:
+                best, best_score, ambiguous = name, score, False
+            elif score == best_score and score > 0 and name != best:
+                ambiguous = True
+        if ambiguous or best_score < min_score:
+            return None, 0.0
+        return best, best_score
+
+    def types(self) -> set:
+        """Types of the names indexed, see flu_type, None for names without one."""
+        return {name_type for names in self._names.values() for _, _, name_type, _ in names}
+
+    @classmethod
+    def from_file(cls, path: str, column: str = "strain", subtype_column: str = "subtype"):
+        """Indexes a catalogue of strain names: a TSV file with a column of strain names, or one name per line.
+
+        The subtype of each name is read from subtype_column if the file has one.
+        """
+        index = cls()
+        with open(path, newline="") as fh:
+            header = fh.readline().rstrip("\r\n").split("\t")
+            if column in header:
+                col_idx = header.index(column)
+                subtype_idx = header.index(subtype_column) if subtype_column in header else None
+                for row in csv.reader(fh, delimiter="\t"):
+                    if len(row) > col_idx:
+                        subtype = row[subtype_idx] if subtype_idx is not None and len(row) > subtype_idx else None
+                        index._add(row[col_idx], subtype)
+            else:
+                index.add([header[0]] + [line.rstrip("\r\n").split("\t")[0] for line in fh])
+        return index
@@ -1,27 +1,55 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import argparse
-import xlrd
-from collections import defaultdict
+import concurrent.futures
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import numpy as np
 import re
+from functools import lru_cache
+
+try:
+    from buildings import instrument
+    from buildings.options import titer_block_parser
+    from buildings.strains import StrainIndex
+except ImportError:  # Run as a script, python buildings/titer_block.py
+    import instrument
+    from options import titer_block_parser
+    from strains import StrainIndex
 
 
 def parse_args():
     """
     Parse command line arguments.
     """
-    parser = argparse.ArgumentParser(
-        description="Find the block of titers in an Excel worksheet.",
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-    )
-    parser.add_argument(
-        "--file",
-        default="~/nextstrain/fludata/VIDRL-Melbourne-WHO-CC/raw-data/A/H1N1pdm/HI/2024/20240528H1N1.xlsx",
-        required=False,
-        help="Path to the Excel file",
-    )
-    return parser.parse_args()
+    parser = titer_block_parser()
+    args = parser.parse_args()
+    if args.source not in PATTERNS:
+        parser.error(f"argument --source: invalid choice: '{args.source}' (choose from {', '.join(sorted(PATTERNS))})")
+    return args
+
+
+# Patterns matching the virus and serum annotations around the titer block, by data source.
+# Add a data source by registering its compiled patterns under the same names.
+PATTERNS = {
+    # VIDRL-Melbourne-WHO-CC
+    "vidrl": {
+        # Full virus names, left of the titer block
+        "virus": re.compile(r"[A-Z]/[\w\s-]+/.+/\d{4}"),
+        # Virus passage, right of the titer block
+        "virus_passage": re.compile(r"(MDCK\d+|SIAT\d+|E\d+)"),
+        # Serum ID, above the titer block
+        "serum_id": re.compile(r"^[A-Z]\d{4,8}$"),
+        # Serum (cell) passage, above the titer block
+        "serum_passage": re.compile(r"(MDCK\d+|SIAT\d+|E\d+)"),
+        # Abbreviated serum names, above the titer block
+        "serum_abbrev": re.compile(r"\w+\s{0,1}\w+/\d+.*"),
+    },
+}
 
 
 def is_numeric(value):
@@ -43,124 +71,354 @@ def is_numeric(value):
     return False
 
 
-def find_titer_block(worksheet):
+class XlsxSheet:
     """
-    Find the block of titers in the worksheet.
+    Read-only .xlsx worksheet with the interface used by the detection functions (name, nrows, ncols, cell_value).
 
-    To reduce false positives, the function looks for rows and columns where at least two consecutive cells contain numeric values.
+    Rows are streamed from the file on demand, up to the last row asked for, and kept for random access.
+    Values are converted as xlrd reads them: empty cells are "" and numbers are floats.
+    """
+
+    def __init__(self, worksheet):
+        self.name = worksheet.title
+        self.nrows = worksheet.max_row
+        self.ncols = worksheet.max_column
+        self._stream = worksheet.iter_rows(values_only=True)
+        self._rows = []
+        if self.nrows is None or self.ncols is None:
+            # No dimensions recorded in the file, read the sheet to size it
+            rows = list(self._stream)
+            self.nrows, self.ncols = len(rows), max((len(row) for row in rows), default=0)
+            self._stream = iter(rows)
+
+    @staticmethod
+    def _convert(value):
+        if value is None:
+            return ""
+        if isinstance(value, int) and not isinstance(value, bool):
+            return float(value)
+        return value
+
+    def row_values(self, rowx):
+        while len(self._rows) <= rowx:
+            row = [self._convert(value) for value in next(self._stream, ())[:self.ncols]]
+            self._rows.append(row + [""] * (self.ncols - len(row)))
+        return self._rows[rowx]
+
+    def cell_value(self, rowx, colx):
+        return self.row_values(rowx)[colx]
+
+
+class XlsxWorkbook:
+    """
+    Read-only .xlsx workbook, loading each sheet only when sheets() gets to it. Use as a context manager to close the file.
+    """
+
+    def __init__(self, path):
+        import openpyxl
+
+        self._workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+    def sheets(self):
+        for worksheet in self._workbook.worksheets:
+            yield XlsxSheet(worksheet)
+
+    def release_resources(self):
+        self._workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release_resources()
+
+
+# Workbook readers by file extension, files with other extensions (e.g. .xls) are read by xlrd.
+# A reader takes the path and returns a context manager whose sheets() yields worksheets.
+READERS = {
+    ".xlsx": XlsxWorkbook,
+    ".xlsm": XlsxWorkbook,
+}
+
+
+def open_workbook(path):
+    """
+    Open an Excel file with the reader registered for its extension in READERS, xlrd otherwise.
+    """
+    reader = READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        import xlrd  # Imported on first use, keeps the startup of the command line fast
+
+        return xlrd.open_workbook(path)
+    return reader(path)
+
+
+def classify_cells(worksheet):
     """
-    col_start_dict = defaultdict(int)
-    col_end_dict = defaultdict(int)
-    row_start_dict = defaultdict(int)
-    row_end_dict = defaultdict(int)
+    Read every cell of the worksheet once and classify it.
 
-    # Iterate over each row
+    Returns a dict of dense arrays shaped like the worksheet:
+      values: the cell values
+      is_titer: True where the cell is_numeric
+      titers: the titer as a float ("< 10" -> 10.0), NaN where the cell is not a titer
+    """
+    values = np.empty((worksheet.nrows, worksheet.ncols), dtype=object)
     for row_idx in range(worksheet.nrows):
-        first_numeric_index = None
-        last_numeric_index = None
-        for col_idx in range(worksheet.ncols):
-            cell_value = worksheet.cell_value(row_idx, col_idx)
-            next_cell_value = (
-                worksheet.cell_value(row_idx, col_idx + 1)
-                if col_idx + 1 < worksheet.ncols
-                else None
-            )
+        if hasattr(worksheet, "row_values"):
+            values[row_idx, :] = worksheet.row_values(row_idx)
+        else:
+            values[row_idx, :] = [worksheet.cell_value(row_idx, col_idx) for col_idx in range(worksheet.ncols)]
 
-            # Check for two consecutive numeric values in a row before incrementing the count
-            if is_numeric(cell_value) and is_numeric(next_cell_value):
-                if first_numeric_index is None:
-                    first_numeric_index = col_idx
-                last_numeric_index = col_idx + 1
-
-        # Only increment if any numeric values were found in the row
-        if first_numeric_index is not None:
-            col_start_dict[first_numeric_index] += 1
-            col_end_dict[last_numeric_index] += 1
-
-    # Iterate over each column
-    for col_idx in range(worksheet.ncols):
-        first_numeric_index = None
-        last_numeric_index = None
-        for row_idx in range(worksheet.nrows):
-            cell_value = worksheet.cell_value(row_idx, col_idx)
-            next_cell_value = (
-                worksheet.cell_value(row_idx + 1, col_idx)
-                if row_idx + 1 < worksheet.nrows
-                else None
-            )
+    # Numbers are titers, strings only if they start with "<" (checked by is_numeric)
+    flat = values.ravel()
+    is_number = np.fromiter((isinstance(x, (int, float)) for x in flat), dtype=bool, count=flat.size)
+    is_censored = np.fromiter((isinstance(x, str) and "<" in x for x in flat), dtype=bool, count=flat.size)
+    is_censored[is_censored] = [is_numeric(x) for x in flat[is_censored]]
 
-            # Check for two consecutive numeric values in a column before incrementing the count
-            if is_numeric(cell_value) and is_numeric(next_cell_value):
-                if first_numeric_index is None:
-                    first_numeric_index = row_idx
-                last_numeric_index = row_idx + 1
+    titers = np.full(flat.size, np.nan)
+    titers[is_number] = flat[is_number].astype(float)
+    titers[is_censored] = [float(x.strip()[1:]) for x in flat[is_censored]]
+    return {
+        "values": values,
+        "is_titer": (is_number | is_censored).reshape(values.shape),
+        "titers": titers.reshape(values.shape),
+    }
 
-        # Only increment if any numeric values were found in the column
-        if first_numeric_index is not None:
-            row_start_dict[first_numeric_index] += 1
-            row_end_dict[last_numeric_index] += 1
 
-    # Sort the dictionaries by frequency in descending order
-    sorted_col_start = sorted(col_start_dict.items(), key=lambda item: item[1], reverse=True)
-    sorted_col_end = sorted(col_end_dict.items(), key=lambda item: item[1], reverse=True)
-    sorted_row_start = sorted(row_start_dict.items(), key=lambda item: item[1], reverse=True)
-    sorted_row_end = sorted(row_end_dict.items(), key=lambda item: item[1], reverse=True)
+def _run_bounds(is_titer):
+    """
+    For each row with at least two consecutive titers, the index of the first one and of the last one.
+    """
+    pairs = is_titer[:, :-1] & is_titer[:, 1:]
+    pairs = pairs[pairs.any(axis=1)]
+    if pairs.size == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    first = pairs.argmax(axis=1)
+    last = pairs.shape[1] - pairs[:, ::-1].argmax(axis=1)
+    return first, last
+
+
+def _ranked_counts(indices):
+    """
+    Count each index, most frequent first and ties in order of first appearance.
+    """
+    unique, first_seen, counts = np.unique(indices, return_index=True, return_counts=True)
+    items = [(int(unique[i]), int(counts[i])) for i in np.argsort(first_seen, kind="stable")]
+    return sorted(items, key=lambda item: item[1], reverse=True)
+
+
+def find_titer_block(worksheet, cells=None):
+    """
+    Find the block of titers in the worksheet.
+
+    To reduce false positives, the function looks for rows and columns where at least two consecutive cells contain numeric values.
+    The cells are read once through classify_cells, unless already classified cells are passed in.
+    """
+    if cells is None:
+        cells = classify_cells(worksheet)
+
+    # Rows (and then columns) with two consecutive numeric values vote for the start and end of the block
+    col_start, col_end = _run_bounds(cells["is_titer"])
+    row_start, row_end = _run_bounds(cells["is_titer"].T)
 
     return {
-        "col_start": sorted_col_start,
-        "col_end": sorted_col_end,
-        "row_start": sorted_row_start,
-        "row_end": sorted_row_end,
+        "col_start": _ranked_counts(col_start),
+        "col_end": _ranked_counts(col_end),
+        "row_start": _ranked_counts(row_start),
+        "row_end": _ranked_counts(row_end),
     }
 
 
-def find_virus_columns(worksheet, col_start, col_end, row_start, row_end):
+def _label_runs(is_titer):
     """
-    Find the columns containing virus names based on the most likely column indices for the titer block.
+    Split each row into runs of consecutive titers and label the runs by connected component.
+
+    Runs of consecutive rows are connected if they share a column. Returns the row, start, (exclusive) end and label
+    of every run, in row order. The work is linear in the number of cells, then in the number of runs.
     """
-    # List of outputs
-    virus_col_idx = None  # Index of the column containing virus names
-    virus_passage_col_idx = None  # Index of the column containing virus passage data
-    virus_names = (
-        []
-    )  # List of virus names, will be used by find_antigen_rows to map abbreviated antigen names to full names
+    padded = np.zeros((is_titer.shape[0], is_titer.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = is_titer
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
 
-    # VIDRL-Melbourne-WHO-CC specific patterns (TODO: parameterize the pattern matching by data source)
-    # Define a regular expression pattern to match virus names
-    virus_pattern = r"[A-Z]/[\w\s-]+/.+/\d{4}"
-    # Define a regular expression pattern to match virus passage column
-    virus_passage_pattern = r"(MDCK\d+|SIAT\d+|E\d+)"
+    # Union-find over the runs, comparing the runs of each row with the overlapping ones of the next row
+    parent = list(range(len(rows)))
 
-    # Find the column containing virus names searching to the left of the titer block
-    for col_idx in range(col_start - 1, -1, -1):
-        virus_count = 0
-        for row_idx in range(row_start, row_end + 1):
-            cell_value = str(worksheet.cell_value(row_idx, col_idx))
-            if re.match(virus_pattern, cell_value):
-                virus_count += 1
-
-        # Index of the first column that contains more than 50% rows matching the virus pattern
-        if virus_count > (row_end - row_start) / 2:
-            virus_col_idx = col_idx
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    row_bounds = np.searchsorted(rows, np.arange(is_titer.shape[0] + 1))
+    for row_idx in range(is_titer.shape[0] - 1):
+        a, a_end = row_bounds[row_idx], row_bounds[row_idx + 1]
+        b, b_end = a_end, row_bounds[row_idx + 2]
+        while a < a_end and b < b_end:
+            if starts[a] < ends[b] and starts[b] < ends[a]:
+                parent[find(a)] = find(b)
+            if ends[a] < ends[b]:
+                a += 1
+            else:
+                b += 1
+
+    labels = np.array([find(i) for i in range(len(rows))], dtype=int)
+    return rows, starts, ends, labels
+
+
+def _is_connected(is_titer):
+    """
+    Whether the titers form a single connected component (see _label_runs), without labelling the runs when every row
+    holds a single run overlapping that of the next row, as in a plate.
+    """
+    padded = np.zeros((is_titer.shape[0], is_titer.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = is_titer
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    if len(rows) == is_titer.shape[0] and np.array_equal(rows, np.arange(len(rows))):
+        return bool(np.all((starts[1:] < ends[:-1]) & (starts[:-1] < ends[1:])))
+    return len(set(_label_runs(is_titer)[3])) == 1
+
+
+def find_titer_blocks(worksheet, cells=None, min_rows=2, min_cols=2):
+    """
+    Find every rectangular block of titers in the worksheet, e.g. several plates side by side or stacked.
+
+    A block is a connected component of titer cells, spanning at least min_rows rows and min_cols columns.
+    Returns a list of dicts with the block bounds (as in analyze_sheet), its number of titers and a confidence score,
+    the fraction of the cells of the block holding a titer, sorted from the top left block.
+    """
+    if cells is None:
+        cells = classify_cells(worksheet)
+
+    rows, starts, ends, labels = _label_runs(cells["is_titer"])
+    if len(rows) == 0:
+        return []
+    components, labels = np.unique(labels, return_inverse=True)
+    row_start = np.full(len(components), worksheet.nrows)
+    row_end = np.full(len(components), -1)
+    col_start = np.full(len(components), worksheet.ncols)
+    col_end = np.full(len(components), -1)
+    n_titers = np.zeros(len(components), dtype=int)
+    np.minimum.at(row_start, labels, rows)
+    np.maximum.at(row_end, labels, rows)
+    np.minimum.at(col_start, labels, starts)
+    np.maximum.at(col_end, labels, ends - 1)
+    np.add.at(n_titers, labels, ends - starts)
+
+    blocks = []
+    for i in np.lexsort((col_start, row_start)):
+        n_rows, n_cols = row_end[i] - row_start[i] + 1, col_end[i] - col_start[i] + 1
+        if n_rows < min_rows or n_cols < min_cols:
+            continue
+        blocks.append({
+            "col_start": int(col_start[i]),
+            "col_end": int(col_end[i]),
+            "row_start": int(row_start[i]),
+            "row_end": int(row_end[i]),
+            "n_titers": int(n_titers[i]),
+            "confidence": round(float(n_titers[i] / (n_rows * n_cols)), 4),
+        })
+    return blocks
+
+
+def _cell_text(worksheet, row_idxs, col_idxs, cells=None):
+    """
+    Read a region of the worksheet as strings, one list per row, from the classified cells if given.
+    """
+    if cells is not None:
+        region = cells["values"][np.ix_(np.asarray(row_idxs, dtype=int), np.asarray(col_idxs, dtype=int))]
+        return [[str(value) for value in row] for row in region]
+    return [[str(worksheet.cell_value(row_idx, col_idx)) for col_idx in col_idxs] for row_idx in row_idxs]
+
+
+def _find_first_lines(lines, patterns, threshold):
+    """
+    Find, for each pattern, the first line in which more than threshold cells match the pattern.
+
+    Every cell is converted and visited once, scoring all the patterns not found yet at the same time.
+    lines is an iterable of (index, cell strings) in search order; returns a dict of pattern name to line index (or None).
+    """
+    found = dict.fromkeys(patterns)
+    for line_idx, line in lines:
+        pending = [name for name, idx in found.items() if idx is None]
+        if not pending:
             break
+        counts = dict.fromkeys(pending, 0)
+        for cell_value in line:
+            for name in pending:
+                if patterns[name].match(cell_value):
+                    counts[name] += 1
+        for name in pending:
+            if counts[name] > threshold:
+                found[name] = line_idx
+    return found
+
+
+def _column_text(worksheet, row_idxs, col_idxs, cells=None):
+    """
+    Read a region of the worksheet as strings, one list per column, from the classified cells if given.
+    """
+    return [list(column) for column in zip(*_cell_text(worksheet, row_idxs, col_idxs, cells))]
+
+
+def _search_lines(line_idxs, read, patterns, threshold, hints=None):
+    """
+    _find_first_lines over the lines line_idxs (in search order), whose cell strings are read by read(line_idxs).
+
+    hints maps each pattern name to the line index expected for it, e.g. from a layout template (see analyze_sheet).
+    Only the lines up to the furthest hint are read at first, the others only if a pattern is not found among them.
+    The result is the same with or without hints.
+    """
+    position = {line_idx: i for i, line_idx in enumerate(line_idxs)}
+    hinted = [position.get(hints.get(name)) for name in patterns] if hints else [None]
+    stop = len(line_idxs) if None in hinted else max(hinted) + 1
+    found = _find_first_lines(zip(line_idxs[:stop], read(line_idxs[:stop])), patterns, threshold)
+    pending = {name: pattern for name, pattern in patterns.items() if found[name] is None}
+    if pending and stop < len(line_idxs):
+        found.update(_find_first_lines(zip(line_idxs[stop:], read(line_idxs[stop:])), pending, threshold))
+    return found
+
+
+def find_virus_columns(worksheet, col_start, col_end, row_start, row_end, source="vidrl", cells=None, hints=None):
+    """
+    Find the columns containing virus names based on the most likely column indices for the titer block.
+
+    The patterns come from PATTERNS[source]. Cells are read from the classified cells if given.
+    hints maps virus_col_idx and virus_passage_col_idx to the expected indices, searched first (see _search_lines).
+    """
+    patterns = PATTERNS[source]
+    hints = hints or {}
+
+    # Find the column containing virus names searching to the left of the titer block
+    # Index of the first column that contains more than 50% rows matching the virus pattern
+    virus_rows = list(range(row_start, row_end + 1))
+    virus_col_idx = _search_lines(
+        list(range(col_start - 1, -1, -1)),
+        lambda col_idxs: _column_text(worksheet, virus_rows, col_idxs, cells),
+        {"virus": patterns["virus"]},
+        (row_end - row_start) / 2,
+        {"virus": hints.get("virus_col_idx")},
+    )["virus"]
 
-    # Get the virus names from the column containing virus names
+    # Get the virus names from the column containing virus names, used by find_serum_rows to map abbreviated serum names to full names
     # This allows for some lienency in matching the virus pattern in the column
-    for row_idx in range(row_start, row_end + 1):
-        virus_names.append(str(worksheet.cell_value(row_idx, virus_col_idx)))
+    virus_names = []
+    if virus_col_idx is not None:
+        virus_names = _column_text(worksheet, virus_rows, [virus_col_idx], cells)[0]
 
     # Find the column containing virus passage data searching to the right of the titer block
-    for col_idx in range(col_end, worksheet.ncols):
-        virus_passage_count = 0
-        for row_idx in range(row_end):
-            cell_value = str(worksheet.cell_value(row_idx, col_idx))
-            if re.match(virus_passage_pattern, cell_value):
-                virus_passage_count += 1
-
-        # Index of the first column that contains more than 50% rows matching the virus passage pattern
-        if virus_passage_count > (row_end - row_start) / 2:
-            virus_passage_col_idx = col_idx
-            break
+    # Index of the first column that contains more than 50% rows matching the virus passage pattern
+    passage_rows = list(range(row_end))
+    virus_passage_col_idx = _search_lines(
+        list(range(col_end, worksheet.ncols)),
+        lambda col_idxs: _column_text(worksheet, passage_rows, col_idxs, cells),
+        {"virus_passage": patterns["virus_passage"]},
+        (row_end - row_start) / 2,
+        {"virus_passage": hints.get("virus_passage_col_idx")},
+    )["virus_passage"]
 
     return {
         "virus_col_idx": virus_col_idx,
@@ -169,140 +427,691 @@ def find_virus_columns(worksheet, col_start, col_end, row_start, row_end):
     }
 
 
-def find_serum_rows(worksheet, col_start, col_end, row_start, row_end, virus_names=None):
+def find_serum_rows(
+    worksheet,
+    col_start,
+    col_end,
+    row_start,
+    row_end,
+    virus_names=None,
+    source="vidrl",
+    cells=None,
+    hints=None,
+    catalogue=None,
+    subtype=None,
+):
     """
     Find the row containing cell passage data and the row containing abbreviated serum names.
+
+    The patterns come from PATTERNS[source]. The rows above the titer block are swept once for the serum ID,
+    passage and abbreviated name patterns. Cells are read from the classified cells if given.
+    hints maps serum_id_row_idx, serum_passage_row_idx and serum_abbrev_row_idx to the expected indices, searched
+    first (see _search_lines).
+
+    Abbreviated serum names are mapped to the full name with the same isolate and year among virus_names, or in the
+    catalogue (a StrainIndex) if none matches. Catalogue matches are restricted to the type of the viruses of the
+    sheet, if they share one, and to subtype if given. serum_scores holds the match score of each abbreviated name
+    (see StrainIndex.match), 0.0 for those left out of serum_mapping for lack of a single best match.
     """
-    # List of outputs
-    serum_id_row_idx = None  # Index of the row containing serum ID
-    serum_passage_row_idx = None  # Index of the row containing cell passage data
-    serum_abbrev_row_idx = None  # Index of the row containing abbreviated antigen names
+    patterns = PATTERNS[source]
+    hints = hints or {}
     serum_mapping = {}  # Mapping of abbreviated antigen names to full names
+    serum_scores = {}
 
-    # VIDRL-Melbourne-WHO-CC specific patterns (TODO: parameterize the pattern matching by data source)
-    # Define a regular expression pattern to match serum ID
-    serum_id_pattern = r"^[A-Z]\d{4,8}$"
-    # Define a regular expression pattern to match cell passage data
-    serum_passage_pattern = r"(MDCK\d+|SIAT\d+|E\d+)"
-    # Define a regular expression pattern to match abbreviated antigen names
-    serum_abbrev_pattern = r"\w+\s{0,1}\w+/\d+.*"
-
-    # Find the row containing serum ID searching from the top of the titer block upwards
-    for row_idx in range(row_start - 1, -1, -1):  # Iterate from row_start to the top
-        serum_id_count = 0
-        for col_idx in range(col_start, col_end + 1):
-            cell_value = str(worksheet.cell_value(row_idx, col_idx))
-            if re.match(serum_id_pattern, cell_value):
-                serum_id_count += 1
-        # Index of the first row that contains more than 50% columns matching the serum ID pattern
-        if serum_id_count > (col_end - col_start) / 2:
-            serum_id_row_idx = row_idx
-            break
+    # Find the rows containing serum ID, cell passage data and abbreviated serum names searching from the top of the titer block upwards
+    # Index of the first row that contains more than 50% columns matching each pattern
+    col_idxs = list(range(col_start, col_end + 1))
+    names = ["serum_id", "serum_passage", "serum_abbrev"]
+    found = _search_lines(
+        list(range(row_start - 1, -1, -1)),
+        lambda row_idxs: _cell_text(worksheet, row_idxs, col_idxs, cells),
+        {name: patterns[name] for name in names},
+        (col_end - col_start) / 2,
+        {name: hints.get(f"{name}_row_idx") for name in names},
+    )
 
-    # Find the row containing cell passage data searching from the top of the titer block upwards
-    for row_idx in range(row_start - 1, -1, -1):  # Iterate from row_start to the top
-        serum_passage_count = 0
-        for col_idx in range(col_start, col_end + 1):
-            cell_value = str(worksheet.cell_value(row_idx, col_idx))
-            if re.match(serum_passage_pattern, cell_value):
-                serum_passage_count += 1
-        if serum_passage_count > (col_end - col_start) / 2:
-            serum_passage_row_idx = row_idx
-            break
+    # Map abbreviated serum names to full names, by isolate and year rather than by position
+    # The columns of the sera need not follow the rows of the viruses, and some sera have no virus row
+    if found["serum_abbrev"] is not None:
+        virus_index = StrainIndex(virus_names or [])
+        types = virus_index.types() - {None}
+        sheet_type = types.pop() if len(types) == 1 else None
+        for cell_value in _cell_text(worksheet, [found["serum_abbrev"]], col_idxs, cells)[0]:
+            # A more lenient check for the presence of a "/" in the cell value to find the abbreviated serum names
+            if r"/" not in cell_value:
+                continue
+            name, score = virus_index.match(cell_value)
+            if name is None and catalogue is not None:
+                name, score = catalogue.match(cell_value, flu_type=sheet_type, subtype=subtype)
+            serum_scores[cell_value] = score
+            if name is not None:
+                serum_mapping[cell_value] = name
 
-    # Find the row containing abbreviated serum names searching from the top of the titer block upwards
-    for row_idx in range(row_start -1, -1, -1):
-        serum_abbrev_count = 0
-        for col_idx in range(col_start, col_end + 1):
-            cell_value = str(worksheet.cell_value(row_idx, col_idx))
-            if re.match(serum_abbrev_pattern, cell_value):
-                serum_abbrev_count += 1
+    return {
+        "serum_id_row_idx": found["serum_id"],
+        "serum_passage_row_idx": found["serum_passage"],
+        "serum_abbrev_row_idx": found["serum_abbrev"],
+        "serum_mapping": serum_mapping,
+        "serum_scores": serum_scores,
+    }
 
-        if serum_abbrev_count > (col_end - col_start) / 2:
-            serum_abbrev_row_idx = row_idx
-            break
 
-    # Map abbreviated serum names to full names
-    virus_idx = 0
-    for col_idx in range(col_start, col_end + 1):
-        cell_value = str(worksheet.cell_value(serum_abbrev_row_idx, col_idx))
-        # A more lenient check for the presence of a "/" in the cell value to find the abbreviated serum names
-        if r"/" in cell_value:
-            serum_mapping[cell_value] = virus_names[virus_idx]
-            virus_idx += 1
+# Number of rows at the top of a worksheet making up its layout fingerprint, with its dimensions
+FINGERPRINT_ROWS = 4
 
+
+def sheet_fingerprint(worksheet, source="vidrl", cells=None):
+    """
+    Fingerprint the layout of a worksheet: its dimensions, the data source and the kind of each cell (empty, number
+    or text) of its first FINGERPRINT_ROWS rows. Sheets of the same lab and assay usually share a fingerprint,
+    whatever their names, dates and titers.
+    """
+    n_rows = min(FINGERPRINT_ROWS, worksheet.nrows)
+    if cells is not None:
+        rows = cells["values"][:n_rows]
+    else:
+        rows = [[worksheet.cell_value(row_idx, col_idx) for col_idx in range(worksheet.ncols)] for row_idx in range(n_rows)]
+    kinds = "".join("." if value == "" else "0" if isinstance(value, (int, float)) else "a" for row in rows for value in row)
+    return hashlib.sha1(f"{source}:{worksheet.nrows}x{worksheet.ncols}:{kinds}".encode()).hexdigest()
+
+
+def _bounds_key(bounds):
+    return f"{bounds['row_start']}:{bounds['row_end']}:{bounds['col_start']}:{bounds['col_end']}"
+
+
+def _stray_digest(is_titer, blocks):
+    """
+    Hash the positions of the titers outside the blocks, see check_template_blocks.
+    """
+    stray = is_titer.copy()
+    for block in blocks:
+        stray[block["row_start"]:block["row_end"] + 1, block["col_start"]:block["col_end"] + 1] = False
+    return hashlib.sha1(np.flatnonzero(stray).astype(np.int64).tobytes()).hexdigest()
+
+
+def layout_template(result):
+    """
+    Make the layout template of an analyze_sheet result, reused by analyze_sheet for sheets with the same fingerprint.
+
+    A template holds the bounds of the blocks, the hash of the positions of the titers outside them (stray) and the
+    annotation indices found for each bounds, keyed by "row_start:row_end:col_start:col_end". It is JSON serializable.
+    """
+    annotations = {}
+    for entry in result["blocks"] + ([result] if result["bounds"] else []):
+        annotations[_bounds_key(entry["bounds"])] = {
+            **{key: entry["virus_block"][key] for key in ["virus_col_idx", "virus_passage_col_idx"]},
+            **{key: entry["serum_block"][key] for key in ["serum_id_row_idx", "serum_passage_row_idx", "serum_abbrev_row_idx"]},
+        }
     return {
-        "serum_id_row_idx": serum_id_row_idx,
-        "serum_passage_row_idx": serum_passage_row_idx,
-        "serum_abbrev_row_idx": serum_abbrev_row_idx,
-        "serum_mapping": serum_mapping,
+        "blocks": [entry["bounds"] for entry in result["blocks"]],
+        "stray": result["layout"]["stray"],
+        "annotations": annotations,
     }
 
 
-def main():
-    args = parse_args()
+def check_template_blocks(cells, template):
+    """
+    Check the blocks of a layout template against the classified cells of a sheet, instead of finding them again.
 
-    # Load the Excel file
-    workbook = xlrd.open_workbook(args.file)
+    A block holds if none of its rows and columns is free of titers, its titers form a single connected component
+    (see _label_runs) and no titer touches it from outside, so it is still a whole component as found by
+    find_titer_blocks. Only the cells of the block and of its border are looked at.
+    The titers outside the blocks must be at the same positions as in the template, or a block may have appeared
+    elsewhere, e.g. a new plate in place of as many stray titers. Templates without these positions never hold.
+    Returns the blocks as find_titer_blocks would, or None if the check fails.
+    """
+    is_titer = cells["is_titer"]
+    n_rows, n_cols = is_titer.shape
+    blocks = []
+    for bounds in template["blocks"]:
+        row_start, row_end, col_start, col_end = (bounds[key] for key in ["row_start", "row_end", "col_start", "col_end"])
+        if row_end >= n_rows or col_end >= n_cols:
+            return None
+        block = is_titer[row_start:row_end + 1, col_start:col_end + 1]
+        if not (block.any(axis=0).all() and block.any(axis=1).all()):
+            return None
+        # e.g. two plates touching only at a corner fill every row and column of their bounding box
+        if not _is_connected(block):
+            return None
+        outside = [
+            is_titer[row_start - 1, col_start:col_end + 1] if row_start > 0 else [],
+            is_titer[row_end + 1, col_start:col_end + 1] if row_end + 1 < n_rows else [],
+            is_titer[row_start:row_end + 1, col_start - 1] if col_start > 0 else [],
+            is_titer[row_start:row_end + 1, col_end + 1] if col_end + 1 < n_cols else [],
+        ]
+        if any(np.any(edge) for edge in outside):
+            return None
+        n_titers = int(np.count_nonzero(block))
+        blocks.append(dict(
+            bounds,
+            n_titers=n_titers,
+            confidence=round(n_titers / block.size, 4),
+        ))
+    if _stray_digest(is_titer, blocks) != template.get("stray"):
+        return None
+    return blocks
 
-    for worksheet in workbook.sheets():
-        print(f"Worksheet: {worksheet.name}")
 
-        # Find the block of titers in the worksheet
-        titer_block = find_titer_block(worksheet)
-        if len(titer_block["col_start"]) == 0:
-            print("No titer block found.")
-            break
+def _find_annotations(worksheet, bounds, source, cells, hints=None, catalogue=None, subtype=None):
+    """
+    Find the virus_block and serum_block of a titer block, see find_virus_columns and find_serum_rows.
+    """
+    virus_block = find_virus_columns(worksheet=worksheet, **bounds, source=source, cells=cells, hints=hints)
+    serum_block = find_serum_rows(
+        worksheet=worksheet,
+        **bounds,
+        virus_names=virus_block["virus_names"],
+        source=source,
+        cells=cells,
+        hints=hints,
+        catalogue=catalogue,
+        subtype=subtype,
+    )
+    return virus_block, serum_block
+
+
+def analyze_sheet(worksheet, source="vidrl", cells=None, layouts=None, catalogue=None, subtype=None):
+    """
+    Find the titer block and its virus and serum annotations in a worksheet.
 
-        virus_block = find_virus_columns(
-            worksheet=worksheet,
-            col_start=titer_block["col_start"][0][0],
-            col_end=titer_block["col_end"][0][0],
-            row_start=titer_block["row_start"][0][0],
-            row_end=titer_block["row_end"][0][0],
+    Returns a JSON serializable dict with the sheet name, the ranked titer_block indices (see find_titer_block),
+    the most likely block bounds, and the virus_block and serum_block (see find_virus_columns and find_serum_rows).
+    All but the sheet name, blocks and layout are None if no titer block is found.
+    blocks lists every block of the sheet (see find_titer_blocks) with its own bounds, confidence, virus_block and
+    serum_block. layout holds the fingerprint of the sheet (see sheet_fingerprint), its number of titers outside
+    the blocks and the hash of their positions.
+
+    layouts is a dict of layout templates by fingerprint (see layout_template), updated with the template of the
+    sheet. The blocks of a known layout are checked (see check_template_blocks) instead of searched for, and its
+    annotation indices are searched first. The result is the same as without layouts. The whole sheet is still
+    classified (see classify_cells), which the check of the titers outside the blocks needs: a template saves the
+    search for blocks and annotations, not the reading of the cells.
+
+    catalogue is a StrainIndex of reference strains for the sera without a virus row, and subtype restricts the
+    matches to the catalogue strains of that subtype, see find_serum_rows.
+    """
+    result = {
+        "sheet": worksheet.name,
+        "titer_block": None,
+        "bounds": None,
+        "virus_block": None,
+        "serum_block": None,
+        "blocks": [],
+        "layout": None,
+    }
+
+    # Find the blocks of titers in the worksheet, or check those of the sheets with the same layout
+    if cells is None:
+        cells = classify_cells(worksheet)
+    fingerprint = sheet_fingerprint(worksheet, source=source, cells=cells)
+    template = layouts.get(fingerprint) if layouts is not None else None
+    blocks = check_template_blocks(cells, template) if template else None
+    if blocks is None:
+        blocks = find_titer_blocks(worksheet, cells=cells)
+    hints = template["annotations"] if template else {}
+    annotations = {}  # By bounds, the most likely bounds are usually those of a block
+
+    def annotate(bounds):
+        key = _bounds_key(bounds)
+        if key not in annotations:
+            annotations[key] = _find_annotations(
+                worksheet, bounds, source, cells, hints.get(key), catalogue, subtype
+            )
+        return annotations[key]
+
+    for block in blocks:
+        bounds = {key: block[key] for key in ["col_start", "col_end", "row_start", "row_end"]}
+        virus_block, serum_block = annotate(bounds)
+        result["blocks"].append(
+            {"bounds": bounds, "confidence": block["confidence"], "virus_block": virus_block, "serum_block": serum_block}
         )
-        serum_block = find_serum_rows(
-            worksheet=worksheet,
-            col_start=titer_block["col_start"][0][0],
-            col_end=titer_block["col_end"][0][0],
-            row_start=titer_block["row_start"][0][0],
-            row_end=titer_block["row_end"][0][0],
-            virus_names=virus_block["virus_names"],
+    result["layout"] = {
+        "fingerprint": fingerprint,
+        "n_stray": int(np.count_nonzero(cells["is_titer"])) - sum(block["n_titers"] for block in blocks),
+        "stray": _stray_digest(cells["is_titer"], blocks),
+    }
+
+    titer_block = find_titer_block(worksheet, cells=cells)
+    if all(len(titer_block[key]) > 0 for key in titer_block):
+        bounds = {key: titer_block[key][0][0] for key in ["col_start", "col_end", "row_start", "row_end"]}
+        virus_block, serum_block = annotate(bounds)
+        result.update(
+            titer_block={key: [list(item) for item in value] for key, value in titer_block.items()},
+            bounds=bounds,
+            virus_block=virus_block,
+            serum_block=serum_block,
         )
 
-        # Print the most likely row and column indices for the titer block
-        print(f"Titer block: n = {titer_block['row_start'][0][1]}x{titer_block['col_start'][0][1]} = {titer_block['row_start'][0][1]*titer_block['col_start'][0][1]}")
-        print(f"  Most likely (n={titer_block['col_start'][0][1]}) col_start: {titer_block['col_start'][0][0]}")
-        print(f"  Most likely (n={titer_block['col_end'][0][1]}) col_end: {titer_block['col_end'][0][0]}")
-        print(f"  Most likely (n={titer_block['row_start'][0][1]}) row_start: {titer_block['row_start'][0][0]}")
-        print(f"  Most likely (n={titer_block['row_end'][0][1]}) row_end: {titer_block['row_end'][0][0]}")
-
-        # For debugging purposes, print alternative indices (e.g. col_start, col_end, row_start, row_end)
-        # print("Alternative indices:")
-        # for i in range(1, len(titer_block['row_start'])):
-        #     print(f"  Alternative (n={titer_block['row_start'][i][1]}) row_start: {titer_block['row_start'][i][0]}")
-
-        # Print Virus and Serum annotations row and column indices
-        print("Virus (antigen) block: left and right of the titer block")
-        print(f"  virus column index: {virus_block['virus_col_idx']}")
-        print(f"  virus passage column index: {virus_block['virus_passage_col_idx']}")
-        print(f"  virus names: {virus_block['virus_names']}")
-
-        print("Serum (antisera) block: above the titer block")
-        print(f"  serum ID row index: {serum_block['serum_id_row_idx']}")
-        print(f"  serum passage row index: {serum_block['serum_passage_row_idx']}")
-        print(f"  serum abbreviated name row index: {serum_block['serum_abbrev_row_idx']}")
-
-        # Match abbreviated names across the top to the full names along the left side and auto convert to full names
-        if serum_block["serum_abbrev_row_idx"] is not None:
-            # print("Serum mapping:")
-            # for abbrev, full in serum_block["serum_mapping"].items():
-            #     print(f"  {abbrev} -> {full}")
-
-            print("serum_mapping = {")
-            for abbrev, full in serum_block["serum_mapping"].items():
-                print(f"    '{abbrev}': '{full}',")
-            print("}")
+    if layouts is not None:
+        layouts[fingerprint] = layout_template(result)
+    return result
+
+
+def file_sha256(path):
+    """
+    Hash the content of a file.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@lru_cache(maxsize=4)
+def load_catalogue(path):
+    """
+    Index a reference strain catalogue file (see StrainIndex.from_file), once per process.
+    """
+    return StrainIndex.from_file(path)
+
+
+def analyze_workbook(path, source="vidrl", layouts=None, strains=None, sha256=None, subtype=None):
+    """
+    Analyze every sheet of an Excel file with analyze_sheet, reusing and updating the layouts templates if given.
+
+    strains is the path of a reference strain catalogue (see load_catalogue), subtype that of the sheets (see
+    analyze_sheet). sha256 is the digest of the file if already known (see analyze_batch), it is computed otherwise.
+    Returns a dict with the file path, its sha256 and the list of sheet results, or the error raised while reading it.
+    """
+    result = {"file": path, "sha256": sha256 or file_sha256(path), "sheets": None, "error": None}
+    try:
+        catalogue = load_catalogue(strains) if strains else None
+        with open_workbook(path) as workbook:
+            result["sheets"] = [
+                analyze_sheet(worksheet, source=source, layouts=layouts, catalogue=catalogue, subtype=subtype)
+                for worksheet in workbook.sheets()
+            ]
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    return result
+
+
+def expand_paths(patterns=None, file_list=None):
+    """
+    Expand paths and glob patterns, and the paths listed one per line in file_list, into a sorted list of unique files.
+    """
+    patterns = list(patterns or [])
+    if file_list:
+        with open(file_list) as fh:
+            patterns += [line.strip() for line in fh if line.strip()]
+    paths = set()
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        paths.update(glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern])
+    return sorted(paths)
+
+
+def read_layouts(path):
+    """
+    Read the layout templates by fingerprint kept in a JSON file (see analyze_sheet), none if the file does not exist.
+    """
+    if not (path and os.path.exists(path)):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def write_layouts(path, layouts, results):
+    """
+    Add the layout templates of the sheets of analyze_workbook results to layouts, and write them to a JSON file.
+    """
+    for result in results:
+        for sheet in result["sheets"] or []:
+            layouts[sheet["layout"]["fingerprint"]] = layout_template(sheet)
+    with open(path, "w") as fh:
+        json.dump(layouts, fh)
+
+
+# Version of the analyze_sheet results, cached results of other versions are parsed again
+RESULTS_VERSION = 5
+
+
+def analyze_batch(paths, source="vidrl", jobs=1, cache=None, layouts=None, strains=None, subtype=None):
+    """
+    Analyze many Excel files across jobs processes, reusing the cached results of files whose content did not change.
+
+    cache is the path of a JSON file mapping "<sha256>:<source>:<RESULTS_VERSION>" to the sheet results, updated with
+    the newly parsed files. With a strains catalogue (see analyze_workbook) the key ends with ":<catalogue sha256>",
+    and with a subtype with ":<subtype>".
+    layouts is the path of a JSON file of layout templates (see analyze_sheet), so sheets laid out like sheets seen
+    before, in this run or earlier ones, skip the full titer block detection. It is updated with the parsed sheets.
+    Returns the analyze_workbook results, in the order of paths.
+    """
+    cached = {}
+    if cache and os.path.exists(cache):
+        with open(cache) as fh:
+            cached = json.load(fh)
+
+    suffix = f":{source}:{RESULTS_VERSION}" + (f":{file_sha256(strains)}" if strains else "")
+    suffix += f":{subtype}" if strains and subtype else ""
+    results = {}
+    todo, digests = [], []
+    for path in paths:
+        sha256 = file_sha256(path)
+        sheets = cached.get(sha256 + suffix)
+        if sheets is not None:
+            results[path] = {"file": path, "sha256": sha256, "sheets": sheets, "error": None}
+        else:
+            todo.append(path)
+            digests.append(sha256)
+
+    templates = read_layouts(layouts) if layouts else None
+    if jobs > 1 and len(todo) > 1:
+        # Each worker starts from the templates known so far
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed = list(
+                pool.map(
+                    analyze_workbook,
+                    todo,
+                    [source] * len(todo),
+                    [templates] * len(todo),
+                    [strains] * len(todo),
+                    digests,
+                    [subtype] * len(todo),
+                )
+            )
+    else:
+        parsed = [
+            analyze_workbook(path, source=source, layouts=templates, strains=strains, sha256=sha256, subtype=subtype)
+            for path, sha256 in zip(todo, digests)
+        ]
+
+    for result in parsed:
+        results[result["file"]] = result
+        if result["error"] is None:
+            cached[result["sha256"] + suffix] = result["sheets"]
+    if cache and parsed:
+        with open(cache, "w") as fh:
+            json.dump(cached, fh)
+    if layouts and parsed:
+        write_layouts(layouts, templates, parsed)
+    return [results[path] for path in paths]
+
+
+# Columns of the TSV written by write_results, one row per sheet
+RESULT_COLUMNS = [
+    "file", "sha256", "sheet", "error",
+    "col_start", "col_end", "row_start", "row_end",
+    "virus_col_idx", "virus_passage_col_idx", "serum_id_row_idx", "serum_passage_row_idx", "serum_abbrev_row_idx",
+    "virus_names", "serum_mapping", "serum_scores", "n_blocks",
+]
+
+
+def write_results(results, output=None):
+    """
+    Write analyze_batch results as TSV (one row per sheet) if output ends with .tsv, and as JSON otherwise or to stdout.
+    """
+    if not (output and output.endswith(".tsv")):
+        if output:
+            with open(output, "w") as fh:
+                json.dump(results, fh, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+        return
+
+    with open(output, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=RESULT_COLUMNS, delimiter="\t", lineterminator="\n")
+        writer.writeheader()
+        for result in results:
+            row = {"file": result["file"], "sha256": result["sha256"], "error": result["error"]}
+            for sheet in result["sheets"] or [{}]:
+                sheet_row = dict(row, sheet=sheet.get("sheet"), n_blocks=len(sheet["blocks"]) if sheet else None)
+                if sheet.get("bounds"):
+                    sheet_row.update(sheet["bounds"])
+                    sheet_row.update({k: v for k, v in sheet["virus_block"].items() if k != "virus_names"})
+                    sheet_row.update(
+                        {k: v for k, v in sheet["serum_block"].items() if k not in ["serum_mapping", "serum_scores"]}
+                    )
+                    sheet_row["virus_names"] = json.dumps(sheet["virus_block"]["virus_names"])
+                    sheet_row["serum_mapping"] = json.dumps(sheet["serum_block"]["serum_mapping"])
+                    sheet_row["serum_scores"] = json.dumps(sheet["serum_block"]["serum_scores"])
+                writer.writerow(sheet_row)
+
+
+# Columns of the titer records written by write_titers
+TITER_COLUMNS = [
+    "file", "sheet", "block",
+    "virus", "virus_passage",
+    "serum", "serum_score", "serum_abbrev", "serum_id", "serum_passage",
+    "titer",
+]
+
+
+def format_titer(value, titer):
+    """
+    Format a titer cell as text, e.g. 80.0 -> "80" and "<10" -> "< 10", given its parsed titer from classify_cells.
+    """
+    number = str(int(titer)) if float(titer).is_integer() else str(titer)
+    return f"< {number}" if isinstance(value, str) else number
+
+
+def extract_titers(cells, result, file=None):
+    """
+    Yield one record (a dict with the TITER_COLUMNS) per titer in the blocks found by analyze_sheet.
+
+    block is the index of the block in the sheet. Annotations that were not found are left empty,
+    serum is the full name from the serum mapping and serum_score its match score.
+    """
+    values = cells["values"]
+
+    def text(row_idx, col_idx):
+        return "" if row_idx is None or col_idx is None else str(values[row_idx, col_idx])
+
+    for block_idx, block in enumerate(result["blocks"]):
+        bounds = block["bounds"]
+        virus_block = block["virus_block"]
+        serum_block = block["serum_block"]
+
+        # Serum annotations, per column of the block
+        sera = {}
+        for col_idx in range(bounds["col_start"], bounds["col_end"] + 1):
+            serum_abbrev = text(serum_block["serum_abbrev_row_idx"], col_idx)
+            sera[col_idx] = {
+                "serum": serum_block["serum_mapping"].get(serum_abbrev, ""),
+                "serum_score": serum_block["serum_scores"].get(serum_abbrev),
+                "serum_abbrev": serum_abbrev,
+                "serum_id": text(serum_block["serum_id_row_idx"], col_idx),
+                "serum_passage": text(serum_block["serum_passage_row_idx"], col_idx),
+            }
+
+        for row_idx in range(bounds["row_start"], bounds["row_end"] + 1):
+            virus = {
+                "virus": text(row_idx, virus_block["virus_col_idx"]),
+                "virus_passage": text(row_idx, virus_block["virus_passage_col_idx"]),
+            }
+            for col_idx in np.flatnonzero(cells["is_titer"][row_idx, bounds["col_start"]:bounds["col_end"] + 1]):
+                col_idx += bounds["col_start"]
+                yield {
+                    "file": file,
+                    "sheet": result["sheet"],
+                    "block": block_idx,
+                    **virus,
+                    **sera[col_idx],
+                    "titer": format_titer(values[row_idx, col_idx], cells["titers"][row_idx, col_idx]),
+                }
+
+
+def extract_batch(paths, titers, source="vidrl", layouts=None, strains=None, subtype=None):
+    """
+    Analyze many Excel files and stream the records of all their titers to the titers file (see write_titers).
+
+    Each sheet is read and classified once for both steps. layouts and strains are the paths of a JSON file of
+    layout templates and of a reference strain catalogue, and subtype that of the sheets, as in analyze_batch.
+    Returns the analyze_workbook results, in the order of paths.
+    """
+    results = []
+    templates = read_layouts(layouts) if layouts else None
+    catalogue = load_catalogue(strains) if strains else None
+
+    def records():
+        for path in paths:
+            result = {"file": path, "sha256": file_sha256(path), "sheets": [], "error": None}
+            results.append(result)
+            try:
+                with open_workbook(path) as workbook:
+                    for worksheet in workbook.sheets():
+                        cells = classify_cells(worksheet)
+                        sheet = analyze_sheet(
+                            worksheet, source=source, cells=cells, layouts=templates, catalogue=catalogue, subtype=subtype
+                        )
+                        result["sheets"].append(sheet)
+                        yield from extract_titers(cells, sheet, file=path)
+            except Exception as error:
+                result["sheets"] = None
+                result["error"] = f"{type(error).__name__}: {error}"
+
+    write_titers(records(), titers)
+    if layouts:
+        write_layouts(layouts, templates, results)
+    return results
+
+
+def write_titers(records, output, batch_size=10000):
+    """
+    Stream titer records to output, as Parquet for a .parquet extension and TSV otherwise.
+
+    Records are written as they come (Parquet in row groups of batch_size), so they are never all held in memory.
+    """
+    if not output.endswith(".parquet"):
+        with open(output, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=TITER_COLUMNS, delimiter="\t", lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(records)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet
+
+    schema = pa.schema(
+        [
+            pa.field(column, {"block": pa.int32(), "serum_score": pa.float64()}.get(column, pa.string()))
+            for column in TITER_COLUMNS
+        ]
+    )
+    with pa.parquet.ParquetWriter(output, schema) as writer:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+def _count_sheets(results, counts):
+    counts["files"] = len(results)
+    counts["sheets"] = sum(len(x["sheets"] or []) for x in results)
+    counts["errors"] = sum(x["error"] is not None for x in results)
+
+
+def main():
+    args = parse_args()
+    if args.titers and (args.jobs != 1 or args.cache):
+        raise ValueError("--titers reads every file in one process, it does not take --jobs or --cache")
+    with instrument.run(args) as timings:
+        _main(args, timings)
+
+
+def _main(args, timings):
+    if args.titers:
+        paths = expand_paths(args.files, args.file_list) if args.files or args.file_list else [os.path.expanduser(args.file)]
+        with timings.stage("extract") as counts:
+            results = extract_batch(
+                paths,
+                args.titers,
+                source=args.source,
+                layouts=args.layouts,
+                strains=args.strains,
+                subtype=args.subtype,
+            )
+            _count_sheets(results, counts)
+        if args.output:
+            with timings.stage("write_results"):
+                write_results(results, args.output)
+        return
+
+    if args.files or args.file_list:
+        paths = expand_paths(args.files, args.file_list)
+        with timings.stage("analyze") as counts:
+            results = analyze_batch(
+                paths,
+                source=args.source,
+                jobs=args.jobs,
+                cache=args.cache,
+                layouts=args.layouts,
+                strains=args.strains,
+                subtype=args.subtype,
+            )
+            _count_sheets(results, counts)
+        with timings.stage("write_results"):
+            write_results(results, args.output)
+        return
+
+    # Load the Excel file, sheets are read one at a time
+    with open_workbook(os.path.expanduser(args.file)) as workbook:
+        for worksheet in workbook.sheets():
+            print(f"Worksheet: {worksheet.name}")
+
+            # Find the block of titers in the worksheet
+            with timings.stage("analyze_sheet") as counts:
+                result = analyze_sheet(
+                    worksheet,
+                    source=args.source,
+                    catalogue=load_catalogue(args.strains) if args.strains else None,
+                    subtype=args.subtype,
+                )
+                counts["cells"] = worksheet.nrows * worksheet.ncols
+            if result["titer_block"] is None:
+                print("No titer block found.")
+                break
+            titer_block = result["titer_block"]
+            virus_block = result["virus_block"]
+            serum_block = result["serum_block"]
+
+            # Print the most likely row and column indices for the titer block
+            print(f"Titer block: n = {titer_block['row_start'][0][1]}x{titer_block['col_start'][0][1]} = {titer_block['row_start'][0][1]*titer_block['col_start'][0][1]}")
+            print(f"  Most likely (n={titer_block['col_start'][0][1]}) col_start: {titer_block['col_start'][0][0]}")
+            print(f"  Most likely (n={titer_block['col_end'][0][1]}) col_end: {titer_block['col_end'][0][0]}")
+            print(f"  Most likely (n={titer_block['row_start'][0][1]}) row_start: {titer_block['row_start'][0][0]}")
+            print(f"  Most likely (n={titer_block['row_end'][0][1]}) row_end: {titer_block['row_end'][0][0]}")
+
+            # Several plates in the same sheet blend into the most likely indices, print each block found
+            if len(result["blocks"]) > 1:
+                print(f"Titer blocks: {len(result['blocks'])}")
+                for block in result["blocks"]:
+                    print(f"  {block['bounds']} confidence: {block['confidence']}")
+
+            # For debugging purposes, print alternative indices (e.g. col_start, col_end, row_start, row_end)
+            # print("Alternative indices:")
+            # for i in range(1, len(titer_block['row_start'])):
+            #     print(f"  Alternative (n={titer_block['row_start'][i][1]}) row_start: {titer_block['row_start'][i][0]}")
+
+            # Print Virus and Serum annotations row and column indices
+            print("Virus (antigen) block: left and right of the titer block")
+            print(f"  virus column index: {virus_block['virus_col_idx']}")
+            print(f"  virus passage column index: {virus_block['virus_passage_col_idx']}")
+            print(f"  virus names: {virus_block['virus_names']}")
+
+            print("Serum (antisera) block: above the titer block")
+            print(f"  serum ID row index: {serum_block['serum_id_row_idx']}")
+            print(f"  serum passage row index: {serum_block['serum_passage_row_idx']}")
+            print(f"  serum abbreviated name row index: {serum_block['serum_abbrev_row_idx']}")
+
+            # Match abbreviated names across the top to the full names along the left side and auto convert to full names
+            if serum_block["serum_abbrev_row_idx"] is not None:
+                # print("Serum mapping:")
+                # for abbrev, full in serum_block["serum_mapping"].items():
+                #     print(f"  {abbrev} -> {full}")
+
+                print("serum_mapping = {")
+                for abbrev, full in serum_block["serum_mapping"].items():
+                    print(f"    '{abbrev}': '{full}',  # score {serum_block['serum_scores'][abbrev]}")
+                print("}")
+                unmatched = [abbrev for abbrev in serum_block["serum_scores"] if abbrev not in serum_block["serum_mapping"]]
+                if unmatched:
+                    print(f"Unmatched sera: {unmatched}")
 
 
 if __name__ == "__main__":
@@ -30,76 +30,76 @@ examples.
   print(merged_df)
 """
 # ===== Dependencies
-import argparse
+import concurrent.futures
+import csv
+import heapq
+import io
+import math
 import os
 import sys
+import tempfile
 
 import numpy as np
 import pandas as pd
 
+try:
+    from buildings import instrument
+    from buildings.lookup import index_path, index_stamp
+    from buildings.options import SENTINELS, merge_parser
+except ImportError:  # Run as a script, python buildings/uniq_merge.py
+    import instrument
+    from lookup import index_path, index_stamp
+    from options import SENTINELS, merge_parser
+
 
 # (2) Define command line arguments
 def parse_args():
-    # Main help command
-    parser = argparse.ArgumentParser(
-        description="Harmonize and merge pandas DataTables such that conflicting data is not lost."
-    )
-    # Add first argument
-    parser.add_argument("--cache", help="Path to cache of cleaned data.", required=True)
-    parser.add_argument("--new", help="Path to new data.", required=True)
-    parser.add_argument(
-        "--cache_delim",
-        default="\t",
-        help="delimiter for cache of cleaned data.",
-        required=False,
-    )
-    parser.add_argument(
-        "--new_delim", default="\t", help="delimiter for new data.", required=False
-    )
-    parser.add_argument(
-        "--outfile",
-        default="merged_cache_new.tsv",
-        help="Merged file [default: merged_cache_new.tsv].",
-        required=False,
-    )
-    parser.add_argument(
-        "--outfile_excel",
-        default="merged_cache_new.xlsx",
-        help="Merged file [default: merged_cache_new.xlsx].",
-        required=False,
-    )
-    parser.add_argument(
-        "--outfile_delim",
-        default="\t",
-        help="delimiter for outfile data.",
-        required=False,
-    )
-    parser.add_argument(
-        "--groupby_col",
-        default="strain",
-        help="Group by column name [default 'strain'].",
-        required=False,
-    )
-    parser.add_argument(
-        "--conflict_resolution",
-        choices=["left", "right", "join"],
-        default="join",
-        help="Specify how to handle conflicting values [default: 'join'].",
-        required=False,
-    )
-
-    return parser.parse_args()
+    return merge_parser().parse_args()
 
 
 # ===== Reusable functions
-def _drop_uninformative_cols(df: pd.DataFrame) -> pd.DataFrame:
-    """Drops uninformative columns from a pandas DataFrame for being all empty. Used by merge_two."""
-    return df.replace("", np.nan).replace("-N/A-", np.nan).dropna(how="all", axis=1)
+
+
+def profile_columns(df: pd.DataFrame, sentinels: tuple = SENTINELS) -> pd.DataFrame:
+    """Counts the missing values and sentinels of each column of a DataFrame, in one read-only pass.
+
+    Args:
+      df:
+        The DataFrame to profile, left untouched
+      sentinels:
+        Values standing for missing data besides NA
+
+    Returns:
+      A DataFrame indexed by column with the number of non_null values, how many of them are sentinels,
+      and whether the column is informative (holds any other value).
+    """
+    sentinels = list(sentinels)
+    non_null, n_sentinels = [], []
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i]
+        non_null.append(int(values.notna().sum()))
+        n_sentinels.append(int(values.isin(sentinels).sum()) if sentinels else 0)
+    profile = pd.DataFrame({"non_null": non_null, "sentinels": n_sentinels}, index=df.columns)
+    profile["informative"] = profile["non_null"] > profile["sentinels"]
+    return profile
+
+
+def _drop_uninformative_cols(
+    df: pd.DataFrame, profile: pd.DataFrame = None, sentinels: tuple = SENTINELS
+) -> pd.DataFrame:
+    """Drops the columns of a pandas DataFrame holding only NA and sentinels, by selection. Used by merge_two.
+
+    Takes the profile_columns of df if already computed.
+    """
+    if profile is None:
+        profile = profile_columns(df, sentinels)
+    informative = profile["informative"].to_numpy()
+    return df if informative.all() else df.loc[:, informative]
 
 
 def _resolve_conflicts(x: "pd.Series[str]", resolution: str) -> str:
     """Resolves conflicting values based on the specified resolution strategy. Used by merge_two."""
-    cx = x.replace("", np.nan).replace("-N/A-", np.nan).replace("?", np.nan).dropna().unique()
+    cx = x[~x.isin(SENTINELS)].dropna().unique()
     if len(cx) >= 1:
         if resolution == "left":
             return cx[0]
@@ -109,24 +109,365 @@ def _resolve_conflicts(x: "pd.Series[str]", resolution: str) -> str:
             # split substrings by delimiter and flatten list
             my_list = [i.split(',') for i in cx]
             flat_list = [item for sublist in my_list for item in sublist]
-            # return unique values joined by delimiter
-            return ",".join(list(set(flat_list)))
+            # return unique values, in order of first appearance, joined by delimiter
+            return ",".join(dict.fromkeys(flat_list))
     else:
         return ""
 
 
+def _mask_sentinels(df: pd.DataFrame, sentinels: tuple = SENTINELS) -> pd.DataFrame:
+    """Replaces sentinel values with NaN across the whole DataFrame. Used by _resolve_conflicts_frame."""
+    return df.mask(df.isin(list(sentinels)))
+
+
+def _encode_categories(
+    df: pd.DataFrame,
+    groupby_col: str,
+    max_ratio: float = 0.5,
+    sentinels: tuple = SENTINELS,
+    masked_cols: list = None,
+) -> pd.DataFrame:
+    """Encodes groupby_col and the low cardinality columns of a DataFrame as categoricals, masking sentinels.
+
+    The inputs of a merge are concatenated first, so each column gets a single
+    dictionary shared by all of them. Sentinels in the value columns are coded as
+    missing values, which also masks them. A value column is encoded
+    when its distinct values are at most max_ratio of its rows, estimated on the
+    first rows. The other value columns are masked as they are, only those in
+    masked_cols if given (the columns profile_columns found sentinels in). Used
+    by merge_two and merge_many, decoded by _decode_categories.
+    """
+    sentinels = list(sentinels)
+    sample = df.head(10000)
+    encoded = {}
+    for col in df.columns:
+        if col != groupby_col and sample[col].nunique() > max_ratio * len(sample):
+            encoded[col] = _mask_column(df[col], sentinels, masked_cols)
+            continue
+        codes, uniques = pd.factorize(df[col])
+        if col != groupby_col:
+            if len(uniques) > max_ratio * len(df):
+                encoded[col] = _mask_column(df[col], sentinels, masked_cols)
+                continue
+            is_sentinel = pd.Index(uniques).isin(sentinels)
+            codes = np.where(is_sentinel[np.maximum(codes, 0)] & (codes >= 0), -1, codes)
+        encoded[col] = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(uniques))
+    return pd.DataFrame(encoded, index=df.index)
+
+
+def _mask_column(s: pd.Series, sentinels: list, masked_cols: list = None) -> pd.Series:
+    """Replaces the sentinels of a column with NaN, unless masked_cols is given and leaves it out. Used by _encode_categories."""
+    if not sentinels or (masked_cols is not None and s.name not in masked_cols):
+        return s
+    return s.mask(s.isin(sentinels))
+
+
+def _decode_categories(df: pd.DataFrame, fill_value: str = None) -> pd.DataFrame:
+    """Decodes the categorical columns and index of a DataFrame back to their values. Used by _resolve_conflicts_frame.
+
+    Missing values of the categorical columns become fill_value if given.
+    """
+
+    def decode(values, fill_value=None):
+        # Take the values of the codes from the categories' own array, filling missing values with an extra category
+        categories, codes = values.categories, values.codes
+        if fill_value is not None:
+            categories = categories.append(pd.Index([fill_value], dtype=categories.dtype))
+            codes = np.where(codes < 0, len(categories) - 1, codes)
+        return categories.array.take(codes, allow_fill=True)
+
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = decode(df[col].array, fill_value)
+    if isinstance(df.index, pd.CategoricalIndex):
+        df.index = pd.Index(decode(df.index.array), name=df.index.name)
+    return df
+
+
+def _contains_delim(s: pd.Series) -> pd.Series:
+    """Flags string values containing the join delimiter, these need the per cell fallback. Used by _resolve_conflicts_frame."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # Check each distinct value once
+        in_categories = _contains_delim(pd.Series(s.cat.categories)).to_numpy()
+        codes = s.cat.codes.to_numpy()
+        return pd.Series(in_categories[codes] & (codes >= 0), index=s.index) if len(in_categories) else pd.Series(False, index=s.index)
+    if pd.api.types.infer_dtype(s, skipna=True) in ("string", "mixed"):
+        return s.str.contains(",", regex=False, na=False).astype(bool)
+    return pd.Series(False, index=s.index)
+
+
+def _join_conflicts(values: list) -> str:
+    """Same as _resolve_conflicts(x, "join") for values whose sentinels are already masked, without the Series overhead."""
+    cx = list(dict.fromkeys(x for x in values if pd.notna(x)))
+    flat_list = [item for i in cx for item in i.split(",")]
+    return ",".join(dict.fromkeys(flat_list))
+
+
+# Columns of the conflict report of merge_two and merge_many, after groupby_col
+CONFLICT_COLUMNS = ["column", "value", "source"]
+
+
+def _collect_conflicts(
+    keys: pd.Series, values: pd.DataFrame, sources: np.ndarray, nunique: pd.DataFrame, groupby_col: str
+) -> pd.DataFrame:
+    """Lists every distinct value, with the source it came from, of the cells holding several distinct values.
+
+    Takes the rows of the keys appearing several times and their per key
+    nunique from the grouping pass of _resolve_conflicts_frame. Returns one
+    row per (key, column, value, source), in key order. Used by _resolve_conflicts_frame.
+    """
+    is_conflict = nunique > 1
+    frames = []
+    for col in values.columns:
+        conflict_keys = is_conflict.index[is_conflict[col].to_numpy()]
+        if len(conflict_keys) == 0:
+            continue
+        rows = keys.isin(conflict_keys).to_numpy() & values[col].notna().to_numpy()
+        frames.append(
+            pd.DataFrame(
+                {
+                    groupby_col: np.asarray(keys[rows], dtype=object),
+                    "column": col,
+                    "value": np.asarray(values[col][rows], dtype=object),
+                    "source": sources[rows],
+                }
+            )
+        )
+    if len(frames) == 0:
+        return pd.DataFrame(columns=[groupby_col] + CONFLICT_COLUMNS)
+    conflicts = pd.concat(frames, ignore_index=True).drop_duplicates()
+    return conflicts.sort_values(groupby_col, kind="stable").reset_index(drop=True)
+
+
+def _resolve_conflicts_frame(
+    df: pd.DataFrame,
+    groupby_col: str,
+    resolution: str,
+    sources: np.ndarray = None,
+    report_sources: np.ndarray = None,
+    sentinels: tuple = SENTINELS,
+):
+    """Columnar equivalent of df.groupby(groupby_col).agg(lambda x: _resolve_conflicts(x, resolution)).
+
+    Sentinels are masked once for the whole frame, groups with a single row are
+    taken as is, and groups with several rows are resolved with cythonized
+    groupby reductions. Only cells that hold real conflicts (or comma separated
+    values in 'join' mode) fall back to _join_conflicts. Used by merge_two and merge_many.
+
+    If sources gives the input each row came from, 'right' takes the value from
+    the last source holding one, rather than the last value in order of first
+    appearance across all rows.
+
+    If report_sources gives the input each row came from, the conflicts found
+    while grouping are returned too, as a (merged, conflicts) tuple (see _collect_conflicts).
+
+    sentinels=None skips the masking, for frames already masked by _encode_categories.
+    """
+    keep = df[groupby_col].notna().to_numpy()
+    df = df[keep].reset_index(drop=True)
+    if sources is not None:
+        sources = np.asarray(sources)[keep]
+    if report_sources is not None:
+        report_sources = np.asarray(report_sources)[keep]
+    keys = df[groupby_col]
+    values = df.drop(columns=groupby_col)
+    if sentinels is not None:
+        values = _mask_sentinels(values, sentinels)
+
+    # Most strains appear in a single input, these need no resolution at all
+    is_single = ~keys.duplicated(keep=False)
+    single_df = values[is_single]
+    single_df.index = keys[is_single]
+    multi_keys = keys[~is_single]
+    multi_values = values[~is_single]
+    grouped = multi_values.groupby(multi_keys, sort=False, observed=True)
+    nunique = grouped.nunique() if resolution == "join" or report_sources is not None else None
+
+    # Cells that need the per cell fallback, indexed by key
+    fallback_df = None
+    if resolution == "left":
+        multi_df = grouped.first()
+    elif resolution == "right":
+        # _resolve_conflicts picks the last value in order of first appearance
+        dedupe_on = [multi_keys] if sources is None else [multi_keys, sources[~is_single.to_numpy()]]
+        first_seen = pd.DataFrame(
+            {
+                col: multi_values[col].mask(
+                    pd.MultiIndex.from_arrays(dedupe_on + [multi_values[col]]).duplicated()
+                )
+                for col in multi_values.columns
+            },
+            index=multi_values.index,
+        )
+        multi_df = first_seen.groupby(multi_keys, sort=False, observed=True).last()
+    else:
+        multi_df = grouped.first()
+        has_delim = pd.DataFrame(
+            {col: _contains_delim(values[col]) for col in values.columns},
+            index=values.index,
+        )
+        single_fallback = has_delim[is_single]
+        single_fallback.index = single_df.index
+        multi_fallback = has_delim[~is_single].groupby(multi_keys, sort=False, observed=True).any()
+        multi_fallback = multi_fallback | (nunique > 1)
+        fallback_df = pd.concat([single_fallback, multi_fallback])
+
+    merged_df = pd.concat([x for x in [single_df, multi_df] if len(x) > 0])
+    if len(merged_df) == 0:
+        merged_df = values.iloc[:0]
+        merged_df.index = keys.iloc[:0]
+    is_encoded = [isinstance(merged_df[col].dtype, pd.CategoricalDtype) for col in merged_df.columns]
+    merged_df = _decode_categories(merged_df, fill_value="")
+
+    if fallback_df is not None:
+        for col in values.columns:
+            fallback_keys = fallback_df.index[fallback_df[col].to_numpy()]
+            if len(fallback_keys) == 0:
+                continue
+            in_fallback = keys.isin(fallback_keys)
+            groups = {}
+            for key, value in zip(keys[in_fallback], values.loc[in_fallback, col]):
+                groups.setdefault(key, []).append(value)
+            merged_df.loc[list(groups), col] = [_join_conflicts(x) for x in groups.values()]
+
+    merged_df = merged_df.sort_index().fillna(
+        {col: "" for col, encoded in zip(merged_df.columns, is_encoded) if not encoded}
+    )
+    if report_sources is not None:
+        is_multi = ~is_single.to_numpy()
+        return merged_df, _collect_conflicts(multi_keys, multi_values, report_sources[is_multi], nunique, groupby_col)
+    return merged_df
+
+
+def _to_ipc(df: pd.DataFrame):
+    """Serializes a DataFrame as an Arrow IPC stream to ship it to a worker process.
+
+    Categorical columns only keep the categories they use: a partition sliced
+    from the encoded frame would otherwise ship (and its worker decode) the
+    dictionaries of the whole frame, every key included. Falls back to the
+    DataFrame itself (pickled by the pool) if pyarrow is not installed or
+    cannot convert its columns. Used by _resolve_conflicts_parallel.
+    """
+    categorical = [col for col, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    if categorical:
+        df = df.copy(deep=False)
+        for col in categorical:
+            df[col] = df[col].cat.remove_unused_categories()
+    try:
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (ImportError, TypeError, ValueError):
+        return df
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _from_ipc(payload) -> pd.DataFrame:
+    """Inverse of _to_ipc."""
+    if isinstance(payload, pd.DataFrame):
+        return payload
+    import pyarrow as pa
+
+    return pa.ipc.open_stream(payload).read_all().to_pandas()
+
+
+def _resolve_partition(
+    payload,
+    groupby_col: str,
+    resolution: str,
+    sources: np.ndarray = None,
+    report_sources: np.ndarray = None,
+    sentinels: tuple = SENTINELS,
+):
+    """Resolves one partition in a worker process. Used by _resolve_conflicts_parallel."""
+    resolved = _resolve_conflicts_frame(
+        _from_ipc(payload), groupby_col, resolution, sources=sources, report_sources=report_sources, sentinels=sentinels
+    )
+    if report_sources is not None:
+        return _to_ipc(resolved[0].reset_index()), resolved[1]
+    return _to_ipc(resolved.reset_index())
+
+
+def _resolve_conflicts_parallel(
+    df: pd.DataFrame,
+    groupby_col: str,
+    resolution: str,
+    jobs: int,
+    sources: np.ndarray = None,
+    report_sources: np.ndarray = None,
+    sentinels: tuple = SENTINELS,
+):
+    """Same as _resolve_conflicts_frame, with the rows hash partitioned by groupby_col across jobs processes.
+
+    All rows sharing a key land in the same partition, keeping their order, so
+    each partition resolves independently. The partitions are reassembled in
+    sorted key order. Used by merge_two and merge_many.
+    """
+    keys = df[groupby_col]
+    parts = (pd.util.hash_pandas_object(keys, index=False).to_numpy() % jobs).astype(np.int64)
+    parts[keys.isna().to_numpy()] = -1
+    if sources is not None:
+        sources = np.asarray(sources)
+    if report_sources is not None:
+        report_sources = np.asarray(report_sources)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for i in range(jobs):
+            in_part = parts == i
+            if not in_part.any():
+                continue
+            futures.append(
+                pool.submit(
+                    _resolve_partition,
+                    _to_ipc(df[in_part]),
+                    groupby_col,
+                    resolution,
+                    None if sources is None else sources[in_part],
+                    None if report_sources is None else report_sources[in_part],
+                    sentinels,
+                )
+            )
+        resolved = [x.result() for x in futures]
+
+    if len(resolved) == 0:
+        return _resolve_conflicts_frame(
+            df, groupby_col, resolution, sources=sources, report_sources=report_sources, sentinels=sentinels
+        )
+    if report_sources is None:
+        return pd.concat([_from_ipc(x).set_index(groupby_col) for x in resolved]).sort_index()
+    merged_df = pd.concat([_from_ipc(x).set_index(groupby_col) for x, _ in resolved]).sort_index()
+    conflicts = [x for _, x in resolved if len(x) > 0]
+    if len(conflicts) == 0:
+        return merged_df, resolved[0][1]
+    conflicts = pd.concat(conflicts, ignore_index=True)
+    return merged_df, conflicts.sort_values(groupby_col, kind="stable").reset_index(drop=True)
+
+
+def _columns_with_sentinels(profiles: list) -> set:
+    """Columns holding sentinels in any of the profiled inputs, the only ones left to mask. Used by merge_two and merge_many."""
+    return {col for profile in profiles for col in profile.index[profile["sentinels"].to_numpy() > 0]}
+
+
 # Merge and harmonize two datasets, flag conflicts with commas
 def merge_two(
     df1: pd.DataFrame,
     df2: pd.DataFrame,
     groupby_col: str = "strain",
     conflict_resolution: str = "join",
-) -> pd.DataFrame:
+    jobs: int = 1,
+    conflicts: bool = False,
+    sentinels: tuple = SENTINELS,
+):
     """Harmonizes and merges two pandas DataFrames.
 
     Takes two pandas DataFrames through the following 3 steps:
 
-    1. Drops any columns in either which are all NA, "-N/A", or empty strings
+    1. Drops any columns in either which are all NA or sentinels ("-N/A-", "?" or empty strings by default)
     2. Harmonizes their columns such that columns in the left DataFrame are preferentially listed first
     3. Combines the DataFrames by group defined in groupby_col such that:
       * unique values are merged
@@ -144,45 +485,615 @@ def merge_two(
           'left': Use the value from the left DataFrame (df1)
           'right': Use the value from the right DataFrame (df2)
           'join': Join conflicting values using a comma separator (default)
+      jobs:
+        Number of processes resolving conflicts, rows are partitioned by groupby_col across them (default 1)
+      conflicts:
+        Also return a report of the conflicting values, collected while grouping (default False)
+      sentinels:
+        Values standing for missing data besides NA, they never conflict
 
     Returns:
-      A merged and harmonized dataset of containing information from df1 and df2.
+      A merged and harmonized dataset of containing information from df1 and df2. 'join' lists the values
+      in order of first appearance, df1 first.
+
+      With conflicts, a (merged, conflicts) tuple. conflicts has one row per distinct value of each cell
+      holding several distinct values, with the groupby_col, column, value and source (0 for df1, 1 for df2)
+      it came from.
 
     Raises:
       TBD
     """
-    # Drop uninformative columns
-    df1 = _drop_uninformative_cols(df1)
-    df2 = _drop_uninformative_cols(df2)
+    # Drop uninformative columns, profiling each input once
+    profiles = [profile_columns(x, sentinels) for x in (df1, df2)]
+    df1 = _drop_uninformative_cols(df1, profiles[0])
+    df2 = _drop_uninformative_cols(df2, profiles[1])
+    masked_cols = _columns_with_sentinels(profiles)
 
     # Harmonize columns
     new_col = [x for x in df2.columns.tolist() if x not in set(df1.columns.tolist())]
     h_df1_df = df1.reindex(df1.columns.tolist() + new_col, axis=1)
     h_df2_df = df2.reindex(df1.columns.tolist() + new_col, axis=1)
 
+    # Encode the key and repetitive columns with one dictionary across both inputs, masking sentinels
+    df = _encode_categories(
+        pd.concat([h_df1_df, h_df2_df]), groupby_col, sentinels=sentinels, masked_cols=masked_cols
+    )
+
+    # Unique and merge conflicting data
+    report_sources = np.repeat([0, 1], [len(h_df1_df), len(h_df2_df)]) if conflicts else None
+    if jobs > 1:
+        return _resolve_conflicts_parallel(
+            df, groupby_col, conflict_resolution, jobs, report_sources=report_sources, sentinels=None
+        )
+    merged_df = _resolve_conflicts_frame(
+        df, groupby_col, conflict_resolution, report_sources=report_sources, sentinels=None
+    )
+    return merged_df
+
+
+def merge_many(
+    frames: list,
+    groupby_col: str = "strain",
+    conflict_resolution: str = "join",
+    jobs: int = 1,
+    conflicts: bool = False,
+    sentinels: tuple = SENTINELS,
+):
+    """Harmonizes and merges any number of pandas DataFrames in a single grouping pass.
+
+    Same steps as merge_two, but the columns of all DataFrames are harmonized
+    once and their rows resolved together, instead of regrouping the
+    accumulated DataFrame for every additional source.
+
+    Args:
+      frames:
+        The pandas DataTables to merge, in order of precedence from left to right. Columns of earlier
+        DataTables are listed first.
+      groupby_col:
+        The id column that is shared by all DataTables
+      conflict_resolution:
+        Specify how to handle conflicting values. Options are:
+          'left': Use the value from the leftmost DataFrame holding one
+          'right': Use the value from the rightmost DataFrame holding one
+          'join': Join conflicting values using a comma separator (default)
+        With one row per id in each DataFrame this gives the same result as chaining merge_two.
+      jobs:
+        See merge_two
+      conflicts:
+        See merge_two, the source of a value is the index of its DataFrame in frames
+      sentinels:
+        See merge_two
+
+    Returns:
+      A merged and harmonized dataset containing information from all frames, or a (merged, conflicts)
+      tuple with conflicts.
+
+    Raises:
+      ValueError: no frames were given
+    """
+    if len(frames) == 0:
+        raise ValueError("merge_many needs at least one DataFrame")
+
+    # Drop uninformative columns, profiling each input once
+    profiles = [profile_columns(x, sentinels) for x in frames]
+    frames = [_drop_uninformative_cols(x, profile) for x, profile in zip(frames, profiles)]
+    masked_cols = _columns_with_sentinels(profiles)
+
+    # Harmonize columns
+    cols = []
+    for df in frames:
+        cols += [x for x in df.columns.tolist() if x not in set(cols)]
+    h_frames = [x.reindex(cols, axis=1) for x in frames]
+
+    # Encode the key and repetitive columns with one dictionary across all inputs, masking sentinels
+    df = _encode_categories(pd.concat(h_frames), groupby_col, sentinels=sentinels, masked_cols=masked_cols)
+
     # Unique and merge conflicting data
-    merged_df = pd.concat([h_df1_df, h_df2_df]).groupby(groupby_col).agg(
-        lambda x: _resolve_conflicts(x, conflict_resolution)
+    sources = np.repeat(np.arange(len(h_frames)), [len(x) for x in h_frames])
+    report_sources = sources if conflicts else None
+    if jobs > 1:
+        return _resolve_conflicts_parallel(
+            df, groupby_col, conflict_resolution, jobs, sources=sources, report_sources=report_sources, sentinels=None
+        )
+    merged_df = _resolve_conflicts_frame(
+        df, groupby_col, conflict_resolution, sources=sources, report_sources=report_sources, sentinels=None
     )
-    merged_df.columns=[i[0] for i in merged_df.columns]
     return merged_df
 
 
+# File extensions read and written through pyarrow, anything else is delimited text
+_COLUMNAR_FORMATS = {".parquet": "parquet", ".pq": "parquet", ".feather": "feather", ".arrow": "feather"}
+
+
+def _table_format(path: str) -> str:
+    """Returns 'parquet', 'feather' or 'text' based on the extension of path."""
+    return _COLUMNAR_FORMATS.get(os.path.splitext(path)[1].lower(), "text")
+
+
+def read_table(path: str, delim: str = "\t") -> pd.DataFrame:
+    """Reads a data file with every column as strings, like pd.read_csv(dtype=str).
+
+    Parquet and Feather (Arrow IPC) files are chosen by extension and read
+    through pyarrow, other files are read as delimited text.
+
+    Args:
+      path:
+        The data file
+      delim:
+        The delimiter of text files
+
+    Returns:
+      A DataFrame of strings, missing values as NaN.
+    """
+    fmt = _table_format(path)
+    if fmt == "text":
+        return pd.read_csv(path, sep=delim, header=0, dtype=str)
+
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    table = pa.parquet.read_table(path) if fmt == "parquet" else pa.feather.read_table(path)
+    table = table.cast(pa.schema([pa.field(x, pa.string()) for x in table.column_names]))
+    return table.to_pandas()
+
+
+def write_table(df: pd.DataFrame, path: str, delim: str = "\t") -> None:
+    """Writes a merged DataFrame, the inverse of read_table.
+
+    Parquet and Feather files store every column, groupby_col included, as a
+    dictionary encoded string column, so repetitive values are stored once.
+
+    Args:
+      df:
+        A merged DataFrame, indexed by groupby_col
+      path:
+        The output file
+      delim:
+        The delimiter of text files
+    """
+    fmt = _table_format(path)
+    if fmt == "text":
+        df.to_csv(path, sep=delim)
+        return
+
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+    table = table.cast(
+        pa.schema([pa.field(x, pa.dictionary(pa.int32(), pa.string())) for x in table.column_names])
+    )
+    if fmt == "parquet":
+        pa.parquet.write_table(table, path)
+    else:
+        pa.feather.write_feather(table, path)
+
+
+# Rows of an Excel worksheet, the header row included
+EXCEL_MAX_ROWS = 1048576
+
+
+def write_excel(df: pd.DataFrame, path: str, max_rows: int = EXCEL_MAX_ROWS, batch: int = 10000) -> int:
+    """Writes a merged DataFrame to an Excel file row by row, in bounded memory.
+
+    The workbook is written in openpyxl's write-only mode, which streams rows
+    to disk instead of building every cell in memory, and the DataFrame is
+    converted batch rows at a time. Rows past the Excel row limit continue on
+    new sheets (Sheet1, Sheet2, ...), each starting with the header.
+
+    Args:
+      df:
+        A merged DataFrame, indexed by groupby_col
+      path:
+        The .xlsx file
+      max_rows:
+        Rows per sheet, the header included
+      batch:
+        Rows converted at a time
+
+    Returns:
+      The number of sheets written.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    header = [df.index.name] + df.columns.tolist()
+    per_sheet = max_rows - 1
+    n_sheets = max(1, math.ceil(len(df) / per_sheet))
+    for i in range(n_sheets):
+        worksheet = workbook.create_sheet(f"Sheet{i + 1}")
+        worksheet.append(header)
+        sheet_stop = min(len(df), (i + 1) * per_sheet)
+        for start in range(i * per_sheet, sheet_stop, batch):
+            chunk = df.iloc[start: min(start + batch, sheet_stop)].astype(object)
+            for row in chunk.where(chunk.notna(), None).itertuples(name=None):
+                worksheet.append(row)
+    workbook.save(path)
+    return n_sheets
+
+
+def build_cache_index(path: str, groupby_col: str = "strain", delim: str = "\t") -> pd.DataFrame:
+    """Indexes the rows of a merged file by groupby_col without parsing the other fields.
+
+    Args:
+      path:
+        A file written by uniq_merge, with groupby_col as the first column and one row per key in sorted order
+      groupby_col:
+        The id column of the merged file
+      delim:
+        The delimiter of the merged file
+
+    Returns:
+      A DataFrame indexed by groupby_col holding the byte offset and length of each row.
+
+    Raises:
+      ValueError: the file does not start with groupby_col or its keys are not unique and sorted
+    """
+    keys, offsets, lengths = [], [], []
+    bdelim = delim.encode()
+    with open(path, "rb") as fh:
+        header = fh.readline()
+        if header.decode().rstrip("\r\n").split(delim)[0] != groupby_col:
+            raise ValueError(f"{path} does not start with the '{groupby_col}' column")
+        offset = len(header)
+        for line in fh:
+            keys.append(line.split(bdelim, 1)[0].rstrip(b"\r\n").decode())
+            offsets.append(offset)
+            lengths.append(len(line))
+            offset += len(line)
+
+    index = pd.DataFrame(
+        {"offset": offsets, "length": lengths},
+        index=pd.Index(keys, name=groupby_col, dtype=object),
+    )
+    if not (index.index.is_unique and index.index.is_monotonic_increasing):
+        raise ValueError(f"{path} is not a uniq_merge output, '{groupby_col}' values are not unique and sorted")
+    return index
+
+
+def _write_cache_index(index: pd.DataFrame, path: str) -> None:
+    """Writes the key index of a merged file, stamped with the file's size and modification time."""
+    with open(index_path(path), "w") as fh:
+        fh.write(index_stamp(path))
+        index.to_csv(fh, sep="\t")
+
+
+def write_cache_index(path: str, groupby_col: str = "strain", delim: str = "\t") -> pd.DataFrame:
+    """Builds and writes the key index of a merged file (<path>.idx), read by lookup.CacheReader and merge_incremental.
+
+    Args:
+      path, groupby_col, delim:
+        See build_cache_index
+
+    Returns:
+      The key index, see build_cache_index.
+    """
+    index = build_cache_index(path, groupby_col=groupby_col, delim=delim)
+    _write_cache_index(index, path)
+    return index
+
+
+def _read_cache_index(path: str, groupby_col: str = "strain", delim: str = "\t") -> pd.DataFrame:
+    """Loads the key index of a merged file, rebuilding it if it is missing or stale."""
+    idx_path = index_path(path)
+    if os.path.exists(idx_path):
+        with open(idx_path) as fh:
+            if fh.readline() == index_stamp(path):
+                index = pd.read_csv(fh, sep="\t", header=0, index_col=0, dtype={groupby_col: object}, keep_default_na=False)
+                index.index = index.index.astype(object)
+                return index
+    return write_cache_index(path, groupby_col=groupby_col, delim=delim)
+
+
+def _copy_rows(src, dst, offsets: np.ndarray, lengths: np.ndarray, pad: bytes, batch: int = 100000) -> None:
+    """Copies consecutive rows of a merged file, appending pad (empty fields for new columns) to each. Used by merge_incremental."""
+    for start in range(0, len(offsets), batch):
+        stop = min(start + batch, len(offsets))
+        src.seek(offsets[start])
+        chunk = src.read(int(offsets[stop - 1] + lengths[stop - 1] - offsets[start]))
+        if pad:
+            chunk = b"".join(line[:-1] + pad + b"\n" for line in chunk.splitlines(keepends=True))
+        dst.write(chunk)
+
+
+def merge_incremental(
+    cache: str,
+    new_df: pd.DataFrame,
+    outfile: str,
+    groupby_col: str = "strain",
+    delim: str = "\t",
+    conflict_resolution: str = "join",
+    sentinels: tuple = SENTINELS,
+) -> None:
+    """Merges new data into a previously merged file, only re-resolving the strains present in the new data.
+
+    The rows of the cache that share a key with new_df are fetched by offset
+    through the key index, merged with new_df via merge_two, and spliced back in
+    sorted order. All other rows are copied as raw bytes, gaining empty fields
+    if new_df brings new columns. The key index of outfile is written alongside
+    it so the next run can start from outfile.
+
+    Args:
+      cache:
+        A file written by uniq_merge, see build_cache_index
+      new_df:
+        The new data, as read by main
+      outfile:
+        Path of the merged file, may be the same as cache
+      groupby_col:
+        The id column that is shared by the cache and new_df
+      delim:
+        The delimiter of both the cache and outfile
+      conflict_resolution:
+        See merge_two
+      sentinels:
+        See merge_two
+    """
+    index = _read_cache_index(cache, groupby_col=groupby_col, delim=delim)
+    cache_keys = index.index
+    offsets = index["offset"].to_numpy()
+    lengths = index["length"].to_numpy()
+
+    with open(cache, "rb") as src:
+        header = src.readline()
+        cache_cols = header.decode().rstrip("\r\n").split(delim)
+
+        # Re-resolve only the strains touched by the new data
+        touched = index.loc[cache_keys.intersection(new_df[groupby_col].dropna().unique())]
+        rows = []
+        for offset, length in zip(touched["offset"], touched["length"]):
+            src.seek(offset)
+            rows.append(src.read(length))
+        cache_df = pd.read_csv(io.BytesIO(header + b"".join(rows)), sep=delim, header=0, dtype=str)
+        delta = merge_two(
+            cache_df, new_df, groupby_col=groupby_col, conflict_resolution=conflict_resolution, sentinels=sentinels
+        )
+        new_cols = [x for x in delta.columns if x not in set(cache_cols)]
+        delta = delta.reindex(cache_cols[1:] + new_cols, axis=1).fillna("")
+        delta_rows = [x.encode() for x in delta.to_csv(sep=delim, header=False).splitlines(keepends=True)]
+
+        # Splice the re-resolved rows into the untouched ones
+        pad = (delim * len(new_cols)).encode()
+        if new_cols:
+            header = header.rstrip(b"\r\n") + (delim + delim.join(new_cols)).encode() + b"\n"
+        out_keys, out_lengths = [], []
+        tmpfile = outfile + ".tmp"
+        with open(tmpfile, "wb") as dst:
+            dst.write(header)
+            pos = 0
+            for key, row in zip(delta.index, delta_rows):
+                stop = cache_keys.searchsorted(key)
+                _copy_rows(src, dst, offsets[pos:stop], lengths[pos:stop], pad)
+                out_keys.append(cache_keys[pos:stop])
+                out_lengths.append(lengths[pos:stop] + len(pad))
+                dst.write(row)
+                out_keys.append(pd.Index([key], dtype=object))
+                out_lengths.append(np.array([len(row)]))
+                pos = stop + 1 if stop < len(cache_keys) and cache_keys[stop] == key else stop
+            _copy_rows(src, dst, offsets[pos:], lengths[pos:], pad)
+            out_keys.append(cache_keys[pos:])
+            out_lengths.append(lengths[pos:] + len(pad))
+    os.replace(tmpfile, outfile)
+
+    out_lengths = np.concatenate(out_lengths)
+    out_offsets = len(header) + np.cumsum(out_lengths) - out_lengths
+    out_index = pd.DataFrame(
+        {"offset": out_offsets, "length": out_lengths},
+        index=pd.Index(np.concatenate([x.to_numpy() for x in out_keys]), name=groupby_col, dtype=object),
+    )
+    _write_cache_index(out_index, outfile)
+
+
+# Rough ratio of the in-memory size of a dtype=str DataFrame to the size of the file it was read from
+_FRAME_OVERHEAD = 10
+
+
+def _rows_per_chunk(path: str, budget: int, sample_size: int = 1 << 16) -> int:
+    """Estimates how many rows of a delimited file fit in budget bytes once read. Used by merge_streaming."""
+    with open(path, "rb") as fh:
+        sample = fh.read(sample_size)
+    row_bytes = max(1, len(sample) // max(1, sample.count(b"\n")))
+    return max(1000, budget // (_FRAME_OVERHEAD * row_bytes))
+
+
+def merge_streaming(
+    cache: str,
+    new: str,
+    outfile: str,
+    groupby_col: str = "strain",
+    conflict_resolution: str = "join",
+    cache_delim: str = "\t",
+    new_delim: str = "\t",
+    outfile_delim: str = "\t",
+    max_memory: float = 2048,
+    tmpdir: str = None,
+    sentinels: tuple = SENTINELS,
+) -> None:
+    """Merges two delimited files like merge_two while holding only part of them in memory.
+
+    Both files are read in chunks and hash partitioned by groupby_col into
+    spill files, cache rows ahead of new rows so conflicts resolve in the same
+    order as merge_two. Each partition is then resolved on its own, sorted and
+    spilled again, and the sorted partitions are merged key by key into
+    outfile as rows are finalized.
+
+    Args:
+      cache:
+        Path to the left hand side file, see merge_two
+      new:
+        Path to the right hand side file, see merge_two
+      outfile:
+        Path of the merged file
+      groupby_col:
+        See merge_two
+      conflict_resolution:
+        See merge_two
+      cache_delim, new_delim, outfile_delim:
+        The delimiters of each file
+      max_memory:
+        Approximate memory ceiling in MB, decides the chunk size and the number of partitions
+      tmpdir:
+        Directory for the spill files, defaults to the system temp dir
+      sentinels:
+        See merge_two
+    """
+    budget = int(max_memory * 2**20)
+    n_parts = max(1, math.ceil(_FRAME_OVERHEAD * (os.path.getsize(cache) + os.path.getsize(new)) / budget))
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as spill_dir:
+        # Partition both inputs by key, tracking which columns are informative in each
+        spill_files = [open(os.path.join(spill_dir, f"part{i}.tsv"), "w", newline="") for i in range(n_parts)]
+        cache_cols = pd.read_csv(cache, sep=cache_delim, nrows=0).columns.tolist()
+        new_cols = pd.read_csv(new, sep=new_delim, nrows=0).columns.tolist()
+        spill_cols = cache_cols + [x for x in new_cols if x not in set(cache_cols)]
+        informative = []
+        for path, delim, cols in [(cache, cache_delim, cache_cols), (new, new_delim, new_cols)]:
+            flags = pd.Series(False, index=cols)
+            chunks = pd.read_csv(path, sep=delim, header=0, dtype=str, chunksize=_rows_per_chunk(path, budget))
+            for chunk in chunks:
+                flags |= profile_columns(chunk, sentinels)["informative"]
+                chunk = chunk[chunk[groupby_col].notna()].reindex(spill_cols, axis=1)
+                parts = pd.util.hash_pandas_object(chunk[groupby_col], index=False).to_numpy() % n_parts
+                for i, part in chunk.groupby(parts):
+                    part.to_csv(spill_files[i], sep="\t", header=False, index=False)
+            informative.append([x for x in cols if flags[x] or x == groupby_col])
+        for fh in spill_files:
+            fh.close()
+
+        # Same column order as merge_two
+        out_cols = informative[0] + [x for x in informative[1] if x not in set(informative[0])]
+        out_cols = [x for x in out_cols if x != groupby_col]
+
+        # Resolve and sort each partition on its own
+        for i in range(n_parts):
+            part_path = os.path.join(spill_dir, f"part{i}.tsv")
+            if os.path.getsize(part_path) == 0:
+                continue
+            part = pd.read_csv(
+                part_path, sep="\t", header=None, names=spill_cols, dtype=str, keep_default_na=False, na_values=[""]
+            )
+            merged = _resolve_conflicts_frame(part, groupby_col, conflict_resolution, sentinels=sentinels)
+            merged.reindex(out_cols, axis=1).to_csv(part_path, sep="\t", header=False)
+            del part, merged
+
+        # Merge the sorted partitions into the output
+        sorted_files = [open(os.path.join(spill_dir, f"part{i}.tsv"), newline="") for i in range(n_parts)]
+        with open(outfile, "w", newline="") as out:
+            writer = csv.writer(out, delimiter=outfile_delim, lineterminator=os.linesep)
+            writer.writerow([groupby_col] + out_cols)
+            writer.writerows(
+                heapq.merge(*[csv.reader(fh, delimiter="\t") for fh in sorted_files], key=lambda row: row[0])
+            )
+        for fh in sorted_files:
+            fh.close()
+
+
 def main():
     args = parse_args()
+    if len(args.new) > 1 and (args.max_memory is not None or args.incremental):
+        raise ValueError("--max_memory and --incremental take a single --new")
+    if args.max_memory is not None or args.incremental:
+        if any(_table_format(x) != "text" for x in [args.cache, args.outfile] + args.new):
+            raise ValueError("--max_memory and --incremental work on delimited text files")
+    if args.conflicts and (args.max_memory is not None or args.incremental):
+        raise ValueError("--conflicts works with the in memory merge, not with --max_memory or --incremental")
+    if args.incremental and args.outfile_delim != args.cache_delim:
+        raise ValueError("--incremental requires --outfile_delim to match --cache_delim")
+    if args.index and _table_format(args.outfile) != "text":
+        raise ValueError("--index works on a delimited text --outfile")
 
-    old = pd.read_csv(args.cache, sep=args.cache_delim, header=0, dtype=str)
-    new = pd.read_csv(args.new, sep=args.new_delim, header=0, dtype=str)
+    with instrument.run(args) as timings:
+        if args.max_memory is not None:
+            with timings.stage("merge_streaming"):
+                merge_streaming(
+                    args.cache,
+                    args.new[0],
+                    args.outfile,
+                    groupby_col=args.groupby_col,
+                    conflict_resolution=args.conflict_resolution,
+                    cache_delim=args.cache_delim,
+                    new_delim=args.new_delim,
+                    outfile_delim=args.outfile_delim,
+                    max_memory=args.max_memory,
+                    tmpdir=args.tmpdir,
+                    sentinels=args.sentinels,
+                )
+            if args.index:
+                with timings.stage("write_index"):
+                    write_cache_index(args.outfile, groupby_col=args.groupby_col, delim=args.outfile_delim)
+            return
 
-    merged = merge_two(
-        old,
-        new,
-        groupby_col=args.groupby_col,
-        conflict_resolution=args.conflict_resolution
-    )
-    merged.to_csv(args.outfile, sep=args.outfile_delim)
-    merged.to_excel(args.outfile_excel)
+        if args.incremental:
+            with timings.stage("read") as counts:
+                new = pd.read_csv(args.new[0], sep=args.new_delim, header=0, dtype=str)
+                counts["rows"] = len(new)
+            with timings.stage("merge_incremental"):
+                merge_incremental(
+                    args.cache,
+                    new,
+                    args.outfile,
+                    groupby_col=args.groupby_col,
+                    delim=args.cache_delim,
+                    conflict_resolution=args.conflict_resolution,
+                    sentinels=args.sentinels,
+                )
+            return
+
+        with timings.stage("read") as counts:
+            old = read_table(args.cache, delim=args.cache_delim)
+            new = [read_table(x, delim=args.new_delim) for x in args.new]
+            counts["files"] = 1 + len(new)
+            counts["rows"] = len(old) + sum(len(x) for x in new)
+
+        with timings.stage("merge") as counts:
+            if len(new) == 1:
+                merged = merge_two(
+                    old,
+                    new[0],
+                    groupby_col=args.groupby_col,
+                    conflict_resolution=args.conflict_resolution,
+                    jobs=args.jobs,
+                    conflicts=bool(args.conflicts),
+                    sentinels=args.sentinels,
+                )
+            else:
+                merged = merge_many(
+                    [old] + new,
+                    groupby_col=args.groupby_col,
+                    conflict_resolution=args.conflict_resolution,
+                    jobs=args.jobs,
+                    conflicts=bool(args.conflicts),
+                    sentinels=args.sentinels,
+                )
+            if args.conflicts:
+                merged, conflicts = merged
+                counts["conflicts"] = len(conflicts)
+            counts["rows"], counts["cols"] = merged.shape
+
+        if args.conflicts:
+            with timings.stage("write_conflicts"):
+                paths = np.array([args.cache] + args.new, dtype=object)
+                conflicts["source"] = paths[conflicts["source"].to_numpy(dtype=int)]
+                write_table(conflicts.set_index(args.groupby_col), args.conflicts, delim=args.outfile_delim)
+
+        def write_excel_stage():
+            with timings.stage("write_excel") as counts:
+                counts["sheets"] = write_excel(merged, args.outfile_excel)
+                counts["rows"] = len(merged)
 
+        # The Excel file is written alongside the main output rather than after it
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            excel = pool.submit(write_excel_stage) if args.outfile_excel else None
+            with timings.stage("write") as counts:
+                write_table(merged, args.outfile, delim=args.outfile_delim)
+                counts["rows"] = len(merged)
+            if args.index:
+                with timings.stage("write_index"):
+                    write_cache_index(args.outfile, groupby_col=args.groupby_col, delim=args.outfile_delim)
+            if excel is not None:
+                excel.result()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,17 @@
+from setuptools import setup
+
+setup(
+    name="buildings",
+    version="0.1.0",
+    description="Data wrangling tools: merge metadata tables, find titer blocks in Excel sheets, resize images.",
+    packages=["buildings"],
+    python_requires=">=3.8",
+    install_requires=["numpy", "pandas", "xlrd", "Pillow"],
+    extras_require={
+        "xlsx": ["openpyxl"],
+        "arrow": ["pyarrow"],
+    },
+    entry_points={
+        "console_scripts": ["buildings=buildings.cli:main"],
+    },
+)
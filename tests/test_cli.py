@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+
+import subprocess
+import sys
+
+import pytest
+
+from buildings.cli import COMMANDS, main
+
+
+def _imported_after(argv):
+    # Runs the command line in a fresh interpreter, returns its output and the modules it imported
+    code = (
+        "import sys\n"
+        "from buildings.cli import main\n"
+        "try:\n"
+        f"    main({argv!r})\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print(sorted(x for x in sys.modules if x.split('.')[0] in ('pandas', 'numpy', 'PIL', 'xlrd', 'buildings')))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return out, out.splitlines()[-1]
+
+
+def test_help_is_lazy():
+    # Listing the commands imports none of them, nor their dependencies
+    out, imported = _imported_after(["--help"])
+    for name in COMMANDS:
+        assert name in out
+    assert imported == "['buildings', 'buildings.cli']"
+
+
+@pytest.mark.parametrize("command", ["merge", "titer-block"])
+def test_command_help_is_lazy(command):
+    # The options are parsed before the module running the command, and its pandas or numpy, is imported
+    out, imported = _imported_after([command, "--help"])
+    assert out.startswith(f"usage: buildings {command}")
+    assert imported == "['buildings', 'buildings.cli', 'buildings.instrument', 'buildings.options']"
+
+
+def test_commands(capsys):
+    saved_argv = sys.argv
+    main(["mk-buildyaml", "--sequence", "seqs.fasta", "--metadata", "meta.tsv"])
+    assert "sequences: seqs.fasta" in capsys.readouterr().out
+    assert sys.argv is saved_argv
+
+    main(["mk-nf", "--script", "echo hi"])
+    assert "process example {\n" in capsys.readouterr().out
+    main(["mk-wdl", "--script", "echo hi", "--docker", "ubuntu"])
+    assert "docker: ubuntu" in capsys.readouterr().out
+
+
+def test_command_help(capsys):
+    with pytest.raises(SystemExit) as exc:
+        main(["resize", "--help"])
+    assert exc.value.code == 0
+    assert capsys.readouterr().out.startswith("usage: buildings resize")
+
+
+def test_unknown_command():
+    with pytest.raises(SystemExit) as exc:
+        main(["nope"])
+    assert exc.value.code == 2
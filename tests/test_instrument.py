@@ -0,0 +1,43 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import pstats
+
+from buildings.instrument import Timings, add_arguments, run
+
+
+def test_timings():
+    timings = Timings()
+    for rows in (3, 4):
+        with timings.stage("read") as counts:
+            counts["rows"] = rows
+    with timings.stage("write"):
+        pass
+    assert list(timings.stages) == ["read", "write"]
+    assert timings.stages["read"]["calls"] == 2
+    assert timings.stages["read"]["counts"] == {"rows": 7}
+    assert timings.stages["read"]["seconds"] >= 0
+
+
+def test_timings_disabled():
+    timings = Timings(enabled=False)
+    with timings.stage("read") as counts:
+        counts["rows"] = 3
+    assert timings.stages == {}
+
+
+def test_run(tmp_path, capsys):
+    parser = add_arguments(argparse.ArgumentParser())
+    timings_json, profile = str(tmp_path / "timings.json"), str(tmp_path / "profile")
+    args = parser.parse_args(["--timings", "--timings_json", timings_json, "--profile", profile])
+    with run(args) as timings:
+        with timings.stage("read") as counts:
+            counts["rows"] = sum(range(1000))
+
+    assert "read" in capsys.readouterr().err
+    assert json.load(open(timings_json))["stages"]["read"]["counts"] == {"rows": 499500}
+    assert pstats.Stats(profile).total_calls > 0
+
+    with run(parser.parse_args([])) as timings:
+        assert not timings.enabled
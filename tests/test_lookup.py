@@ -0,0 +1,68 @@
+#! /usr/bin/env python3
+
+import os
+import random
+import sys
+
+import pandas as pd
+import pytest
+
+from buildings import lookup, uniq_merge
+from buildings.lookup import CacheReader, index_path
+
+
+@pytest.fixture
+def merged_file(tmp_path, monkeypatch):
+    rng = random.Random(3)
+    for name in ["cache", "new"]:
+        rows = [f"s{rng.randrange(500)}\t{rng.choice(['a', 'b', 'c,d', ''])}\n" for _ in range(500)]
+        (tmp_path / f"{name}.tsv").write_text(f"strain\t{name}\n" + "".join(rows))
+    path = str(tmp_path / "merged.tsv")
+    argv = ["uniq_merge.py", "--cache", str(tmp_path / "cache.tsv"), "--new", str(tmp_path / "new.tsv")]
+    monkeypatch.setattr(sys, "argv", argv + ["--outfile", path, "--index"])
+    uniq_merge.main()
+    return path, pd.read_csv(path, sep="\t", header=0, dtype=str)
+
+
+def test_cache_reader_matches_full_read(merged_file):
+    path, full = merged_file
+    # Written by uniq_merge --index
+    stamp = os.path.getmtime(index_path(path))
+    with CacheReader(path) as reader:
+        assert os.path.getmtime(index_path(path)) == stamp
+        for i in [0, 1, len(full) // 2, len(full) - 1]:
+            row = reader.get(full["strain"][i])
+            assert row.decode().rstrip("\n").split("\t")[0] == full["strain"][i]
+        assert reader.get("s-1") is None
+        assert reader.get("") is None
+        assert reader.get("zzz") is None
+
+        keys = list(full["strain"].sample(50, random_state=0)) + ["s-1"]
+        expected = full[full["strain"].isin(keys)].reset_index(drop=True)
+        pd.testing.assert_frame_equal(reader.lookup(keys), expected)
+
+
+def test_cache_reader_rebuilds_stale_index(merged_file):
+    path, full = merged_file
+    CacheReader(path).close()
+    # Dropping the first rows moves all the others
+    with open(path) as fh:
+        lines = fh.readlines()
+    with open(path, "w") as fh:
+        fh.writelines(lines[:1] + lines[11:])
+    with CacheReader(path) as reader:
+        assert reader.get(full["strain"][0]) is None
+        assert reader.get(full["strain"][11]).decode() == lines[12]
+
+
+def test_main(merged_file, tmp_path, monkeypatch, capsys):
+    path, full = merged_file
+    (tmp_path / "strains.txt").write_text(f"{full['strain'][5]}\n\nnope\n")
+    outfile = str(tmp_path / "rows.tsv")
+    argv = ["lookup.py", "--cache", path, "--strains", full["strain"][3], "--strain_file", str(tmp_path / "strains.txt")]
+    monkeypatch.setattr(sys, "argv", argv + ["--outfile", outfile])
+    lookup.main()
+    assert "Not found: nope" in capsys.readouterr().err
+    pd.testing.assert_frame_equal(
+        pd.read_csv(outfile, sep="\t", header=0, dtype=str), full.iloc[[3, 5]].reset_index(drop=True)
+    )
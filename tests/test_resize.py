@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+
+import os
+
+import pytest
+from PIL import Image
+
+from buildings.resize import (
+    MANIFEST,
+    output_path,
+    pillow_format,
+    read_manifest,
+    resize_800width,
+    resize_all,
+    resize_image,
+    resize_incremental,
+)
+
+
+@pytest.fixture
+def imgs(tmp_path):
+    """A large portrait JPEG, a small portrait PNG and a landscape JPEG."""
+    paths = []
+    for name, size in [("portrait.jpg", (2000, 3000)), ("small.png", (500, 700)), ("landscape.jpg", (1200, 900))]:
+        path = str(tmp_path / name)
+        Image.new("RGB" if name.endswith(".jpg") else "RGBA", size, (200, 100, 50)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_output_path():
+    assert output_path("imgs/a.png", "out") == os.path.join("out", "a.png")
+    assert output_path("imgs/a.png", "out", "jpeg") == os.path.join("out", "a.jpg")
+    assert output_path("imgs/a.jpg", "out", "WEBP") == os.path.join("out", "a.webp")
+
+
+def test_pillow_format(tmp_path, imgs):
+    assert [pillow_format(x) for x in ["jpg", "JPEG", "tif", "png", "webp"]] == ["JPEG", "JPEG", "TIFF", "PNG", "WEBP"]
+    with pytest.raises(ValueError):
+        pillow_format("nope")
+    outfile = resize_image(imgs[0], str(tmp_path), format="jpg")
+    assert outfile == str(tmp_path / "portrait.jpg")
+    with Image.open(outfile) as img:
+        assert img.format == "JPEG"
+
+
+def test_resize_800width(tmp_path, imgs):
+    outdir = str(tmp_path / "resized")
+    resize_800width(imgs[0], outdir)
+    with Image.open(os.path.join(outdir, "portrait.jpg")) as img:
+        assert img.size == (800, 1200)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_resize_all(tmp_path, imgs, jobs):
+    outdir = str(tmp_path / "out")
+    resized = dict(resize_all(imgs, outdir, new_width=600, format="png", jobs=jobs, max_in_flight=1))
+    assert sorted(resized) == sorted(imgs)
+    sizes = {}
+    for imgfile, outfile in resized.items():
+        with Image.open(outfile) as img:
+            assert (img.format, img.mode) == ("PNG", "RGB")
+            sizes[os.path.basename(outfile)] = img.size
+    # Landscape images, and images narrower than new_width, keep their size
+    assert sizes == {"portrait.png": (600, 900), "small.png": (500, 700), "landscape.png": (1200, 900)}
+
+
+def test_resize_all_quality(tmp_path, imgs):
+    low, high = [
+        dict(resize_all(imgs[:1], str(tmp_path / str(quality)), quality=quality))[imgs[0]]
+        for quality in (10, 95)
+    ]
+    assert os.path.getsize(low) < os.path.getsize(high)
+
+
+def test_resize_incremental(tmp_path, imgs):
+    outdir = str(tmp_path / "out")
+    resized = lambda files=imgs[:2], **kwargs: sorted(x for x, _ in resize_incremental(files, outdir, **kwargs))
+    assert resized() == sorted(imgs[:2])
+    assert resized() == []
+
+    # Copied again: same content, new mtime
+    os.utime(imgs[0], ns=(0, 0))
+    assert resized() == []
+    # New content
+    Image.new("RGB", (1000, 2000), (0, 0, 0)).save(imgs[0])
+    assert resized() == [imgs[0]]
+    # New parameters
+    assert resized(new_width=600) == sorted(imgs[:2])
+
+    # Outputs of deleted images are removed
+    os.remove(imgs[1])
+    assert resized(imgs[:1], new_width=600) == []
+    assert sorted(os.listdir(outdir)) == [MANIFEST, "portrait.jpg"]
+    assert list(read_manifest(outdir)) == [os.path.abspath(imgs[0])]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_resize_all_widths(tmp_path, imgs, jobs):
+    outdir = str(tmp_path / "out")
+    widths = [400, 1600, 800]
+    resized = dict(resize_all(imgs, outdir, widths=widths, format=["png", None, "webp"], quality=80, jobs=jobs))
+    assert sorted(os.listdir(outdir)) == ["1600", "400", "800"]
+    assert resized[imgs[0]] == [
+        os.path.join(outdir, "400", "portrait.png"),
+        os.path.join(outdir, "1600", "portrait.jpg"),
+        os.path.join(outdir, "800", "portrait.webp"),
+    ]
+    sizes = {}
+    for imgfile, outfiles in resized.items():
+        for outfile in outfiles:
+            with Image.open(outfile) as img:
+                sizes[os.path.relpath(outfile, outdir)] = img.size
+    assert sizes == {
+        os.path.join("400", "portrait.png"): (400, 600),
+        os.path.join("1600", "portrait.jpg"): (1600, 2400),
+        os.path.join("800", "portrait.webp"): (800, 1200),
+        # Smaller than some widths, the full size is kept for those
+        os.path.join("400", "small.png"): (400, 560),
+        os.path.join("1600", "small.png"): (500, 700),
+        os.path.join("800", "small.webp"): (500, 700),
+        os.path.join("400", "landscape.png"): (1200, 900),
+        os.path.join("1600", "landscape.jpg"): (1200, 900),
+        os.path.join("800", "landscape.webp"): (1200, 900),
+    }
+
+    with pytest.raises(ValueError):
+        list(resize_all(imgs, outdir, widths=widths, format=["png"]))
+
+
+def test_resize_incremental_widths(tmp_path, imgs):
+    outdir = str(tmp_path / "out")
+    assert len(list(resize_incremental(imgs, outdir, widths=[200, 100]))) == 3
+    assert list(resize_incremental(imgs, outdir, widths=[200, 100])) == []
+    os.remove(os.path.join(outdir, "100", "small.png"))
+    assert [x for x, _ in resize_incremental(imgs, outdir, widths=[200, 100])] == [imgs[1]]
+
+
+def test_resize_incremental_new_outputs(tmp_path, imgs):
+    outdir = str(tmp_path / "out")
+    list(resize_incremental(imgs[:2], outdir, format="png"))
+    # The outputs of the previous format are replaced, not left untracked
+    assert len(list(resize_incremental(imgs[:2], outdir, format="webp"))) == 2
+    assert sorted(os.listdir(outdir)) == [MANIFEST, "portrait.webp", "small.webp"]
+    list(resize_incremental(imgs[:2], outdir, widths=[200, 100]))
+    assert sorted(os.listdir(outdir)) == ["100", "200", MANIFEST]
+
+    # Unless another image is resized to the same output
+    other = str(tmp_path / "other" / "portrait.jpg")
+    os.makedirs(os.path.dirname(other))
+    Image.new("RGB", (300, 600), (0, 0, 0)).save(other)
+    list(resize_incremental([imgs[0], other], outdir, format="png"))
+    list(resize_incremental([imgs[0]], outdir, widths=[200, 100]))
+    assert os.path.exists(os.path.join(outdir, "portrait.png"))
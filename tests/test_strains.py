@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+
+import pytest
+
+from benchmarks.synthetic import make_strains
+from buildings.strains import (
+    EXACT,
+    INITIALS,
+    PREFIX,
+    SUBSEQUENCE,
+    StrainIndex,
+    flu_type,
+    location_score,
+    parse_strain,
+)
+
+
+def test_parse_strain():
+    assert parse_strain("A/Sydney/0101/2022") == ("Sydney", "101", "22")
+    assert parse_strain("A/swine/Iowa/1/2020") == ("Iowa", "1", "20")
+    assert parse_strain("Syd/101/22e") == ("Syd", "101", "22")
+    assert parse_strain("Hong Kong/45/19") == ("Hong Kong", "45", "19")
+    for name in ["", "Syd/101", "Syd/101/2", "Syd//22", 40.0]:
+        assert parse_strain(name) is None
+
+
+@pytest.mark.parametrize(
+    "abbrev, location, score",
+    [
+        ("Sydney", "Sydney", EXACT),
+        ("Syd", "Sydney", PREFIX),
+        ("HK", "Hong Kong", INITIALS),
+        ("Bsb", "Brisbane", SUBSEQUENCE),
+        ("Perth", "Darwin", 0.0),
+        ("Nbs", "Brisbane", 0.0),
+    ],
+)
+def test_location_score(abbrev, location, score):
+    assert location_score(abbrev, location) == score
+
+
+def test_strain_index():
+    index = StrainIndex(["A/Sydney/101/2022", "A/Singapore/101/2022", "A/Hong Kong/45/2019", "not a strain"])
+    assert len(index) == 3
+    assert index.match("Syd/101/22") == ("A/Sydney/101/2022", PREFIX)
+    assert index.match("Sing/101/22") == ("A/Singapore/101/2022", PREFIX)
+    # Distinct names matching equally well are ambiguous
+    assert index.match("S/101/22") == (None, 0.0)
+    assert StrainIndex(["A/Sydney/101/2022"] * 2).match("S/101/22") == ("A/Sydney/101/2022", PREFIX)
+    assert index.match("HK/45/19") == ("A/Hong Kong/45/2019", INITIALS)
+    assert index.match("Syd/101/21") == (None, 0.0)
+    assert index.match("Bsb/101/22") == (None, 0.0)
+    assert index.match("Bsb/101/22", min_score=0.0) == (None, 0.0)
+    assert index.match("Syd") == (None, 0.0)
+
+
+def test_flu_type():
+    assert [flu_type(x) for x in ["A/Sydney/1/2022", "b/Perth/1/2020", "A/swine/Iowa/1/2020"]] == ["A", "B", "A"]
+    assert [flu_type(x) for x in ["Syd/1/22", "HK/Hong Kong/45/2019", ""]] == [None, None, None]
+
+
+def test_strain_index_types():
+    index = StrainIndex(["B/Sydney/5/2022", "A/Sydney/5/2022"])
+    assert index.types() == {"A", "B"}
+    assert index.match("Syd/5/22") == (None, 0.0)
+    assert index.match("Syd/5/22", flu_type="a") == ("A/Sydney/5/2022", PREFIX)
+    assert index.match("Syd/5/22", flu_type="B") == ("B/Sydney/5/2022", PREFIX)
+    assert index.match("Syd/5/22", flu_type="C") == (None, 0.0)
+
+    index = StrainIndex(["A/Sydney/5/2022"], subtype="H3N2").add(["A/Singapore/5/2022"], subtype="H1N1")
+    assert index.match("S/5/22") == (None, 0.0)
+    assert index.match("S/5/22", subtype="h1n1") == ("A/Singapore/5/2022", PREFIX)
+    # Names of unknown subtype are kept
+    index.add(["A/Sapporo/5/2022"])
+    assert index.match("Sap/5/22", subtype="H3N2") == ("A/Sapporo/5/2022", PREFIX)
+
+
+def test_strain_index_from_file(tmp_path):
+    names = make_strains(n_strains=1000)
+    (tmp_path / "strains.txt").write_text("\n".join(names) + "\n")
+    (tmp_path / "metadata.tsv").write_text("date\tstrain\n" + "".join(f"2022\t{x}\n" for x in names))
+    for path in [tmp_path / "strains.txt", tmp_path / "metadata.tsv"]:
+        index = StrainIndex.from_file(str(path))
+        assert len(index) == 1000
+        location, isolate, year = names[0].split("/")[1:]
+        assert index.match(f"{location}/{isolate}/{year[2:]}") == (names[0], EXACT)
+
+    (tmp_path / "subtypes.tsv").write_text("strain\tsubtype\nA/Sydney/5/2022\th3n2\nA/Sydney/5/2022\th1n1\n")
+    index = StrainIndex.from_file(str(tmp_path / "subtypes.tsv"))
+    assert index.match("Syd/5/22", subtype="H3N2") == ("A/Sydney/5/2022", PREFIX)
@@ -0,0 +1,453 @@
+#! /usr/bin/env python3
+
+import csv
+import json
+import sys
+from collections import defaultdict
+
+import numpy as np
+import pytest
+import xlrd
+
+from benchmarks.synthetic import TITERS, Sheet, make_titer_sheet
+from buildings import titer_block
+from buildings.strains import StrainIndex
+from buildings.titer_block import (
+    PATTERNS,
+    TITER_COLUMNS,
+    analyze_batch,
+    analyze_sheet,
+    classify_cells,
+    expand_paths,
+    extract_batch,
+    extract_titers,
+    find_serum_rows,
+    find_titer_block,
+    find_titer_blocks,
+    find_virus_columns,
+    format_titer,
+    is_numeric,
+    main,
+    open_workbook,
+    sheet_fingerprint,
+    write_results,
+    write_titers,
+)
+
+
+def _legacy_find_titer_block(worksheet):
+    """Cell by cell sweep that find_titer_block used before classify_cells."""
+    counts = {x: defaultdict(int) for x in ["col_start", "col_end", "row_start", "row_end"]}
+    for outer, inner, cell, start, end in [
+        (worksheet.nrows, worksheet.ncols, lambda i, j: worksheet.cell_value(i, j), "col_start", "col_end"),
+        (worksheet.ncols, worksheet.nrows, lambda i, j: worksheet.cell_value(j, i), "row_start", "row_end"),
+    ]:
+        for i in range(outer):
+            first, last = None, None
+            for j in range(inner):
+                next_value = cell(i, j + 1) if j + 1 < inner else None
+                if is_numeric(cell(i, j)) and is_numeric(next_value):
+                    first = j if first is None else first
+                    last = j + 1
+            if first is not None:
+                counts[start][first] += 1
+                counts[end][last] += 1
+    return {k: sorted(v.items(), key=lambda item: item[1], reverse=True) for k, v in counts.items()}
+
+
+def _noisy_sheet(seed):
+    worksheet = make_titer_sheet(n_viruses=15, n_sera=8, seed=seed)
+    rng = np.random.default_rng(seed)
+    for _ in range(40):
+        worksheet.rows[rng.integers(worksheet.nrows)][rng.integers(worksheet.ncols)] = rng.choice(
+            [10.0, "< 10", "", "MDCK1", " <40 "]
+        )
+    return worksheet
+
+
+def test_classify_cells():
+    worksheet = Sheet([["A/Perth/1/2022", "< 10", 40.0, "<x"]])
+    cells = classify_cells(worksheet)
+    assert cells["is_titer"].tolist() == [[False, True, True, False]]
+    np.testing.assert_array_equal(cells["titers"], [[np.nan, 10.0, 40.0, np.nan]])
+    assert cells["values"][0, 0] == "A/Perth/1/2022"
+
+
+def test_find_titer_block():
+    titer_block = find_titer_block(make_titer_sheet(n_viruses=20, n_sera=10, row_offset=6, col_offset=3))
+    assert titer_block["col_start"][0] == (3, 20)
+    assert titer_block["col_end"][0] == (12, 20)
+    assert titer_block["row_start"][0] == (6, 11)
+    assert titer_block["row_end"][0] == (25, 11)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_find_titer_block_matches_legacy(seed):
+    worksheet = _noisy_sheet(seed)
+    assert find_titer_block(worksheet) == _legacy_find_titer_block(worksheet)
+
+
+def test_find_titer_block_empty():
+    assert find_titer_block(Sheet([["a"], ["b"]]))["col_start"] == []
+    assert find_titer_block(Sheet([]))["row_start"] == []
+
+
+def _block_bounds(worksheet, cells=None):
+    titer_block = find_titer_block(worksheet, cells=cells)
+    return {k: titer_block[k][0][0] for k in ["col_start", "col_end", "row_start", "row_end"]}
+
+
+@pytest.mark.parametrize("use_cells", [False, True])
+def test_find_virus_columns_and_serum_rows(use_cells):
+    worksheet = make_titer_sheet(n_viruses=20, n_sera=10, row_offset=6, col_offset=3)
+    cells = classify_cells(worksheet) if use_cells else None
+    bounds = _block_bounds(worksheet, cells)
+
+    virus_block = find_virus_columns(worksheet, **bounds, cells=cells)
+    assert virus_block["virus_col_idx"] == 2
+    assert virus_block["virus_passage_col_idx"] == 13
+    assert virus_block["virus_names"][:2] == ["A/Victoria/100/2022", "A/Sydney/101/2022"]
+
+    serum_block = find_serum_rows(worksheet, **bounds, virus_names=virus_block["virus_names"], cells=cells)
+    assert serum_block["serum_id_row_idx"] == 5
+    assert serum_block["serum_passage_row_idx"] == 4
+    assert serum_block["serum_abbrev_row_idx"] == 3
+    assert serum_block["serum_mapping"]["Syd/101/22"] == "A/Sydney/101/2022"
+    assert len(serum_block["serum_mapping"]) == 10
+
+
+def test_find_serum_rows_custom_source():
+    worksheet = make_titer_sheet(n_viruses=20, n_sera=10, row_offset=6, col_offset=3)
+    PATTERNS["test"] = dict(PATTERNS["vidrl"], serum_id=PATTERNS["vidrl"]["serum_passage"])
+    try:
+        serum_block = find_serum_rows(worksheet, **_block_bounds(worksheet), virus_names=[""] * 20, source="test")
+    finally:
+        del PATTERNS["test"]
+    assert serum_block["serum_id_row_idx"] == 4
+
+
+def test_find_serum_rows_without_abbreviations():
+    worksheet = make_titer_sheet(n_viruses=20, n_sera=10, row_offset=6, col_offset=3)
+    for j in range(3, 13):
+        worksheet.rows[3][j] = ""
+    serum_block = find_serum_rows(worksheet, **_block_bounds(worksheet), virus_names=[])
+    assert serum_block["serum_abbrev_row_idx"] is None
+    assert serum_block["serum_mapping"] == {}
+
+
+def test_find_serum_rows_mapping():
+    worksheet = make_titer_sheet(n_viruses=20, n_sera=10, row_offset=6, col_offset=3)
+    # Sera in another order than the viruses, one of them without a virus row
+    worksheet.rows[3][3:13] = worksheet.rows[3][12:2:-1]
+    worksheet.rows[3][5] = "Bris/7/21"
+    bounds = _block_bounds(worksheet)
+    virus_names = find_virus_columns(worksheet, **bounds)["virus_names"]
+
+    serum_block = find_serum_rows(worksheet, **bounds, virus_names=virus_names)
+    assert serum_block["serum_mapping"]["Syd/101/22"] == "A/Sydney/101/2022"
+    assert serum_block["serum_mapping"]["Auc/106/22"] == "A/Auckland/106/2022"
+    assert "Bris/7/21" not in serum_block["serum_mapping"]
+    assert serum_block["serum_scores"]["Bris/7/21"] == 0.0
+    assert serum_block["serum_scores"]["Syd/101/22"] == 0.9
+
+    catalogue = StrainIndex(["A/Brisbane/7/2021", "A/Sydney/101/2021"])
+    serum_block = find_serum_rows(worksheet, **bounds, virus_names=virus_names, catalogue=catalogue)
+    assert serum_block["serum_mapping"]["Bris/7/21"] == "A/Brisbane/7/2021"
+    assert serum_block["serum_mapping"]["Syd/101/22"] == "A/Sydney/101/2022"
+    assert len(serum_block["serum_mapping"]) == 10
+
+    # Only catalogue strains of the type of the sheet's viruses, and of subtype if given
+    catalogue = StrainIndex(["B/Brisbane/7/2021"]).add(["A/Brisbane/7/2021"], subtype="H3N2")
+    serum_block = find_serum_rows(worksheet, **bounds, virus_names=virus_names, catalogue=catalogue)
+    assert serum_block["serum_mapping"]["Bris/7/21"] == "A/Brisbane/7/2021"
+    serum_block = find_serum_rows(worksheet, **bounds, virus_names=virus_names, catalogue=catalogue, subtype="H1N1")
+    assert "Bris/7/21" not in serum_block["serum_mapping"]
+
+
+def _plates(layout):
+    """Two synthetic plates of different sizes, stacked or side by side in one sheet."""
+    a = make_titer_sheet(n_viruses=12, n_sera=4, seed=1).rows
+    b = make_titer_sheet(n_viruses=8, n_sera=6, seed=2).rows
+    if layout == "stacked":
+        return Sheet(a + b)
+    return Sheet([x + [""] + y for x, y in zip(a, b)] + a[len(b):])
+
+
+@pytest.mark.parametrize(
+    "layout, expected",
+    [
+        ("stacked", [(3, 6, 6, 17), (3, 8, 29, 36)]),
+        ("side_by_side", [(3, 6, 6, 17), (14, 19, 6, 13)]),
+    ],
+)
+def test_find_titer_blocks(layout, expected):
+    worksheet = _plates(layout)
+    blocks = find_titer_blocks(worksheet)
+    assert [(x["col_start"], x["col_end"], x["row_start"], x["row_end"]) for x in blocks] == expected
+    assert [(x["n_titers"], x["confidence"]) for x in blocks] == [(48, 1.0), (48, 1.0)]
+
+    result = analyze_sheet(worksheet)
+    assert [len(x["virus_block"]["virus_names"]) for x in result["blocks"]] == [12, 8]
+    assert [len(x["serum_block"]["serum_mapping"]) for x in result["blocks"]] == [4, 6]
+    records = list(extract_titers(classify_cells(worksheet), result))
+    assert [sum(x["block"] == i for x in records) for i in range(2)] == [48, 48]
+
+
+def test_find_titer_blocks_confidence():
+    worksheet = make_titer_sheet(n_viruses=10, n_sera=4)
+    worksheet.rows[8][4] = ""
+    worksheet.rows[0][7:10] = [1.0, 2.0, 3.0]
+    blocks = find_titer_blocks(worksheet)
+    assert [(x["col_start"], x["row_start"], x["confidence"]) for x in blocks] == [(3, 6, 0.975)]
+    assert find_titer_blocks(worksheet, min_rows=1)[0]["row_start"] == 0
+    assert find_titer_blocks(Sheet([["notes"]])) == []
+
+
+def test_sheet_fingerprint():
+    worksheet = make_titer_sheet()
+    assert sheet_fingerprint(worksheet) == sheet_fingerprint(make_titer_sheet(seed=1))
+    assert sheet_fingerprint(worksheet) == sheet_fingerprint(worksheet, cells=classify_cells(worksheet))
+    assert sheet_fingerprint(worksheet) != sheet_fingerprint(make_titer_sheet(n_viruses=21))
+    assert sheet_fingerprint(worksheet) != sheet_fingerprint(worksheet, source="other")
+
+
+def test_find_annotations_hints():
+    worksheet = make_titer_sheet(n_viruses=20, n_sera=10, row_offset=6, col_offset=3)
+    bounds = _block_bounds(worksheet)
+    expected = find_virus_columns(worksheet, **bounds), find_serum_rows(worksheet, **bounds, virus_names=[""] * 20)
+    # Right, too far, too near and out of range hints give the same result
+    for hints in [
+        {"virus_col_idx": 2, "virus_passage_col_idx": 13, "serum_id_row_idx": 5, "serum_passage_row_idx": 4, "serum_abbrev_row_idx": 3},
+        {"virus_col_idx": 0, "virus_passage_col_idx": 15, "serum_id_row_idx": 0, "serum_passage_row_idx": 1},
+        {"virus_col_idx": 99, "virus_passage_col_idx": 12, "serum_abbrev_row_idx": 5},
+    ]:
+        assert find_virus_columns(worksheet, **bounds, hints=hints) == expected[0]
+        assert find_serum_rows(worksheet, **bounds, virus_names=[""] * 20, hints=hints) == expected[1]
+
+
+def _count_searches(monkeypatch):
+    """Records a call to find_titer_blocks in the returned list each time analyze_sheet searches a sheet for blocks."""
+    searched = []
+
+    def search(*args, **kwargs):
+        searched.append(1)
+        return find_titer_blocks(*args, **kwargs)
+
+    monkeypatch.setattr(titer_block, "find_titer_blocks", search)
+    return searched
+
+
+def test_analyze_sheet_layouts(monkeypatch):
+    worksheets = [make_titer_sheet(seed=seed) for seed in range(3)]
+    # Same fingerprint, but two plates touching only at a corner, which fill every row and column of the block,
+    # a titer right of the block, a new block below it, a block split in two, and a new block in place of as many
+    # stray titers
+    worksheets += [make_titer_sheet(seed=seed) for seed in range(3, 9)]
+    for row in worksheets[3].rows[6:16]:
+        row[8:13] = [""] * 5
+    for row in worksheets[3].rows[16:26]:
+        row[3:8] = [""] * 5
+    worksheets[4].rows[10][13] = 40.0
+    for row in worksheets[5].rows[27:29]:
+        row[5:7] = [10.0, 20.0]
+    for row in worksheets[6].rows[6:26]:
+        row[7] = ""
+    for row_idx, col_idx in [(27, 5), (27, 7), (29, 5), (29, 7)]:
+        worksheets[7].rows[row_idx][col_idx] = 10.0
+    for row in worksheets[8].rows[27:29]:
+        row[5:7] = [10.0, 20.0]
+
+    searched = _count_searches(monkeypatch)
+    layouts = {}
+    results = [analyze_sheet(worksheet, layouts=layouts) for worksheet in worksheets]
+    assert len(searched) == 7
+    assert list(layouts) == [sheet_fingerprint(worksheets[0])]
+    assert [len(x["blocks"]) for x in results] == [1, 1, 1, 2, 1, 2, 2, 1, 2]
+    assert [x["confidence"] for x in results[3]["blocks"]] == [1.0, 1.0]
+    assert results == [analyze_sheet(worksheet) for worksheet in worksheets]
+
+
+class _Workbook:
+    """Stands in for xlrd workbooks, with one synthetic sheet seeded by the length of the file."""
+
+    opened = []
+
+    def __init__(self, path):
+        with open(path) as fh:
+            seed = len(fh.read())
+        self._sheets = [make_titer_sheet(seed=seed, name="HI"), Sheet([["notes"]], name="notes")]
+        _Workbook.opened.append(path)
+
+    def sheets(self):
+        return self._sheets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_analyze_batch(tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(xlrd, "open_workbook", _Workbook)
+    _Workbook.opened = []
+    for i in range(3):
+        (tmp_path / f"plate{i}.xls").write_text("x" * i)
+    cache = str(tmp_path / "cache.json")
+
+    paths = expand_paths([str(tmp_path / "*.xls")])
+    results = analyze_batch(paths, jobs=jobs, cache=cache)
+    assert [x["file"] for x in results] == paths
+    assert [x["sheet"] for x in results[0]["sheets"]] == ["HI", "notes"]
+    assert results[0]["sheets"][0]["bounds"] == {"col_start": 3, "col_end": 12, "row_start": 6, "row_end": 25}
+    assert results[0]["sheets"][1]["bounds"] is None
+
+    # Only the changed file is parsed again, and every file is hashed once
+    _Workbook.opened = []
+    (tmp_path / "plate1.xls").write_text("changed")
+    hashed = []
+    file_sha256 = titer_block.file_sha256
+    monkeypatch.setattr(titer_block, "file_sha256", lambda path: hashed.append(path) or file_sha256(path))
+    rerun = analyze_batch(paths, jobs=1, cache=cache)
+    assert _Workbook.opened == [str(tmp_path / "plate1.xls")]
+    assert hashed == paths
+    assert rerun[0] == results[0]
+
+    write_results(rerun, str(tmp_path / "results.json"))
+    assert json.load(open(tmp_path / "results.json")) == rerun
+    write_results(rerun, str(tmp_path / "results.tsv"))
+    lines = open(tmp_path / "results.tsv").read().splitlines()
+    assert len(lines) == 1 + 3 * 2
+    assert lines[1].split("\t")[2:5] == ["HI", "", "3"]
+
+
+def test_analyze_batch_layouts(tmp_path, monkeypatch):
+    monkeypatch.setattr(xlrd, "open_workbook", _Workbook)
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f"plate{i}.xls"))
+        open(paths[-1], "w").write("x" * i)
+    layouts = str(tmp_path / "layouts.json")
+    expected = analyze_batch(paths)
+
+    searched = _count_searches(monkeypatch)
+    assert analyze_batch(paths, layouts=layouts) == expected
+    # The HI and notes sheets of the first file, those of the others match their layouts
+    assert len(searched) == 2
+    assert len(json.load(open(layouts))) == 2
+
+    # The layouts persist across runs
+    searched.clear()
+    assert extract_batch(paths, str(tmp_path / "titers.tsv"), layouts=layouts) == expected
+    assert searched == []
+
+
+def test_analyze_batch_error(tmp_path):
+    (tmp_path / "broken.xls").write_text("not a workbook")
+    results = analyze_batch([str(tmp_path / "broken.xls")], cache=str(tmp_path / "cache.json"))
+    assert results[0]["sheets"] is None
+    assert results[0]["error"].startswith("XLRDError")
+    assert json.load(open(tmp_path / "cache.json")) == {}
+
+
+def test_format_titer():
+    assert format_titer(80.0, 80.0) == "80"
+    assert format_titer("<10", 10.0) == "< 10"
+    assert format_titer(" < 10 ", 10.0) == "< 10"
+    assert format_titer(12.5, 12.5) == "12.5"
+
+
+def test_extract_titers():
+    worksheet = make_titer_sheet(n_viruses=12, n_sera=4)
+    worksheet.rows[8][5] = ""
+    cells = classify_cells(worksheet)
+    records = list(extract_titers(cells, analyze_sheet(worksheet, cells=cells), file="plate.xls"))
+    assert len(records) == 12 * 4 - 1
+    assert all(list(x) == TITER_COLUMNS for x in records)
+    assert records[0]["file"] == "plate.xls"
+    assert records[0]["virus"] == "A/Victoria/100/2022"
+    assert records[0]["virus_passage"] == worksheet.rows[6][7]
+    assert records[1]["serum_abbrev"] == "Syd/101/22"
+    assert records[1]["serum"] == "A/Sydney/101/2022"
+    assert records[1]["serum_score"] == 0.9
+    assert records[1]["serum_id"] == worksheet.rows[5][4]
+    assert records[1]["serum_passage"] == worksheet.rows[4][4]
+    assert [x["titer"] for x in records[:4]] == [format_titer(x, t) for x, t in zip(worksheet.rows[6][3:7], cells["titers"][6, 3:7])]
+
+    assert list(extract_titers(classify_cells(Sheet([["notes"]])), analyze_sheet(Sheet([["notes"]])))) == []
+
+
+@pytest.mark.parametrize("ext", [".tsv", ".parquet"])
+def test_extract_batch(tmp_path, monkeypatch, ext):
+    if ext == ".parquet":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(xlrd, "open_workbook", lambda path: _Workbook(path) if "plate" in path else 1 / 0)
+    _Workbook.opened = []
+    paths = [str(tmp_path / x) for x in ["plate0.xls", "plate1.xls", "broken.xls"]]
+    for i, path in enumerate(paths):
+        open(path, "w").write("x" * i)
+
+    titers = str(tmp_path / f"titers{ext}")
+    results = extract_batch(paths, titers)
+    # Each workbook is opened once for both the analysis and the extraction
+    assert _Workbook.opened == paths[:2]
+    assert [x["sheets"] for x in results[:2]] == [x["sheets"] for x in analyze_batch(paths[:2])]
+    assert results[2]["error"].startswith("ZeroDivisionError")
+
+    if ext == ".parquet":
+        import pyarrow.parquet
+
+        rows = pyarrow.parquet.read_table(titers).to_pylist()
+    else:
+        with open(titers) as fh:
+            rows = list(csv.DictReader(fh, delimiter="\t"))
+    assert len(rows) == 2 * 20 * 10
+    assert {str(x["block"]) for x in rows} == {"0"}
+    assert [rows[0]["file"], rows[-1]["file"]] == paths[:2]
+    assert rows[0]["titer"] in {format_titer(x, float(str(x).strip("< "))) for x in TITERS}
+
+
+def test_write_titers_empty(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    write_titers(iter([]), str(tmp_path / "titers.parquet"), batch_size=2)
+    assert pyarrow.parquet.read_table(str(tmp_path / "titers.parquet")).column_names == TITER_COLUMNS
+
+
+def _write_xlsx(path, worksheets):
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for worksheet in worksheets:
+        sheet = workbook.create_sheet(worksheet.name)
+        for row in worksheet.rows:
+            sheet.append([None if x == "" else x for x in row])
+    workbook.save(path)
+
+
+def test_open_workbook_xlsx(tmp_path):
+    worksheet = make_titer_sheet(name="HI")
+    worksheet.rows[7][4] = 40  # integers are read as floats, as by xlrd
+    path = str(tmp_path / "plate.xlsx")
+    _write_xlsx(path, [worksheet, Sheet([["notes"]], name="notes")])
+
+    with open_workbook(path) as workbook:
+        sheets = workbook.sheets()
+        sheet = next(sheets)
+        assert (sheet.name, sheet.nrows, sheet.ncols) == ("HI", worksheet.nrows, worksheet.ncols)
+        # Rows are only read up to the last one asked for
+        assert sheet.cell_value(7, 4) == 40.0 and len(sheet._rows) == 8
+        expected = analyze_sheet(worksheet)
+        assert analyze_sheet(sheet) == expected
+        assert next(sheets).row_values(0) == ["notes"]
+
+    assert [x["sheets"][0] for x in analyze_batch([path])] == [expected]
+
+
+@pytest.mark.parametrize("option", [["--jobs", "2"], ["--cache", "cache.json"]])
+def test_main_titers_rejects_batch_options(monkeypatch, option):
+    monkeypatch.setattr(sys, "argv", ["titer_block.py", "--files", "*.xls", "--titers", "titers.tsv"] + option)
+    with pytest.raises(ValueError, match="--titers"):
+        main()
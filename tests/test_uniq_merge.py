@@ -1,8 +1,307 @@
 #! /usr/bin/env python3
 
+import math
+import random
+import sys
+
+import numpy as np
+import pandas as pd
 import pytest
-import ./..buildings.uniq_merge
 
-def test_merge_two():
-    man = 1
-    assert man == 1
\ No newline at end of file
+from buildings.uniq_merge import (
+    _drop_uninformative_cols,
+    _encode_categories,
+    _from_ipc,
+    _read_cache_index,
+    _resolve_conflicts,
+    _to_ipc,
+    build_cache_index,
+    main,
+    merge_incremental,
+    merge_many,
+    merge_streaming,
+    merge_two,
+    profile_columns,
+    read_table,
+    write_excel,
+    write_table,
+)
+
+
+def _legacy_merge(df1, df2, groupby_col, conflict_resolution):
+    """Per cell groupby/agg path that merge_two used before the columnar engine."""
+    return pd.concat([df1, df2]).groupby(groupby_col).agg(
+        lambda x: _resolve_conflicts(x, conflict_resolution)
+    )
+
+
+def _random_df(rng, n_rows, cols):
+    pool = ["a", "b", "c", "a,b", "", "-N/A-", "?", np.nan]
+    data = {"strain": [f"s{rng.randrange(n_rows)}" for _ in range(n_rows)]}
+    for col in cols:
+        data[col] = [rng.choice(pool) for _ in range(n_rows)]
+    return pd.DataFrame(data)
+
+
+@pytest.fixture
+def one_two():
+    one = pd.read_csv("tests/one.tsv", sep="\t", header=0, dtype=str)
+    two = pd.read_csv("tests/two.tsv", sep="\t", header=0, dtype=str)
+    return one, two
+
+
+def test_merge_two(one_two):
+    merged = merge_two(*one_two)
+    assert merged.columns.tolist() == ["date", "clade", "geo", "patient"]
+    assert merged.index.tolist() == ["A", "B", "C", "D"]
+    assert merged.loc["B", "clade"] == "beta,beta2"
+    assert merged.loc["C", "geo"] == ""
+    assert merged.loc["D", "patient"] == "bob"
+
+
+@pytest.mark.parametrize("resolution, expected", [("left", "beta"), ("right", "beta2")])
+def test_merge_two_left_right(one_two, resolution, expected):
+    merged = merge_two(*one_two, conflict_resolution=resolution)
+    assert merged.loc["B", "clade"] == expected
+
+
+@pytest.mark.parametrize("resolution", ["left", "right", "join"])
+def test_merge_two_matches_legacy(resolution):
+    rng = random.Random(0)
+    df1 = _random_df(rng, 200, ["x", "y", "z"])
+    df2 = _random_df(rng, 150, ["y", "z", "w"])
+    cols = df1.columns.tolist() + ["w"]
+    expected = _legacy_merge(
+        df1.reindex(cols, axis=1), df2.reindex(cols, axis=1), "strain", resolution
+    )
+    merged = merge_two(df1, df2, conflict_resolution=resolution)
+    pd.testing.assert_frame_equal(merged, expected, check_dtype=False)
+    assert not any(isinstance(x, pd.CategoricalDtype) for x in merged.dtypes)
+
+
+def test_encode_categories():
+    df = pd.DataFrame(
+        {
+            "strain": ["A", "B", "A", "C"],
+            "clade": ["x", "-N/A-", "x", np.nan],
+            "note": ["n1", "n2", "n3", "n4"],
+        }
+    )
+    encoded = _encode_categories(df, "strain")
+    assert isinstance(encoded["strain"].dtype, pd.CategoricalDtype)
+    assert encoded["strain"].cat.codes.tolist() == [0, 1, 0, 2]
+    # Sentinels are coded as missing values
+    assert encoded["clade"].isna().tolist() == [False, True, False, True]
+    # High cardinality columns are kept as they are
+    assert encoded["note"].dtype == df["note"].dtype
+
+
+def test_profile_columns():
+    df = pd.DataFrame(
+        {
+            "strain": ["A", "B", "C"],
+            "clade": ["x", "-N/A-", np.nan],
+            "age": ["-N/A-", "", "?"],
+            "empty": [np.nan] * 3,
+        }
+    )
+    before = df.copy()
+    profile = profile_columns(df)
+    pd.testing.assert_frame_equal(df, before)
+    assert profile["non_null"].tolist() == [3, 2, 3, 0]
+    assert profile["sentinels"].tolist() == [0, 1, 3, 0]
+    assert profile["informative"].tolist() == [True, True, False, False]
+    assert profile_columns(df, sentinels=["-N/A-"])["informative"].tolist() == [True, True, True, False]
+
+
+def test_merge_two_sentinels(one_two):
+    merged = merge_two(*one_two, sentinels=["-N/A-", "beta2"])
+    assert merged.loc["B", "clade"] == "beta"
+    # Only NA and sentinels, dropped
+    one, two = one_two
+    assert "age" not in merge_two(one.assign(age="unknown"), two, sentinels=["unknown"]).columns
+    assert merge_two(one.assign(age="?"), two, sentinels=[]).loc["A", "age"] == "?"
+
+
+def test_merge_two_conflicts(one_two):
+    merged, conflicts = merge_two(*one_two, conflicts=True)
+    pd.testing.assert_frame_equal(merged, merge_two(*one_two))
+    assert conflicts.columns.tolist() == ["strain", "column", "value", "source"]
+    assert conflicts.values.tolist() == [["B", "clade", "beta", 0], ["B", "clade", "beta2", 1]]
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_merge_many_conflicts(jobs):
+    rng = random.Random(6)
+    frames = [_random_df(rng, 200, ["x", "y"]), _random_df(rng, 200, ["y", "z"]), _random_df(rng, 200, ["x"])]
+    merged, conflicts = merge_many(frames, conflict_resolution="left", jobs=jobs, conflicts=True)
+    pd.testing.assert_frame_equal(
+        merged, merge_many(frames, conflict_resolution="left"), check_dtype=False, check_index_type=False
+    )
+
+    # Same as listing the distinct values of each cell across the inputs
+    long = pd.concat(
+        [x.assign(source=i).melt(["strain", "source"], var_name="column") for i, x in enumerate(frames)]
+    )
+    long = long[~long["value"].isin(["", "-N/A-", "?"]) & long["value"].notna()]
+    n_values = long.groupby(["strain", "column"])["value"].transform("nunique")
+    expected = long[n_values > 1].drop_duplicates()[["strain", "column", "value", "source"]]
+    key = ["strain", "column", "value", "source"]
+    pd.testing.assert_frame_equal(
+        conflicts.sort_values(key).reset_index(drop=True),
+        expected.sort_values(key).reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def _unique_df(rng, n_rows, cols):
+    return _random_df(rng, n_rows, cols).drop_duplicates("strain")
+
+
+@pytest.mark.parametrize("resolution", ["left", "right", "join"])
+def test_merge_many_matches_chained_merge_two(resolution):
+    rng = random.Random(3)
+    frames = [_unique_df(rng, 100, ["x", "y"]), _unique_df(rng, 100, ["y", "z"]), _unique_df(rng, 100, ["w", "x"])]
+    chained = merge_two(
+        merge_two(frames[0], frames[1], conflict_resolution=resolution).reset_index(),
+        frames[2],
+        conflict_resolution=resolution,
+    )
+    merged = merge_many(frames, conflict_resolution=resolution)
+    pd.testing.assert_frame_equal(merged, chained, check_dtype=False)
+    pd.testing.assert_frame_equal(
+        merge_many(frames[:2], conflict_resolution=resolution),
+        merge_two(frames[0], frames[1], conflict_resolution=resolution),
+    )
+
+
+def test_merge_many_precedence():
+    frames = [pd.DataFrame({"strain": ["A"], "clade": [clade]}) for clade in ["x", "y", "x"]]
+    assert merge_many(frames, conflict_resolution="left").loc["A", "clade"] == "x"
+    assert merge_many(frames, conflict_resolution="right").loc["A", "clade"] == "x"
+    assert merge_many(frames[:2], conflict_resolution="right").loc["A", "clade"] == "y"
+
+
+@pytest.mark.parametrize("resolution", ["left", "right", "join"])
+def test_merge_parallel_matches_serial(resolution):
+    rng = random.Random(4)
+    frames = [_random_df(rng, 300, ["x", "y"]), _random_df(rng, 300, ["y", "z"]), _random_df(rng, 300, ["w"])]
+    serial = [merge_two(*frames[:2], conflict_resolution=resolution), merge_many(frames, conflict_resolution=resolution)]
+    parallel = [
+        merge_two(*frames[:2], conflict_resolution=resolution, jobs=3),
+        merge_many(frames, conflict_resolution=resolution, jobs=3),
+    ]
+    for expected, merged in zip(serial, parallel):
+        pd.testing.assert_frame_equal(merged, expected, check_dtype=False, check_index_type=False)
+
+
+@pytest.mark.parametrize("resolution", ["left", "right", "join"])
+def test_merge_incremental_matches_full(tmp_path, resolution):
+    rng = random.Random(1)
+    cache = merge_two(
+        _random_df(rng, 300, ["x", "y"]), _random_df(rng, 300, ["y", "z"]), conflict_resolution="left"
+    )
+    cache_file = str(tmp_path / "cache.tsv")
+    cache.to_csv(cache_file, sep="\t")
+    new = _random_df(rng, 40, ["z", "w"]).replace({"strain": {"s1": "zzz"}})
+
+    # The output can be the cache of the next run
+    for step in range(2):
+        outfile = str(tmp_path / f"out{step}.tsv")
+        merge_incremental(cache_file, new, outfile, conflict_resolution=resolution)
+
+        full_file = str(tmp_path / f"full{step}.tsv")
+        cache_df = pd.read_csv(cache_file, sep="\t", header=0, dtype=str)
+        merge_two(cache_df, new, conflict_resolution=resolution).to_csv(full_file, sep="\t")
+        assert open(outfile).read() == open(full_file).read()
+        pd.testing.assert_frame_equal(_read_cache_index(outfile), build_cache_index(outfile))
+        cache_file = outfile
+
+
+def test_build_cache_index_unsorted(tmp_path):
+    cache_file = tmp_path / "cache.tsv"
+    cache_file.write_text("strain\tx\nB\t1\nA\t2\n")
+    with pytest.raises(ValueError):
+        build_cache_index(str(cache_file))
+
+
+@pytest.mark.parametrize("resolution", ["left", "right", "join"])
+@pytest.mark.parametrize("max_memory", [1, 0.1])
+def test_merge_streaming_matches_full(tmp_path, resolution, max_memory):
+    rng = random.Random(2)
+    df1 = _random_df(rng, 3000, ["x", "y", "z"])
+    df2 = _random_df(rng, 2000, ["y", "z", "w"])
+    df2["empty"] = "-N/A-"
+    cache_file, new_file = str(tmp_path / "cache.tsv"), str(tmp_path / "new.tsv")
+    df1.to_csv(cache_file, sep="\t", index=False)
+    df2.to_csv(new_file, sep=",", index=False)
+
+    outfile = str(tmp_path / "out.tsv")
+    merge_streaming(
+        cache_file, new_file, outfile, conflict_resolution=resolution, new_delim=",", max_memory=max_memory
+    )
+
+    full_file = str(tmp_path / "full.tsv")
+    merge_two(
+        pd.read_csv(cache_file, sep="\t", header=0, dtype=str),
+        pd.read_csv(new_file, sep=",", header=0, dtype=str),
+        conflict_resolution=resolution,
+    ).to_csv(full_file, sep="\t")
+    assert open(outfile).read() == open(full_file).read()
+
+
+@pytest.mark.parametrize("ext", [".tsv", ".parquet", ".feather"])
+def test_write_read_table(tmp_path, one_two, ext):
+    pytest.importorskip("pyarrow")
+    merged = merge_two(*one_two)
+    path = str(tmp_path / f"merged{ext}")
+    write_table(merged, path)
+    pd.testing.assert_frame_equal(
+        read_table(path).set_index("strain").fillna(""), merged, check_dtype=False, check_index_type=False
+    )
+
+
+def test_write_excel(tmp_path, one_two):
+    pytest.importorskip("openpyxl")
+    merged = merge_two(*one_two)
+    path = str(tmp_path / "merged.xlsx")
+    assert write_excel(merged, path) == 1
+    pd.testing.assert_frame_equal(
+        pd.read_excel(path, dtype=str).set_index("strain").fillna(""), merged.fillna(""), check_dtype=False, check_index_type=False
+    )
+
+    # Rows past max_rows continue on new sheets, each with the header
+    rng = random.Random(4)
+    merged = merge_two(_random_df(rng, 300, ["x", "y"]), _random_df(rng, 300, ["y", "z"]))
+    assert write_excel(merged, path, max_rows=101, batch=7) == math.ceil(len(merged) / 100)
+    sheets = pd.read_excel(path, sheet_name=None, dtype=str)
+    assert list(sheets) == [f"Sheet{i + 1}" for i in range(len(sheets))]
+    assert all(len(x) == 100 for x in list(sheets.values())[:-1])
+    pd.testing.assert_frame_equal(
+        pd.concat(sheets.values(), ignore_index=True).set_index("strain").fillna(""),
+        merged.fillna(""),
+        check_dtype=False,
+        check_index_type=False,
+    )
+
+
+def test_main_excel(tmp_path, monkeypatch):
+    pytest.importorskip("openpyxl")
+    outfile, outfile_excel = str(tmp_path / "merged.tsv"), str(tmp_path / "merged.xlsx")
+    argv = ["uniq_merge.py", "--cache", "tests/one.tsv", "--new", "tests/two.tsv", "--outfile", outfile]
+    monkeypatch.setattr(sys, "argv", argv + ["--outfile_excel", outfile_excel])
+    main()
+    pd.testing.assert_frame_equal(
+        pd.read_excel(outfile_excel, dtype=str).fillna(""),
+        pd.read_csv(outfile, sep="\t", header=0, dtype=str).fillna(""),
+    )
+
+
+def test_to_ipc_drops_unused_categories(one_two):
+    pytest.importorskip("pyarrow")
+    df = _encode_categories(_drop_uninformative_cols(pd.concat(one_two)), "strain")
+    part = _from_ipc(_to_ipc(df[df["strain"] == "B"]))
+    assert list(part["strain"].cat.categories) == ["B"]
+    pd.testing.assert_frame_equal(
+        part.astype(object), df[df["strain"] == "B"].astype(object).reset_index(drop=True), check_index_type=False
+    )